@@ -0,0 +1,43 @@
+from datetime import datetime, time, timedelta
+from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from .forms import DashboardForm
+from .models import RollupWatermark, SalesRollup
+from .rollups import WATERMARK, dashboard
+
+
+@admin.register(SalesRollup)
+class SalesRollupAdmin(admin.ModelAdmin):
+    """لوحة المبيعات بدلاً من قائمة الملخصات؛ تقرأ الملخصات المحسوبة مسبقاً فقط"""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        form = DashboardForm(request.GET)
+        data = top = None
+        if form.is_valid():
+            start = timezone.make_aware(datetime.combine(form.cleaned_data['date_from'], time.min))
+            end = timezone.make_aware(datetime.combine(form.cleaned_data['date_to'] + timedelta(days=1), time.min))
+            data = dashboard(start, end, period=form.cleaned_data['period'])
+            top = [(label, data.top[dimension]) for dimension, label in SalesRollup.DIMENSION_CHOICES[1:]]
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': _('لوحة المبيعات'),
+            'opts': self.model._meta,
+            'form': form,
+            'data': data,
+            'top': top,
+            'watermark': RollupWatermark.objects.filter(name=WATERMARK).values_list('value', flat=True).first(),
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, 'admin/analytics/dashboard.html', context)
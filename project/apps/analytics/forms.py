@@ -0,0 +1,26 @@
+from datetime import timedelta
+from django import forms
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from .models import SalesRollup
+
+
+class DashboardForm(forms.Form):
+    """مدى لوحة المبيعات (أيام شاملة) ودقة السلسلة الزمنية"""
+    date_from = forms.DateField(label=_('من'), required=False)
+    date_to = forms.DateField(label=_('إلى'), required=False)
+    period = forms.ChoiceField(label=_('الفترة'), choices=SalesRollup.PERIOD_CHOICES, required=False)
+
+    # أطول مدى للعرض الساعي
+    MAX_HOURLY_DAYS = 7
+
+    def clean(self):
+        data = super().clean()
+        data['date_to'] = data.get('date_to') or timezone.localdate()
+        data['date_from'] = data.get('date_from') or data['date_to'] - timedelta(days=29)
+        data['period'] = data.get('period') or 'day'
+        if data['date_from'] > data['date_to']:
+            raise forms.ValidationError(_('تاريخ البداية بعد تاريخ النهاية'))
+        if data['period'] == 'hour' and (data['date_to'] - data['date_from']).days >= self.MAX_HOURLY_DAYS:
+            raise forms.ValidationError(_('العرض الساعي متاح لسبعة أيام على الأكثر'))
+        return data
@@ -0,0 +1,68 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class SalesRollup(models.Model):
+    """
+    جدول حقائق المبيعات المحسوبة مسبقاً لكل ساعة ويوم حسب البعد (الإجمالي أو منتج أو فئة
+    أو علامة تجارية أو كوبون أو طريقة دفع). لوحة التحليلات تقرأ منه فقط، ويُحدّث تدريجياً (انظر rollups).
+    """
+    PERIOD_CHOICES = [
+        ('hour', _('ساعة')),
+        ('day', _('يوم')),
+    ]
+
+    DIMENSION_CHOICES = [
+        ('total', _('الإجمالي')),
+        ('product', _('المنتج')),
+        ('category', _('الفئة')),
+        ('brand', _('العلامة التجارية')),
+        ('coupon', _('الكوبون')),
+        ('payment_method', _('طريقة الدفع')),
+    ]
+
+    period = models.CharField(_('الفترة'), max_length=10, choices=PERIOD_CHOICES)
+    period_start = models.DateTimeField(_('بداية الفترة'))
+    dimension = models.CharField(_('البعد'), max_length=20, choices=DIMENSION_CHOICES)
+    # معرف قيمة البعد (فارغ للإجمالي) واسمها وقت الحساب
+    key = models.CharField(_('المفتاح'), max_length=100, blank=True)
+    label = models.CharField(_('الاسم'), max_length=255, blank=True)
+
+    orders = models.PositiveIntegerField(_('الطلبات'), default=0)
+    units = models.PositiveIntegerField(_('الوحدات'), default=0)
+    revenue = models.DecimalField(_('الإيرادات'), max_digits=14, decimal_places=2, default=0)
+    refunds = models.DecimalField(_('المبالغ المستردة'), max_digits=14, decimal_places=2, default=0)
+
+    updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('ملخص المبيعات')
+        verbose_name_plural = _('ملخصات المبيعات')
+        ordering = ['-period_start']
+        constraints = [
+            # يخدم أيضاً استعلامات اللوحة (الفترة والبعد ومدى التاريخ)
+            models.UniqueConstraint(
+                fields=['period', 'dimension', 'period_start', 'key'], name='unique_sales_rollup'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_dimension_display()} {self.label or self.key} - {self.period_start:%Y-%m-%d %H:%M}"
+
+    @property
+    def average_order_value(self):
+        return self.revenue / self.orders if self.orders else 0
+
+
+class RollupWatermark(models.Model):
+    """آخر وقت حُدّثت حتى الملخصات من تعديلات الطلبات"""
+    name = models.CharField(_('الاسم'), max_length=50, unique=True)
+    value = models.DateTimeField(_('القيمة'), null=True, blank=True)
+    updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('علامة التحديث')
+        verbose_name_plural = _('علامات التحديث')
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
@@ -0,0 +1,251 @@
+"""
+ملخصات المبيعات المحسوبة مسبقاً
+
+كل ساعة لها صفوف في SalesRollup لكل بعد: الطلبات والوحدات والإيرادات والمبالغ المستردة
+للطلبات المؤكدة التي أنشئت فيها، ومتوسط قيمة الطلب يشتق منها. الأيام تجمع من ساعاتها.
+
+التحديث تدريجي: الطلبات المعدلة بعد آخر علامة (updated_at، مع هامش تداخل للمعاملات المتأخرة)
+تحدد الساعات المتأثرة، فتعاد كل ساعة منها كاملة من المصدر ثم أيامها من الساعات.
+إعادة الحساب كاملة للفترة تجعل التحديث متكرر الأثر، فالتداخل وإعادة التشغيل آمنان.
+اللوحة تقرأ الملخصات فقط بمدى على فهرس (الفترة، البعد، بداية الفترة)، فلا يتأثر زمنها بحجم سجل الطلبات.
+"""
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Sum, Value, When
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from apps.orders.models import Order, OrderItem
+from .models import RollupWatermark, SalesRollup
+
+
+# الطلبات التي تحتسب مبيعات: تأكدت (حتى لو استردت لاحقاً، والمسترد يظهر في refunds)
+SALES_STATUSES = ('confirmed', 'processing', 'shipped', 'delivered', 'refunded')
+
+WATERMARK = 'sales'
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+CENT = Decimal('0.01')
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+# الأبعاد على مستوى الطلب: (مسار المفتاح من الطلب، مسار الاسم)؛ الوحدات تجمع من العناصر بالمسار نفسه بعد order__
+ORDER_DIMENSIONS = {
+    'total': (None, None),
+    'payment_method': ('payment_method', 'payment_method'),
+    'coupon': ('coupon_usages__coupon_id', 'coupon_usages__coupon__code'),
+}
+
+# الأبعاد على مستوى العنصر: الإيرادات صافي العنصر بعد نصيبه من الخصم، والمسترد موزع بنسبة العنصر من الطلب
+ITEM_DIMENSIONS = {
+    'product': ('product_id', 'product_name'),
+    'category': ('product__category_id', 'product__category__name'),
+    'brand': ('product__brand_id', 'product__brand__name'),
+}
+
+RefreshResult = namedtuple('RefreshResult', 'hours days')
+
+DashboardData = namedtuple('DashboardData', 'totals series top')
+
+
+def _sold_orders(start, end):
+    return Order.objects.filter(created_at__gte=start, created_at__lt=end, status__in=SALES_STATUSES)
+
+
+def _sold_items(start, end):
+    return OrderItem.objects.filter(
+        order__created_at__gte=start, order__created_at__lt=end, order__status__in=SALES_STATUSES
+    )
+
+
+def _fact(facts, hour, dimension, key, label=''):
+    return facts.setdefault((hour, dimension, '' if key is None else str(key)), {
+        'label': label or '', 'orders': 0, 'units': 0, 'revenue': Decimal(0), 'refunds': Decimal(0),
+    })
+
+
+def aggregate_hours(start, end):
+    """حقائق الساعات بين start و end من الطلبات: {(الساعة، البعد، المفتاح): القيم}"""
+    facts = {}
+    orders = _sold_orders(start, end).annotate(hour=TruncHour('created_at')).order_by()
+    items = _sold_items(start, end).annotate(hour=TruncHour('order__created_at')).order_by()
+
+    for dimension, (key_path, label_path) in ORDER_DIMENSIONS.items():
+        dimension_orders, dimension_items, fields = orders, items, ['hour']
+        if key_path:
+            # التصفية قبل التجميع كي تستخدم العلاقة نفسها
+            dimension_orders = orders.filter(**{f'{key_path}__isnull': False})
+            dimension_items = items.filter(**{f'order__{key_path}__isnull': False})
+            fields.append(key_path)
+        rows = dimension_orders.values(*fields).annotate(
+            count=Count('pk', distinct=True), revenue_sum=Sum('total'), refunds_sum=Sum('amount_refunded'),
+            name=Max(label_path) if label_path else Value(''),
+        )
+        for row in rows:
+            _fact(facts, row['hour'], dimension, row.get(key_path), row['name']).update(
+                orders=row['count'], revenue=row['revenue_sum'] or 0, refunds=row['refunds_sum'] or 0,
+            )
+
+        item_fields = ['hour'] + ([f'order__{key_path}'] if key_path else [])
+        for row in dimension_items.values(*item_fields).annotate(quantity=Sum('quantity')):
+            key = row.get(f'order__{key_path}') if key_path else None
+            _fact(facts, row['hour'], dimension, key)['units'] = row['quantity'] or 0
+
+    refunded_share = Case(
+        When(order__subtotal__gt=0, then=F('total') * F('order__amount_refunded') / F('order__subtotal')),
+        default=Value(0), output_field=MONEY,
+    )
+    for dimension, (key_path, label_path) in ITEM_DIMENSIONS.items():
+        rows = items.filter(**{f'{key_path}__isnull': False}).values('hour', key_path).annotate(
+            count=Count('order', distinct=True), quantity=Sum('quantity'),
+            revenue_sum=Sum(F('total') - F('discount'), output_field=MONEY),
+            refunds_sum=Sum(refunded_share), name=Max(label_path),
+        )
+        for row in rows:
+            _fact(facts, row['hour'], dimension, row[key_path], row['name']).update(
+                orders=row['count'], units=row['quantity'] or 0,
+                revenue=row['revenue_sum'] or 0, refunds=row['refunds_sum'] or 0,
+            )
+    return facts
+
+
+def _groups(moments, span):
+    """تقسيم الأوقات المرتبة إلى مجموعات لا يتجاوز مداها span، كل منها بمدى استعلام واحد"""
+    group = []
+    for moment in sorted(moments):
+        if group and moment - group[0] >= span:
+            yield group
+            group = []
+        group.append(moment)
+    if group:
+        yield group
+
+
+def _rollup(period, period_start, dimension, key, values):
+    return SalesRollup(
+        period=period, period_start=period_start, dimension=dimension, key=key,
+        label=(values['label'] or '')[:255], orders=values['orders'], units=values['units'],
+        revenue=Decimal(values['revenue']).quantize(CENT), refunds=Decimal(values['refunds']).quantize(CENT),
+    )
+
+
+def rebuild_hours(hours):
+    """إعادة حساب ملخصات الساعات من الطلبات، ثم ملخصات أيامها من الساعات. يعيد عدد الأيام"""
+    days = set()
+    for group in _groups(hours, DAY):
+        facts = aggregate_hours(group[0], group[-1] + HOUR)
+        wanted = set(group)
+        with transaction.atomic():
+            SalesRollup.objects.filter(period='hour', period_start__in=group).delete()
+            SalesRollup.objects.bulk_create([
+                _rollup('hour', hour, dimension, key, values)
+                for (hour, dimension, key), values in facts.items() if hour in wanted
+            ], batch_size=1000)
+        days.update(_day_start(hour) for hour in group)
+    rebuild_days(days)
+    return len(days)
+
+
+def _day_start(moment):
+    local = timezone.localtime(moment)
+    return timezone.make_aware(datetime.combine(local.date(), time.min))
+
+
+def rebuild_days(days):
+    """ملخصات الأيام بجمع ساعاتها (كل طلب في ساعة واحدة، فجمع أعداد الطلبات دقيق)"""
+    for group in _groups(days, 31 * DAY):
+        wanted = set(group)
+        rows = SalesRollup.objects.filter(
+            period='hour', period_start__gte=group[0], period_start__lt=group[-1] + DAY
+        ).annotate(day=TruncDay('period_start')).values('day', 'dimension', 'key').annotate(
+            name=Max('label'), orders_sum=Sum('orders'), units_sum=Sum('units'),
+            revenue_sum=Sum('revenue'), refunds_sum=Sum('refunds'),
+        ).order_by()
+        with transaction.atomic():
+            SalesRollup.objects.filter(period='day', period_start__in=group).delete()
+            SalesRollup.objects.bulk_create([
+                _rollup('day', row['day'], row['dimension'], row['key'], {
+                    'label': row['name'], 'orders': row['orders_sum'], 'units': row['units_sum'],
+                    'revenue': row['revenue_sum'], 'refunds': row['refunds_sum'],
+                })
+                for row in rows if row['day'] in wanted
+            ], batch_size=1000)
+
+
+def changed_hours(since=None):
+    """ساعات إنشاء الطلبات المعدلة منذ since (أو كل الساعات)، مع هامش التداخل"""
+    orders = Order.objects.all()
+    if since is not None:
+        orders = orders.filter(updated_at__gte=since - timedelta(seconds=settings.SALES_ROLLUP_OVERLAP))
+    return set(orders.annotate(hour=TruncHour('created_at')).order_by().values_list('hour', flat=True).distinct())
+
+
+def refresh_rollups():
+    """
+    تحديث الملخصات من آخر علامة: قفل العلامة يمنع تحديثين متزامنين، والعلامة الجديدة
+    هي وقت بدء التحديث كي لا يفوت ما عُدل أثناءه
+    """
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK)
+        started = timezone.now()
+        hours = changed_hours(watermark.value)
+        days = rebuild_hours(hours)
+        watermark.value = started
+        watermark.save()
+    return RefreshResult(len(hours), days)._asdict()
+
+
+def backfill_rollups(date_from, date_to, progress=None):
+    """
+    إعادة بناء ملخصات الأيام بين التاريخين (شاملين) من الطلبات يوماً يوماً، مع حذف ملخصات الساعات
+    التي لم يعد فيها طلبات. progress(day, hours) تستدعى بعد كل يوم
+    """
+    day = date_from
+    total = 0
+    while day <= date_to:
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        end = start + DAY
+        hours = set(Order.objects.filter(created_at__gte=start, created_at__lt=end).annotate(
+            hour=TruncHour('created_at')
+        ).order_by().values_list('hour', flat=True).distinct())
+        with transaction.atomic():
+            SalesRollup.objects.filter(period_start__gte=start, period_start__lt=end).delete()
+            rebuild_hours(hours)
+        total += len(hours)
+        if progress:
+            progress(day, len(hours))
+        day += timedelta(days=1)
+    return total
+
+
+def dashboard(start, end, period='day', top=10):
+    """
+    بيانات لوحة المبيعات بين start و end من الملخصات فقط: الإجماليات، والسلسلة الزمنية،
+    وأعلى قيم كل بعد بالإيرادات
+    """
+    rollups = SalesRollup.objects.filter(period=period, period_start__gte=start, period_start__lt=end)
+    series = list(
+        rollups.filter(dimension='total').order_by('period_start')
+        .values('period_start', 'orders', 'units', 'revenue', 'refunds')
+    )
+    totals = {
+        field: sum((row[field] for row in series), Decimal(0) if field in ('revenue', 'refunds') else 0)
+        for field in ('orders', 'units', 'revenue', 'refunds')
+    }
+    totals['average_order_value'] = (totals['revenue'] / totals['orders']).quantize(CENT) if totals['orders'] else 0
+    for row in series:
+        row['average_order_value'] = (row['revenue'] / row['orders']).quantize(CENT) if row['orders'] else 0
+
+    top_rows = {}
+    for dimension, _ in SalesRollup.DIMENSION_CHOICES[1:]:
+        top_rows[dimension] = list(
+            rollups.filter(dimension=dimension).values('key').annotate(
+                name=Max('label'), orders_sum=Sum('orders'), units_sum=Sum('units'),
+                revenue_sum=Sum('revenue'), refunds_sum=Sum('refunds'),
+            ).order_by('-revenue_sum', 'key')[:top]
+        )
+    return DashboardData(totals, series, top_rows)
@@ -0,0 +1,8 @@
+from celery import shared_task
+from .rollups import refresh_rollups
+
+
+@shared_task
+def refresh_sales_rollups():
+    """تحديث ملخصات المبيعات للساعات التي تغيرت طلباتها منذ آخر تحديث"""
+    return refresh_rollups()
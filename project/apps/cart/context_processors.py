@@ -1,28 +1,16 @@
-
-from .models import Cart, CartItem
+from django.utils.functional import SimpleLazyObject
+from .storage import get_cart_store
 
 
 def cart(request):
-    """معالج سياق سلة التسوق"""
-    cart = None
-    cart_items_count = 0
-
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            cart_items_count = sum(item.quantity for item in cart.items.all())
-        except Cart.DoesNotExist:
-            pass
-    else:
-        session_key = request.session.get('cart_session_key')
-        if session_key:
-            try:
-                cart = Cart.objects.get(session_key=session_key)
-                cart_items_count = sum(item.quantity for item in cart.items.all())
-            except Cart.DoesNotExist:
-                pass
+    """
+    معالج سياق سلة التسوق: عدد العناصر كائن كسول لا يُقرأ (ولا يُحمّل المستخدم)
+    إلا إذا استخدمه القالب، ثم يُقرأ بقراءة واحدة من ملخص السلة في المخزن
+    """
+    def get_items_count():
+        store = get_cart_store(request, create=False)
+        return store.get_count() if store else 0
 
     return {
-        'cart': cart,
-        'cart_items_count': cart_items_count,
+        'cart_items_count': SimpleLazyObject(get_items_count),
     }
@@ -77,6 +77,11 @@ class CartItem(models.Model):
             return f"{self.product.name} - {self.variant.sku}"
         return self.product.name
 
+    @property
+    def line_key(self):
+        """مفتاح السطر في مخزن السلة"""
+        return f'{self.product_id}:{self.variant_id or 0}'
+
     def get_price(self):
         """الحصول على سعر العنصر"""
         if self.variant:
@@ -105,7 +110,11 @@ class CartItem(models.Model):
         """الحصول على صورة المنتج"""
         if self.variant and self.variant.image:
             return self.variant.image.image.url
-        elif self.product.images.filter(is_featured=True).exists():
+        # الصور المجلوبة مسبقاً عبر Product.objects.for_listing()
+        listing_images = getattr(self.product, 'listing_images', None)
+        if listing_images is not None:
+            return listing_images[0].image.url if listing_images else None
+        if self.product.images.filter(is_featured=True).exists():
             return self.product.images.filter(is_featured=True).first().image.url
         elif self.product.images.exists():
             return self.product.images.first().image.url
@@ -6,6 +6,7 @@ from apps.products.serializers import ProductListSerializer as ProductSerializer
 
 class CartItemSerializer(serializers.ModelSerializer):
     """مسلسل عناصر سلة التسوق"""
+    id = serializers.CharField(source='line_key', read_only=True)
     product = ProductSerializer(read_only=True)
     variant = ProductVariantSerializer(read_only=True)
     price = serializers.SerializerMethodField()
@@ -0,0 +1,404 @@
+"""
+مخزن سلة التسوق النشطة
+
+تحفظ السلة النشطة (الأسطر والكميات والإجمالي وعدد العناصر المحسوبين مسبقاً)
+في Redis، وتُكتب إلى جداول Cart/CartItem لاحقاً: دورياً لسلال المستخدمين
+المعدلة، وعند إتمام الطلب. سلال الزوار لا تصل إلى قاعدة البيانات قبل إتمام الطلب.
+
+السطر يعرف بالمفتاح "product_id:variant_id" (0 بدون متغير)، والأسعار تخزن بالهللات
+كأعداد صحيحة ليبقى تحديث الإجمالي ذرياً بـ HINCRBY.
+"""
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from config.redis import get_redis_connection
+from .models import Cart, CartItem
+
+
+SESSION_KEY = 'cart_session_key'
+
+
+def make_line_key(product_id, variant_id=None):
+    """مفتاح سطر السلة"""
+    return f'{product_id}:{variant_id or 0}'
+
+
+def parse_line_key(line):
+    """(product_id, variant_id) من مفتاح السطر، يرفع ValueError للمفتاح غير الصالح"""
+    product_id, variant_id = (int(part) for part in str(line).split(':'))
+    return product_id, variant_id or None
+
+
+def to_cents(price):
+    return int((Decimal(price) * 100).quantize(Decimal('1')))
+
+
+def from_cents(cents):
+    return (Decimal(cents or 0) / 100).quantize(Decimal('0.01'))
+
+
+class BaseCartStore:
+    """
+    الواجهة المشتركة لمخازن السلة. owner بالشكل user:<id> أو session:<key>
+    """
+
+    def __init__(self, owner):
+        self.owner = owner
+
+    @property
+    def is_user_cart(self):
+        return self.owner.startswith('user:')
+
+    def get_lines(self):
+        """الأسطر: {line_key: quantity}"""
+        raise NotImplementedError
+
+    def get_summary(self):
+        """(عدد العناصر، الإجمالي بالهللات) أو None إذا لم تحمل السلة بعد"""
+        raise NotImplementedError
+
+    def change_line(self, line, quantity, price, replace=False):
+        """إضافة كمية للسطر (أو استبدالها عند replace)، والكمية 0 تحذف السطر"""
+        raise NotImplementedError
+
+    def load(self, lines):
+        """تحميل السلة من أسطر [(line_key, quantity, price)] بدلاً من محتواها الحالي"""
+        raise NotImplementedError
+
+    def clear(self):
+        """تفريغ السلة مع إبقائها محملة"""
+        self.load([])
+        if self.is_user_cart:
+            self.mark_dirty(self.owner)
+
+    def get_count(self):
+        summary = self.get_summary()
+        return summary[0] if summary else 0
+
+    def get_total(self):
+        summary = self.get_summary()
+        return from_cents(summary[1] if summary else 0)
+
+    def is_loaded(self):
+        return self.get_summary() is not None
+
+    def add(self, line, quantity, price):
+        return self.change_line(line, quantity, price)
+
+    def set(self, line, quantity, price):
+        return self.change_line(line, quantity, price, replace=True)
+
+    def remove(self, line):
+        return self.change_line(line, 0, 0, replace=True)
+
+    # سلال المستخدمين المعدلة التي تنتظر الكتابة إلى قاعدة البيانات
+    @classmethod
+    def mark_dirty(cls, owner):
+        raise NotImplementedError
+
+    @classmethod
+    def pop_dirty(cls, count):
+        raise NotImplementedError
+
+
+class RedisCartStore(BaseCartStore):
+    """مخزن Redis: Hash للكميات وآخر للأسعار وثالث لعدد العناصر والإجمالي"""
+    dirty_key = 'cart:dirty'
+
+    # تعديل السطر وتحديث العدد والإجمالي ذرياً
+    CHANGE_LINE_SCRIPT = """
+local old = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+local old_price = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+local new = tonumber(ARGV[2])
+local price = tonumber(ARGV[3])
+if ARGV[4] == '0' then new = old + new end
+if new > 0 then
+    redis.call('HSET', KEYS[1], ARGV[1], new)
+    redis.call('HSET', KEYS[2], ARGV[1], price)
+else
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    new = 0
+    price = 0
+end
+redis.call('HINCRBY', KEYS[3], 'count', new - old)
+redis.call('HINCRBY', KEYS[3], 'total', new * price - old * old_price)
+for i = 1, 3 do redis.call('EXPIRE', KEYS[i], ARGV[5]) end
+return new
+"""
+
+    def __init__(self, owner):
+        super().__init__(owner)
+        self.redis = get_redis_connection()
+        self.lines_key = f'cart:{owner}:lines'
+        self.prices_key = f'cart:{owner}:prices'
+        self.summary_key = f'cart:{owner}:summary'
+        self.change_line_script = self.redis.register_script(self.CHANGE_LINE_SCRIPT)
+
+    def get_lines(self):
+        return {line.decode(): int(quantity) for line, quantity in self.redis.hgetall(self.lines_key).items()}
+
+    def get_summary(self):
+        count, total = self.redis.hmget(self.summary_key, 'count', 'total')
+        if count is None:
+            return None
+        return int(count), int(total or 0)
+
+    def change_line(self, line, quantity, price, replace=False):
+        new = self.change_line_script(
+            keys=[self.lines_key, self.prices_key, self.summary_key],
+            args=[line, int(quantity), to_cents(price), int(replace), settings.CART_STORE_TTL],
+        )
+        if self.is_user_cart:
+            self.mark_dirty(self.owner)
+        return int(new)
+
+    def load(self, lines):
+        pipe = self.redis.pipeline()
+        pipe.delete(self.lines_key, self.prices_key)
+        count = total = 0
+        for line, quantity, price in lines:
+            pipe.hset(self.lines_key, line, quantity)
+            pipe.hset(self.prices_key, line, to_cents(price))
+            count += quantity
+            total += quantity * to_cents(price)
+        pipe.hset(self.summary_key, mapping={'count': count, 'total': total})
+        for key in (self.lines_key, self.prices_key, self.summary_key):
+            pipe.expire(key, settings.CART_STORE_TTL)
+        pipe.execute()
+
+    @classmethod
+    def mark_dirty(cls, owner):
+        get_redis_connection().sadd(cls.dirty_key, owner)
+
+    @classmethod
+    def pop_dirty(cls, count):
+        return [owner.decode() for owner in get_redis_connection().spop(cls.dirty_key, count) or []]
+
+
+class CacheCartStore(BaseCartStore):
+    """
+    مخزن احتياطي فوق ذاكرة التخزين المؤقت (للتطوير والاختبارات دون خادم Redis).
+    السلة كاملة في مفتاح واحد، فالتعديلات المتزامنة غير ذرية.
+    """
+    dirty_key = 'cart:dirty'
+
+    def __init__(self, owner):
+        super().__init__(owner)
+        self.key = f'cart:{owner}'
+
+    def _get(self):
+        return cache.get(self.key)
+
+    def _save(self, data):
+        cache.set(self.key, data, settings.CART_STORE_TTL)
+
+    def get_lines(self):
+        data = self._get()
+        return dict(data['lines']) if data else {}
+
+    def get_summary(self):
+        data = self._get()
+        if data is None:
+            return None
+        return data['count'], data['total']
+
+    def change_line(self, line, quantity, price, replace=False):
+        data = self._get() or {'lines': {}, 'prices': {}, 'count': 0, 'total': 0}
+        old = data['lines'].get(line, 0)
+        old_price = data['prices'].get(line, 0)
+        new = quantity if replace else old + quantity
+        price = to_cents(price)
+        if new > 0:
+            data['lines'][line] = new
+            data['prices'][line] = price
+        else:
+            data['lines'].pop(line, None)
+            data['prices'].pop(line, None)
+            new = price = 0
+        data['count'] += new - old
+        data['total'] += new * price - old * old_price
+        self._save(data)
+        if self.is_user_cart:
+            self.mark_dirty(self.owner)
+        return new
+
+    def load(self, lines):
+        data = {'lines': {}, 'prices': {}, 'count': 0, 'total': 0}
+        for line, quantity, price in lines:
+            data['lines'][line] = quantity
+            data['prices'][line] = to_cents(price)
+            data['count'] += quantity
+            data['total'] += quantity * to_cents(price)
+        self._save(data)
+
+    @classmethod
+    def mark_dirty(cls, owner):
+        dirty = cache.get(cls.dirty_key, set())
+        dirty.add(owner)
+        cache.set(cls.dirty_key, dirty, None)
+
+    @classmethod
+    def pop_dirty(cls, count):
+        dirty = cache.get(cls.dirty_key, set())
+        owners = [dirty.pop() for _ in range(min(count, len(dirty)))]
+        cache.set(cls.dirty_key, dirty, None)
+        return owners
+
+
+def get_store_class():
+    """صنف المخزن المحدد في الإعدادات"""
+    return import_string(settings.CART_STORE)
+
+
+def get_user_store(user_id):
+    """مخزن سلة المستخدم، محملاً من قاعدة البيانات عند أول استخدام"""
+    store = get_store_class()(f'user:{user_id}')
+    if not store.is_loaded():
+        items = CartItem.objects.filter(cart__user_id=user_id).select_related('product', 'variant')
+        store.load([
+            (make_line_key(item.product_id, item.variant_id), item.quantity, item.get_price())
+            for item in items
+        ])
+    return store
+
+
+def get_cart_store(request, create=True):
+    """
+    مخزن السلة للطلب الحالي. عند تسجيل الدخول تدمج سلة الزائر في سلة المستخدم.
+    مع create=False لا تنشأ جلسة للزائر الذي لا يملك سلة (وتعاد None).
+    """
+    store_class = get_store_class()
+    session_key = request.session.get(SESSION_KEY)
+
+    if request.user.is_authenticated:
+        store = get_user_store(request.user.pk)
+        if session_key:
+            merge_stores(store_class(f'session:{session_key}'), store)
+            request.session.pop(SESSION_KEY, None)
+        return store
+
+    if not session_key:
+        if not create:
+            return None
+        # إنشاء جلسة جديدة إذا لم تكن موجودة
+        if not request.session.session_key:
+            request.session.create()
+        session_key = request.session.session_key
+        request.session[SESSION_KEY] = session_key
+    return store_class(f'session:{session_key}')
+
+
+def merge_stores(source, target):
+    """نقل أسطر سلة الزائر إلى سلة المستخدم"""
+    lines = source.get_lines()
+    if not lines:
+        return
+    prices = get_line_prices(lines)
+    for line, quantity in lines.items():
+        if line in prices:
+            target.add(line, quantity, prices[line])
+    source.clear()
+
+
+def get_line_prices(lines):
+    """الأسعار الحالية لأسطر السلة من قاعدة البيانات"""
+    return {item.line_key: item.get_price() for item in build_items(lines)}
+
+
+def build_items(lines):
+    """
+    عناصر CartItem غير محفوظة للأسطر المعطاة بثلاثة استعلامات،
+    مع تجاهل المنتجات غير المنشورة أو المتغيرات غير النشطة
+    """
+    from apps.products.models import Product, ProductVariant
+
+    parsed = []
+    for line, quantity in lines.items():
+        try:
+            parsed.append((parse_line_key(line), quantity))
+        except ValueError:
+            continue
+
+    product_ids = {product_id for (product_id, _), _ in parsed}
+    variant_ids = {variant_id for (_, variant_id), _ in parsed if variant_id}
+    products = Product.objects.published().filter(pk__in=product_ids).for_listing().in_bulk()
+    variants = ProductVariant.objects.filter(
+        pk__in=variant_ids, is_active=True
+    ).select_related('image').in_bulk() if variant_ids else {}
+
+    items = []
+    for (product_id, variant_id), quantity in parsed:
+        product = products.get(product_id)
+        variant = variants.get(variant_id) if variant_id else None
+        if product is None or (variant_id and (variant is None or variant.product_id != product_id)):
+            continue
+        items.append(CartItem(product=product, variant=variant, quantity=quantity))
+    return items
+
+
+class CartLines(list):
+    """قائمة عناصر بواجهة مشابهة لمدير العلاقة (all و exists و count) لاستخدامها في القوالب"""
+
+    def all(self):
+        return self
+
+    def exists(self):
+        return bool(self)
+
+
+class StoredCart:
+    """سلة للعرض مبنية من المخزن دون صفوف في قاعدة البيانات"""
+    id = None
+    created_at = None
+    updated_at = None
+
+    def __init__(self, store):
+        self.store = store
+        self.items = CartLines(build_items(store.get_lines()))
+
+    def get_total_price(self):
+        """حساب الإجمالي بالأسعار الحالية"""
+        return sum((item.get_total_price() for item in self.items), Decimal('0'))
+
+    def get_total_items(self):
+        """حساب إجمالي العناصر"""
+        return sum(item.quantity for item in self.items)
+
+
+def flush_cart(store, cart):
+    """كتابة أسطر المخزن إلى عناصر سلة قاعدة البيانات بأقل عدد من الاستعلامات"""
+    lines = store.get_lines()
+    with transaction.atomic():
+        existing = {item.line_key: item for item in cart.items.all()}
+        CartItem.objects.filter(pk__in=[
+            item.pk for line, item in existing.items() if line not in lines
+        ]).delete()
+
+        changed = []
+        for line, quantity in lines.items():
+            item = existing.get(line)
+            if item is not None and item.quantity != quantity:
+                item.quantity = quantity
+                changed.append(item)
+        CartItem.objects.bulk_update(changed, ['quantity'])
+
+        # الأسطر الجديدة بعد التحقق من أن منتجاتها ما زالت متاحة
+        created = build_items({line: quantity for line, quantity in lines.items() if line not in existing})
+        for item in created:
+            item.cart = cart
+        CartItem.objects.bulk_create(created, ignore_conflicts=True)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now())
+
+
+def flush_user_cart(owner):
+    """كتابة سلة مستخدم من المخزن إلى قاعدة البيانات"""
+    store = get_store_class()(owner)
+    if not store.is_user_cart or not store.is_loaded():
+        return
+    cart, _ = Cart.objects.get_or_create(user_id=int(owner.split(':', 1)[1]))
+    flush_cart(store, cart)
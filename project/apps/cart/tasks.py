@@ -0,0 +1,33 @@
+import logging
+from celery import shared_task
+from .storage import flush_user_cart, get_store_class
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def flush_dirty_carts(batch_size=500):
+    """
+    كتابة سلال المستخدمين المعدلة من المخزن إلى قاعدة البيانات.
+    فشل سلة لا يوقف بقية الدفعة؛ تعاد السلال الفاشلة إلى قائمة الانتظار في النهاية
+    (لا أثناء التشغيل كي لا تسحب مجدداً في الحلقة نفسها) لمحاولة في التشغيل التالي.
+    """
+    store_class = get_store_class()
+    flushed = 0
+    failed = []
+    try:
+        while True:
+            owners = store_class.pop_dirty(batch_size)
+            if not owners:
+                return flushed
+            for owner in owners:
+                try:
+                    flush_user_cart(owner)
+                except Exception:
+                    logger.exception('تعذر كتابة السلة %s إلى قاعدة البيانات', owner)
+                    failed.append(owner)
+                else:
+                    flushed += 1
+    finally:
+        for owner in failed:
+            store_class.mark_dirty(owner)
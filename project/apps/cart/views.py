@@ -1,56 +1,51 @@
 
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import render, redirect
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
-from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.utils.translation import gettext as _
-from django.db import transaction
-from django.contrib.sessions.models import Session
-from rest_framework import status, generics, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework import status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Cart, CartItem
+from .models import Cart
 from apps.products.models import Product, ProductVariant
-from .serializers import CartSerializer, CartItemSerializer
+from .serializers import CartSerializer
+from .storage import StoredCart, build_items, flush_cart, get_cart_store, make_line_key
 
 
 def get_or_create_cart(request):
-    """الحصول على سلة التسوق الحالية أو إنشاء سلة جديدة"""
+    """
+    سلة قاعدة البيانات للطلب الحالي بعد كتابة محتوى مخزن السلة إليها،
+    تستخدم عند إتمام الطلب فقط؛ العرض والتعديل يتمان عبر المخزن
+    """
+    store = get_cart_store(request)
     if request.user.is_authenticated:
         cart, created = Cart.objects.get_or_create(user=request.user)
-        # إذا كان المستخدم لديه سلة قديمة مرتبطة بالجلسة، نقل العناصر
-        if not created and request.session.get('cart_session_key'):
-            try:
-                session_cart = Cart.objects.get(session_key=request.session.get('cart_session_key'))
-                for item in session_cart.items.all():
-                    cart_item, item_created = CartItem.objects.get_or_create(
-                        cart=cart,
-                        product=item.product,
-                        variant=item.variant,
-                        defaults={'quantity': item.quantity}
-                    )
-                    if not item_created:
-                        cart_item.quantity += item.quantity
-                        cart_item.save()
-                session_cart.delete()
-                request.session.pop('cart_session_key', None)
-            except Cart.DoesNotExist:
-                pass
     else:
-        session_key = request.session.get('cart_session_key')
-        if not session_key:
-            # إنشاء جلسة جديدة إذا لم تكن موجودة
-            if not request.session.session_key:
-                request.session.create()
-            session_key = request.session.session_key
-            request.session['cart_session_key'] = session_key
+        cart, created = Cart.objects.get_or_create(session_key=store.owner.split(':', 1)[1])
+    flush_cart(store, cart)
+    return cart
 
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
 
-    return cart
+def get_cart_response(store):
+    """تمثيل السلة الكامل من المخزن"""
+    return Response(CartSerializer(StoredCart(store)).data)
+
+
+def parse_quantity(value):
+    """الكمية كعدد صحيح موجب أو None"""
+    try:
+        quantity = int(value)
+    except (ValueError, TypeError):
+        return None
+    return quantity if quantity > 0 else None
+
+
+def check_stock(product, variant, quantity):
+    """التحقق من توفر الكمية المطلوبة"""
+    product_to_check = variant if variant else product
+    return not product_to_check.track_quantity or product_to_check.available_quantity >= quantity
 
 
 class CartDetailView(APIView):
@@ -58,9 +53,7 @@ class CartDetailView(APIView):
     permission_classes = [permissions.AllowAny]
 
     def get(self, request):
-        cart = get_or_create_cart(request)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        return get_cart_response(get_cart_store(request))
 
 
 class AddToCartView(APIView):
@@ -80,7 +73,7 @@ class AddToCartView(APIView):
 
         try:
             product = Product.objects.get(id=product_id, status='published')
-        except Product.DoesNotExist:
+        except (Product.DoesNotExist, ValueError):
             return Response(
                 {'error': _('المنتج غير موجود')},
                 status=status.HTTP_404_NOT_FOUND
@@ -90,47 +83,42 @@ class AddToCartView(APIView):
         if variant_id:
             try:
                 variant = ProductVariant.objects.get(id=variant_id, product=product, is_active=True)
-            except ProductVariant.DoesNotExist:
+            except (ProductVariant.DoesNotExist, ValueError):
                 return Response(
                     {'error': _('متغير المنتج غير موجود')},
                     status=status.HTTP_404_NOT_FOUND
                 )
 
         # التحقق من الكمية
-        try:
-            quantity = int(quantity)
-            if quantity <= 0:
-                raise ValueError
-        except (ValueError, TypeError):
+        quantity = parse_quantity(quantity)
+        if quantity is None:
             return Response(
                 {'error': _('الكمية غير صالحة')},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
         # التحقق من توفر المنتج
-        product_to_check = variant if variant else product
-        if product_to_check.track_quantity and product_to_check.quantity < quantity:
+        if not check_stock(product, variant, quantity):
             return Response(
                 {'error': _('الكمية المطلوبة غير متوفرة')},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        cart = get_or_create_cart(request)
+        store = get_cart_store(request)
+        price = variant.price if variant else product.price
+        store.add(make_line_key(product.pk, variant.pk if variant else None), quantity, price)
 
-        with transaction.atomic():
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=product,
-                variant=variant,
-                defaults={'quantity': quantity}
-            )
+        return get_cart_response(store)
 
-            if not created:
-                cart_item.quantity += quantity
-                cart_item.save()
 
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+def get_store_item(request, item_id):
+    """مخزن السلة وعنصرها المحدد بمفتاح السطر، أو (المخزن، None) إذا لم يوجد"""
+    store = get_cart_store(request)
+    lines = store.get_lines()
+    if item_id not in lines:
+        return store, None
+    items = build_items({item_id: lines[item_id]})
+    return store, items[0] if items else None
 
 
 class UpdateCartItemView(APIView):
@@ -138,10 +126,8 @@ class UpdateCartItemView(APIView):
     permission_classes = [permissions.AllowAny]
 
     def put(self, request, item_id):
-        try:
-            cart = get_or_create_cart(request)
-            cart_item = CartItem.objects.get(id=item_id, cart=cart)
-        except CartItem.DoesNotExist:
+        store, cart_item = get_store_item(request, item_id)
+        if cart_item is None:
             return Response(
                 {'error': _('العنصر غير موجود في سلة التسوق')},
                 status=status.HTTP_404_NOT_FOUND
@@ -154,29 +140,23 @@ class UpdateCartItemView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            quantity = int(quantity)
-            if quantity <= 0:
-                raise ValueError
-        except (ValueError, TypeError):
+        quantity = parse_quantity(quantity)
+        if quantity is None:
             return Response(
                 {'error': _('الكمية غير صالحة')},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
         # التحقق من توفر المنتج
-        product_to_check = cart_item.variant if cart_item.variant else cart_item.product
-        if product_to_check.track_quantity and product_to_check.quantity < quantity:
+        if not check_stock(cart_item.product, cart_item.variant, quantity):
             return Response(
                 {'error': _('الكمية المطلوبة غير متوفرة')},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        cart_item.quantity = quantity
-        cart_item.save()
+        store.set(item_id, quantity, cart_item.get_price())
 
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        return get_cart_response(store)
 
 
 class RemoveFromCartView(APIView):
@@ -184,19 +164,16 @@ class RemoveFromCartView(APIView):
     permission_classes = [permissions.AllowAny]
 
     def delete(self, request, item_id):
-        try:
-            cart = get_or_create_cart(request)
-            cart_item = CartItem.objects.get(id=item_id, cart=cart)
-        except CartItem.DoesNotExist:
+        store = get_cart_store(request)
+        if item_id not in store.get_lines():
             return Response(
                 {'error': _('العنصر غير موجود في سلة التسوق')},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        cart_item.delete()
+        store.remove(item_id)
 
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        return get_cart_response(store)
 
 
 class ClearCartView(APIView):
@@ -204,19 +181,17 @@ class ClearCartView(APIView):
     permission_classes = [permissions.AllowAny]
 
     def delete(self, request):
-        cart = get_or_create_cart(request)
-        cart.items.all().delete()
+        store = get_cart_store(request)
+        store.clear()
 
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        return get_cart_response(store)
 
 
 # واجهات HTML
 def cart_detail(request):
     """عرض صفحة سلة التسوق"""
-    cart = get_or_create_cart(request)
     context = {
-        'cart': cart,
+        'cart': StoredCart(get_cart_store(request)),
     }
     return render(request, 'cart/cart_detail.html', context)
 
@@ -225,31 +200,10 @@ def cart_detail(request):
 @login_required
 def merge_carts(request):
     """دمج سلة التسوق للضيف مع سلة المستخدم بعد تسجيل الدخول"""
-    if request.user.is_authenticated:
-        session_key = request.session.get('cart_session_key')
-        if session_key:
-            try:
-                session_cart = Cart.objects.get(session_key=session_key)
-                user_cart, created = Cart.objects.get_or_create(user=request.user)
-
-                with transaction.atomic():
-                    for item in session_cart.items.all():
-                        cart_item, item_created = CartItem.objects.get_or_create(
-                            cart=user_cart,
-                            product=item.product,
-                            variant=item.variant,
-                            defaults={'quantity': item.quantity}
-                        )
-                        if not item_created:
-                            cart_item.quantity += item.quantity
-                            cart_item.save()
-
-                    session_cart.delete()
-                    request.session.pop('cart_session_key', None)
-
-                if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'status': 'success'})
-            except Cart.DoesNotExist:
-                pass
+    # الدمج يتم داخل get_cart_store عند وجود سلة للجلسة
+    get_cart_store(request)
+
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse({'status': 'success'})
 
     return redirect('cart:cart_detail')
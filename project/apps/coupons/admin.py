@@ -1,6 +1,10 @@
 
-from django.contrib import admin
-from .models import Coupon, CouponUsage, UserCoupon
+import csv
+from django.contrib import admin, messages
+from django.http import StreamingHttpResponse
+from django.utils.translation import gettext_lazy as _
+from .campaigns import iter_batch_rows
+from .models import Coupon, CouponBatch, CouponUsage, CouponUserCounter, UserCoupon
 
 
 @admin.register(Coupon)
@@ -81,3 +85,53 @@ class UserCouponAdmin(admin.ModelAdmin):
         'user__email', 'user__username', 'coupon__code', 'coupon__name'
     )
     readonly_fields = ('created_at',)
+
+
+@admin.register(CouponUserCounter)
+class CouponUserCounterAdmin(admin.ModelAdmin):
+    """إعدادات عرض عدادات استخدام الكوبونات لكل مستخدم في لوحة التحكم"""
+    list_display = ('coupon', 'user', 'times_used')
+    search_fields = ('coupon__code', 'user__email', 'user__username')
+    raw_id_fields = ('coupon', 'user')
+    readonly_fields = ('times_used',)
+
+
+class Echo:
+    """كائن بواجهة الملف يعيد السطر المكتوب بدلاً من تخزينه، لبث CSV سطراً سطراً"""
+
+    def write(self, value):
+        return value
+
+
+@admin.register(CouponBatch)
+class CouponBatchAdmin(admin.ModelAdmin):
+    """إعدادات عرض دفعات كوبونات الحملات في لوحة التحكم"""
+    list_display = ('name', 'template', 'quantity', 'generated', 'assigned', 'status', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('name', 'template__code')
+    raw_id_fields = ('template',)
+    readonly_fields = ('status', 'generated', 'assigned', 'assigned_rows', 'created_at', 'updated_at')
+    actions = ['generate_codes', 'download_codes']
+
+    @admin.action(description=_('توليد الأكواد (أو استئنافه) في الخلفية'))
+    def generate_codes(self, request, queryset):
+        from .tasks import generate_coupon_batch
+
+        # الدفعات قيد التوليد تُتخطى، والمهمة نفسها ترفض الدفعة المحجوزة لعامل آخر
+        batches = [batch for batch in queryset if batch.status != 'generating']
+        for batch in batches:
+            generate_coupon_batch.delay(batch.pk)
+        self.message_user(request, _('تمت جدولة توليد %d دفعة') % len(batches), messages.SUCCESS)
+
+    @admin.action(description=_('تنزيل أكواد الدفعة (CSV)'))
+    def download_codes(self, request, queryset):
+        if len(queryset) != 1:
+            self.message_user(request, _('اختر دفعة واحدة للتنزيل'), messages.ERROR)
+            return None
+        batch = queryset[0]
+        writer = csv.writer(Echo())
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in iter_batch_rows(batch)), content_type='text/csv'
+        )
+        response['Content-Disposition'] = f'attachment; filename="coupon-batch-{batch.pk}.csv"'
+        return response
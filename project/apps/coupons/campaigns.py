@@ -0,0 +1,199 @@
+"""
+توليد كوبونات الحملات وتوزيعها بالجملة
+
+تولد الأكواد عشوائياً بـ secrets على مجموعات، تُدرج كل مجموعة بـ bulk_create(ignore_conflicts=True)
+ويُعد ما أُدرج فعلاً، فتعاد محاولة الأكواد المتصادمة في المجموعة التالية.
+كل مجموعة تُحفظ مع عداد تقدم الدفعة في معاملة واحدة، فيستأنف التشغيل بعد أي انقطاع
+من حيث توقف دون تكرار. التصدير والتوزيع يقرآن ويكتبان ملفات CSV تدفقياً
+دون تحميل الأكواد أو المستخدمين في الذاكرة.
+"""
+import csv
+import secrets
+from datetime import timedelta
+from itertools import islice
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from apps.users.models import User
+from .models import Coupon, CouponBatch, UserCoupon
+
+
+CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'  # دون الأحرف الملتبسة O و 0 و I و 1
+
+# المحاولات المتتالية دون إدراج أي كود قبل اعتبار مساحة الأكواد مستنفدة
+MAX_EMPTY_ROUNDS = 5
+
+# المدة دون تقدم التي تعد بعدها الدفعة قيد التوليد عالقة ويجوز استئنافها
+GENERATION_STALE_AFTER = timedelta(minutes=10)
+
+TEMPLATE_FIELDS = (
+    'name', 'description', 'discount_type', 'discount_value', 'minimum_amount',
+    'maximum_discount', 'start_date', 'end_date',
+)
+
+
+class CouponBatchError(Exception):
+    """تعذر إكمال توليد الدفعة أو توزيعها"""
+
+
+def generate_code(length, prefix=''):
+    """كود عشوائي آمن تشفيرياً"""
+    return prefix + ''.join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def generate_batch(batch, chunk_size=2000, progress=None):
+    """
+    توليد أكواد الدفعة حتى تبلغ الكمية المطلوبة، ويستأنف من عدد الأكواد المحفوظة فعلاً.
+    progress(done, total) تستدعى بعد كل مجموعة.
+    """
+    template = batch.template
+    fields = {name: getattr(template, name) for name in TEMPLATE_FIELDS}
+    product_ids = list(template.products.values_list('pk', flat=True))
+    category_ids = list(template.categories.values_list('pk', flat=True))
+
+    # حجز الدفعة بتحديث شرطي كي لا يولدها عاملان معاً فيتجاوزا الكمية؛
+    # الدفعة العالقة في التوليد دون تقدم (عامل توقف فجأة) يمكن استئنافها بعد مهلة
+    now = timezone.now()
+    claimed = CouponBatch.objects.filter(pk=batch.pk).filter(
+        ~Q(status='generating') | Q(updated_at__lt=now - GENERATION_STALE_AFTER)
+    ).update(status='generating', updated_at=now)
+    if not claimed:
+        raise CouponBatchError(_('الدفعة قيد التوليد في عملية أخرى'))
+
+    generated = batch.coupons.count()
+    empty_rounds = 0
+    try:
+        while generated < batch.quantity:
+            size = min(chunk_size, batch.quantity - generated)
+            # التكرار داخل المجموعة نادر ويعوض كالتصادم في المجموعة التالية
+            codes = {generate_code(batch.code_length, batch.prefix) for _ in range(size)}
+
+            with transaction.atomic():
+                # ignore_conflicts لا يعيد المعرفات، فالمدرج فعلاً ما جاء بعد آخر معرف قبل الإدراج؛
+                # الكود المكرر لكود سابق (من الدفعة نفسها أو غيرها) لا يُدرج فلا يُعد
+                last_pk = Coupon.objects.aggregate(last=Max('pk'))['last'] or 0
+                Coupon.objects.bulk_create(
+                    [
+                        Coupon(code=code, batch=batch, usage_limit=1, usage_limit_per_user=1, **fields)
+                        for code in codes
+                    ],
+                    ignore_conflicts=True,
+                )
+                # الأكواد المتصادمة لا تُدرج وتعوض في المجموعة التالية
+                created = list(batch.coupons.filter(pk__gt=last_pk, code__in=codes).values_list('pk', flat=True))
+                Coupon.products.through.objects.bulk_create(
+                    [Coupon.products.through(coupon_id=pk, product_id=product_id)
+                     for pk in created for product_id in product_ids],
+                    ignore_conflicts=True,
+                )
+                Coupon.categories.through.objects.bulk_create(
+                    [Coupon.categories.through(coupon_id=pk, category_id=category_id)
+                     for pk in created for category_id in category_ids],
+                    ignore_conflicts=True,
+                )
+                generated += len(created)
+                CouponBatch.objects.filter(pk=batch.pk).update(generated=generated, updated_at=timezone.now())
+
+            empty_rounds = 0 if created else empty_rounds + 1
+            if empty_rounds >= MAX_EMPTY_ROUNDS:
+                raise CouponBatchError(_('تعذر توليد أكواد فريدة؛ زد طول الكود أو غيّر البادئة'))
+            if progress:
+                progress(generated, batch.quantity)
+    except Exception:
+        CouponBatch.objects.filter(pk=batch.pk).update(status='failed', updated_at=timezone.now())
+        raise
+
+    CouponBatch.objects.filter(pk=batch.pk).update(status='generated', updated_at=timezone.now())
+    batch.generated, batch.status = generated, 'generated'
+    return generated
+
+
+def iter_batch_rows(batch, chunk_size=5000):
+    """أسطر CSV لأكواد الدفعة (الكود والمستخدم الموزع له) تدفقياً بترتيب المعرف"""
+    yield ['code', 'email']
+    rows = batch.coupons.order_by('pk').values_list('code', 'user_coupons__user__email')
+    for code, email in rows.iterator(chunk_size=chunk_size):
+        yield [code, email or '']
+
+
+def export_batch(batch, stream, chunk_size=5000):
+    """كتابة أكواد الدفعة في ملف CSV مفتوح، ويعيد عدد الأكواد"""
+    writer = csv.writer(stream)
+    count = -1
+    for count, row in enumerate(iter_batch_rows(batch, chunk_size=chunk_size)):
+        writer.writerow(row)
+    return count
+
+
+def _resolve_users(values):
+    """معرفات المستخدمين لقيم عمود المستخدم (بريد إلكتروني أو معرف) باستعلام واحد، بترتيب الملف دون تكرار"""
+    ids = {int(value) for value in values if value.isdigit()}
+    emails = {value for value in values if not value.isdigit()}
+    lookup = {}
+    for pk, email in User.objects.filter(Q(pk__in=ids) | Q(email__in=emails)).values_list('pk', 'email'):
+        lookup[str(pk)] = lookup[email] = pk
+    return list(dict.fromkeys(lookup[value] for value in values if value in lookup))
+
+
+def assign_batch(batch, stream, chunk_size=2000, progress=None):
+    """
+    توزيع أكواد الدفعة على المستخدمين من ملف CSV فيه عمود email أو user_id، كوداً لكل مستخدم.
+    يُقصر كل كود على صاحبه ويُنشأ له UserCoupon، ويتخطى الأسطر المعالجة في تشغيل سابق
+    والمستخدمين الذين لديهم كود من الدفعة. progress(rows, assigned) تستدعى بعد كل مجموعة.
+    """
+    reader = csv.DictReader(stream)
+    column = next((name for name in ('email', 'user_id') if name in (reader.fieldnames or ())), None)
+    if column is None:
+        raise CouponBatchError(_('ملف المستخدمين يجب أن يحتوي عمود email أو user_id'))
+
+    rows_done, assigned = batch.assigned_rows, batch.assigned
+    # الأكواد توزع بترتيب المعرف، فغير الموزع منها يأتي بعد آخر كود موزع
+    cursor = UserCoupon.objects.filter(coupon__batch=batch).aggregate(last=Max('coupon_id'))['last'] or 0
+
+    for chunk in _chunks(islice(reader, rows_done, None), chunk_size):
+        values = [(row.get(column) or '').strip() for row in chunk]
+        users = _resolve_users([value for value in values if value])
+
+        with transaction.atomic():
+            holders = set(UserCoupon.objects.filter(
+                coupon__batch=batch, user_id__in=users
+            ).values_list('user_id', flat=True))
+            users = [pk for pk in users if pk not in holders]
+            coupons = list(
+                batch.coupons.filter(pk__gt=cursor).order_by('pk').values_list('pk', flat=True)[:len(users)]
+            )
+            if len(coupons) < len(users):
+                raise CouponBatchError(_('عدد أكواد الدفعة غير كافٍ لجميع المستخدمين'))
+
+            pairs = list(zip(users, coupons))
+            UserCoupon.objects.bulk_create(
+                [UserCoupon(user_id=user_id, coupon_id=coupon_id) for user_id, coupon_id in pairs],
+                ignore_conflicts=True,
+            )
+            Coupon.users.through.objects.bulk_create(
+                [Coupon.users.through(user_id=user_id, coupon_id=coupon_id) for user_id, coupon_id in pairs],
+                ignore_conflicts=True,
+            )
+            # الإدراج الجماعي لا يرسل m2m_changed فيحدّث علم التقييد وتاريخ التعديل مباشرة
+            Coupon.objects.filter(pk__in=coupons).update(is_restricted=True, updated_at=timezone.now())
+
+            rows_done += len(chunk)
+            assigned += len(pairs)
+            CouponBatch.objects.filter(pk=batch.pk).update(
+                assigned_rows=rows_done, assigned=assigned, updated_at=timezone.now()
+            )
+        if coupons:
+            cursor = coupons[-1]
+        if progress:
+            progress(rows_done, assigned)
+
+    batch.assigned_rows, batch.assigned = rows_done, assigned
+    return assigned
@@ -0,0 +1,110 @@
+"""
+حساب خصم الكوبون على مستوى أسطر السلة
+
+الأسطر المشمولة بنطاق الكوبون (منتجاته، أو منتجات فئاته وفروعها) تُحدد باستعلام واحد
+على معرفات منتجات السلة مهما كان عدد الأسطر أو عدد منتجات الكوبون:
+شرطا EXISTS على جدولي العلاقة المفهرسين، ومطابقة بداية مسار فئة المنتج لمسار فئة الكوبون.
+ثم يحسب الخصم من إجمالي الأسطر المشمولة بـ Decimal مع الحد الأقصى،
+ويوزع على الأسطر بنسبة مبالغها بحيث يساوي مجموع خصومها الخصم الكلي تماماً.
+"""
+from collections import namedtuple
+from decimal import ROUND_DOWN, ROUND_HALF_UP, Decimal
+from django.db.models import Exists, F, OuterRef
+from django.db.models.lookups import StartsWith
+
+from apps.products.models import Product
+from .models import Coupon
+
+
+CENT = Decimal('0.01')
+
+# سطر للحساب: مفتاح يعرّفه المستدعي ومعرف المنتج ومبلغ السطر
+DiscountLine = namedtuple('DiscountLine', 'key product_id amount')
+LineDiscount = namedtuple('LineDiscount', 'key product_id amount eligible discount')
+DiscountBreakdown = namedtuple('DiscountBreakdown', 'subtotal eligible_subtotal discount lines')
+
+
+def _money(value):
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def get_eligible_product_ids(coupon, product_ids):
+    """معرفات المنتجات المشمولة بنطاق الكوبون من بين المعطاة باستعلام واحد"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return set()
+
+    coupon_products = Coupon.products.through.objects.filter(coupon_id=coupon.pk)
+    coupon_categories = Coupon.categories.through.objects.filter(coupon_id=coupon.pk)
+    in_scope = (
+        # الكوبون دون منتجات أو فئات يشمل جميع المنتجات
+        (~Exists(coupon_products) & ~Exists(coupon_categories))
+        | Exists(coupon_products.filter(product_id=OuterRef('pk')))
+        # فئة المنتج هي فئة الكوبون أو فرع منها إذا بدأ مسارها بمسار فئة الكوبون
+        | Exists(coupon_categories.filter(StartsWith(OuterRef('category__path'), F('category__path'))))
+    )
+    return set(
+        Product.objects.filter(pk__in=product_ids).filter(in_scope).order_by().values_list('pk', flat=True)
+    )
+
+
+def _allocate(total, amounts):
+    """
+    توزيع المبلغ على الأسطر بنسبة مبالغها بالهللات: يُقرب كل نصيب للأسفل
+    ثم توزع الهللات المتبقية على الأسطر ذات الكسور الأكبر
+    """
+    base = sum(amounts, Decimal('0'))
+    if not base or not total:
+        return [Decimal('0.00')] * len(amounts)
+
+    shares = [total * amount / base for amount in amounts]
+    allocated = [share.quantize(CENT, rounding=ROUND_DOWN) for share in shares]
+    remaining = int((total - sum(allocated, Decimal('0'))) / CENT)
+    by_remainder = sorted(range(len(shares)), key=lambda index: allocated[index] - shares[index])
+    for index in by_remainder[:remaining]:
+        allocated[index] += CENT
+    return allocated
+
+
+def calculate_line_discounts(coupon, lines):
+    """
+    خصم الكوبون لكل سطر من أسطر DiscountLine (أو أي ثلاثيات بالترتيب نفسه).
+    النسبة المئوية تحسب من إجمالي الأسطر المشمولة ثم يطبق maximum_discount،
+    والقيمة الثابتة لا تتجاوز إجمالي الأسطر المشمولة.
+    """
+    lines = [DiscountLine(key, product_id, _money(amount)) for key, product_id, amount in lines]
+    eligible_ids = get_eligible_product_ids(coupon, {line.product_id for line in lines})
+    eligible = [line for line in lines if line.product_id in eligible_ids]
+
+    subtotal = sum((line.amount for line in lines), Decimal('0.00'))
+    eligible_subtotal = sum((line.amount for line in eligible), Decimal('0.00'))
+
+    if coupon.discount_type == 'percentage':
+        discount = _money(eligible_subtotal * coupon.discount_value / 100)
+        if coupon.maximum_discount and discount > coupon.maximum_discount:
+            discount = _money(coupon.maximum_discount)
+    else:
+        discount = _money(coupon.discount_value)
+    discount = min(discount, eligible_subtotal)
+
+    shares = dict(zip((line.key for line in eligible), _allocate(discount, [line.amount for line in eligible])))
+    return DiscountBreakdown(
+        subtotal=subtotal,
+        eligible_subtotal=eligible_subtotal,
+        discount=discount,
+        lines=[
+            LineDiscount(
+                line.key, line.product_id, line.amount,
+                eligible=line.key in shares,
+                discount=shares.get(line.key, Decimal('0.00')),
+            )
+            for line in lines
+        ],
+    )
+
+
+def calculate_cart_discounts(coupon, items):
+    """خصم الكوبون لعناصر السلة (CartItem) مفهرساً بمفتاح السطر"""
+    return calculate_line_discounts(
+        coupon, [(item.line_key, item.product_id, item.get_total_price()) for item in items]
+    )
@@ -0,0 +1,93 @@
+"""
+محرك صلاحية الكوبونات
+
+الشروط العامة (النشاط والتاريخ والحد الكلي) تُقرأ من صف الكوبون نفسه بفضل العداد times_used.
+شروط المستخدم (العضوية في قائمة المستخدمين وعدد استخداماته) تُجلب باستعلام واحد
+على الفهارس الفريدة (coupon_id, user_id) وتُخزن مؤقتاً لكل (كوبون، مستخدم)،
+ويُبطل التخزين عند الاستخدام أو عند تعديل الكوبون (المفتاح يتضمن updated_at).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils.translation import gettext as _
+
+from .models import Coupon, CouponUsage, CouponUserCounter
+
+
+def _version(coupon):
+    return int(coupon.updated_at.timestamp() * 1000000) if coupon.updated_at else 0
+
+
+def get_eligibility_key(coupon, user_id):
+    return f'coupons:eligibility:{coupon.pk}:{_version(coupon)}:{user_id}'
+
+
+def get_user_eligibility(coupon, user):
+    """(هل المستخدم ضمن مستخدمي الكوبون، عدد مرات استخدامه له) من التخزين المؤقت أو باستعلام واحد"""
+    if user is None or not user.is_authenticated:
+        return False, 0
+
+    key = get_eligibility_key(coupon, user.pk)
+    state = cache.get(key)
+    if state is None:
+        members = Coupon.users.through.objects.filter(coupon_id=OuterRef('pk'), user_id=user.pk)
+        counter = CouponUserCounter.objects.filter(coupon_id=OuterRef('pk'), user_id=user.pk)
+        state = Coupon.objects.filter(pk=coupon.pk).annotate(
+            is_member=Exists(members),
+            user_times_used=Coalesce(Subquery(counter.values('times_used')[:1]), Value(0)),
+        ).values_list('is_member', 'user_times_used').first() or (False, 0)
+        cache.set(key, tuple(state), settings.COUPON_ELIGIBILITY_CACHE_TIMEOUT)
+    return tuple(state)
+
+
+def invalidate_user_eligibility(coupon, user_id):
+    """إبطال نتيجة التحقق المخزنة للمستخدم بعد استخدامه الكوبون"""
+    cache.delete(get_eligibility_key(coupon, user_id))
+
+
+class CouponRedemptionError(Exception):
+    """تعذر استخدام الكوبون لبلوغ حد الاستخدام الكلي أو حد المستخدم"""
+
+
+def _claim_coupon(coupon):
+    """زيادة العداد الكلي بتحديث شرطي: times_used = times_used + 1 WHERE times_used < usage_limit"""
+    claimed = Coupon.objects.filter(pk=coupon.pk).filter(
+        Q(usage_limit__isnull=True) | Q(times_used__lt=F('usage_limit'))
+    ).update(times_used=F('times_used') + 1)
+    if not claimed:
+        raise CouponRedemptionError(_('تم الوصول إلى الحد الأقصى لاستخدام الكوبون'))
+
+
+def _claim_user_counter(coupon, user):
+    """زيادة عداد المستخدم بتحديث شرطي، وإنشاؤه عند أول استخدام"""
+    limit = coupon.usage_limit_per_user
+    counters = CouponUserCounter.objects.filter(coupon=coupon, user=user)
+    condition = Q(times_used__lt=limit) if limit else Q()
+    if counters.filter(condition).update(times_used=F('times_used') + 1):
+        return
+    if not counters.exists():
+        try:
+            with transaction.atomic():
+                CouponUserCounter.objects.create(coupon=coupon, user=user, times_used=1)
+            return
+        except IntegrityError:
+            # أنشأ طلب متزامن العداد قبلنا فيعاد التحديث الشرطي
+            if counters.filter(condition).update(times_used=F('times_used') + 1):
+                return
+    raise CouponRedemptionError(_('تم الوصول إلى الحد الأقصى لاستخدام الكوبون لهذا المستخدم'))
+
+
+@transaction.atomic
+def redeem_coupon(coupon, user, order, discount_amount):
+    """
+    تسجيل استخدام الكوبون ضمن معاملة إتمام الطلب. الحدود تُفرض بتحديثات شرطية على العدادات
+    (تقفل صف الكوبون حتى نهاية المعاملة)، فلا تتجاوز مهما كان عدد المشترين المتزامنين،
+    ويرفع CouponRedemptionError (مع التراجع عن الطلب) عند بلوغ أي حد.
+    """
+    _claim_coupon(coupon)
+    _claim_user_counter(coupon, user)
+    usage = CouponUsage.objects.create(coupon=coupon, user=user, order=order, discount_amount=discount_amount)
+    transaction.on_commit(lambda: invalidate_user_eligibility(coupon, user.pk))
+    return usage
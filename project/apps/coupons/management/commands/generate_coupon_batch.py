@@ -0,0 +1,89 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from apps.coupons.campaigns import CouponBatchError, assign_batch, export_batch, generate_batch
+from apps.coupons.models import Coupon, CouponBatch
+from apps.coupons.tasks import generate_coupon_batch
+
+
+class Command(BaseCommand):
+    """توليد كوبونات حملة أحادية الاستخدام وتوزيعها على المستخدمين وتصديرها"""
+    help = (
+        'إنشاء دفعة كوبونات من كوبون قالب (أو استئناف دفعة بـ --batch) وتوليد أكوادها، '
+        'ثم توزيعها من ملف CSV للمستخدمين وتصديرها إلى ملف CSV'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, help='معرف دفعة قائمة لاستئنافها')
+        parser.add_argument('--template', help='كود الكوبون القالب للدفعة الجديدة')
+        parser.add_argument('--quantity', type=int, help='عدد الأكواد للدفعة الجديدة')
+        parser.add_argument('--name', default='', help='اسم الدفعة الجديدة')
+        parser.add_argument('--prefix', default='')
+        parser.add_argument('--length', type=int, default=10, help='طول الجزء العشوائي من الكود')
+        parser.add_argument('--assign', help='ملف CSV للمستخدمين بعمود email أو user_id')
+        parser.add_argument('--output', help='ملف CSV لتصدير الأكواد (- للمخرج القياسي)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--async', action='store_true', dest='run_async', help='التوليد في مهمة Celery')
+
+    def get_batch(self, options):
+        if options['batch']:
+            try:
+                return CouponBatch.objects.select_related('template').get(pk=options['batch'])
+            except CouponBatch.DoesNotExist:
+                raise CommandError(f'الدفعة {options["batch"]} غير موجودة')
+
+        if not options['template'] or not options['quantity']:
+            raise CommandError('يجب تحديد --batch أو --template و --quantity')
+        template = Coupon.objects.filter(code__iexact=options['template']).first()
+        if template is None:
+            raise CommandError(f'الكوبون {options["template"]} غير موجود')
+        batch = CouponBatch.objects.create(
+            name=options['name'] or template.name,
+            template=template,
+            prefix=options['prefix'],
+            code_length=options['length'],
+            quantity=options['quantity'],
+        )
+        self.stdout.write(f'تم إنشاء الدفعة {batch.pk}')
+        return batch
+
+    def handle(self, *args, **options):
+        batch = self.get_batch(options)
+        chunk_size = options['chunk_size']
+
+        if options['run_async']:
+            result = generate_coupon_batch.delay(batch.pk, chunk_size=chunk_size)
+            self.stdout.write(self.style.SUCCESS(f'تمت جدولة توليد الدفعة {batch.pk} في المهمة {result.id}'))
+            return
+
+        started = time.perf_counter()
+        try:
+            if batch.status != 'generated' or batch.generated < batch.quantity:
+                generate_batch(batch, chunk_size=chunk_size, progress=self.report(
+                    lambda done, total: f'تم توليد {done}/{total}', started
+                ))
+            if options['assign']:
+                with open(options['assign'], encoding='utf-8-sig', newline='') as stream:
+                    assign_batch(batch, stream, chunk_size=chunk_size, progress=self.report(
+                        lambda rows, assigned: f'تمت معالجة {rows} سطر وتوزيع {assigned} كود', started
+                    ))
+        except CouponBatchError as error:
+            raise CommandError(f'{error} (يمكن الاستئناف بـ --batch {batch.pk})')
+
+        if options['output'] == '-':
+            export_batch(batch, sys.stdout)
+        elif options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+                exported = export_batch(batch, stream, chunk_size=chunk_size)
+            self.stderr.write(f'تم تصدير {exported} كود إلى {options["output"]}')
+
+        self.stderr.write(self.style.SUCCESS(
+            f'الدفعة {batch.pk}: {batch.generated}/{batch.quantity} كود، '
+            f'{batch.assigned} موزع، خلال {time.perf_counter() - started:.2f} ث'
+        ))
+
+    def report(self, message, started):
+        """دالة تقدم تكتب في stderr كي لا تختلط بالتصدير إلى المخرج القياسي"""
+        def progress(*values):
+            self.stderr.write(f'{message(*values)} ({time.perf_counter() - started:.1f} ث)')
+        return progress
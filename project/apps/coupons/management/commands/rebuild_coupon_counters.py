@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Now
+from apps.coupons.models import Coupon, CouponUsage, CouponUserCounter
+
+
+class Command(BaseCommand):
+    """إعادة بناء عدادات استخدام الكوبونات من سجل الاستخدامات لإصلاح أي انحراف"""
+    help = 'إعادة حساب عدد استخدامات كل كوبون ولكل مستخدم وعلم التقييد بمستخدمين'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        usages = CouponUsage.objects.filter(coupon=OuterRef('pk')).order_by().values('coupon')
+
+        with transaction.atomic():
+            coupons = Coupon.objects.update(
+                times_used=Coalesce(Subquery(usages.annotate(total=Count('pk')).values('total')), Value(0)),
+                is_restricted=Exists(Coupon.users.through.objects.filter(coupon_id=OuterRef('pk'))),
+                # التحديث الجماعي لا يطبق auto_now، وتاريخ التعديل يبطل نتائج التحقق المخزنة
+                updated_at=Now(),
+            )
+
+            CouponUserCounter.objects.all().delete()
+            rows = (
+                CouponUsage.objects.values('coupon_id', 'user_id')
+                .annotate(total=Count('pk')).order_by().iterator(chunk_size=options['batch_size'])
+            )
+            counters = CouponUserCounter.objects.bulk_create(
+                (CouponUserCounter(coupon_id=row['coupon_id'], user_id=row['user_id'], times_used=row['total'])
+                 for row in rows),
+                batch_size=options['batch_size'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'تمت إعادة بناء عدادات {coupons} كوبون و{len(counters)} عداد مستخدم'
+        ))
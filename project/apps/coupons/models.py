@@ -1,5 +1,6 @@
 
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -7,6 +8,20 @@ from django.utils import timezone
 import uuid
 
 
+class CouponQuerySet(models.QuerySet):
+    """استعلامات الكوبونات"""
+
+    def available_to(self, user):
+        """الكوبونات السارية العامة أو المخصصة للمستخدم (فحص العضوية بـ EXISTS بدلاً من JOIN و DISTINCT)"""
+        now = timezone.now()
+        members = Coupon.users.through.objects.filter(coupon_id=models.OuterRef('pk'), user_id=user.pk)
+        return self.filter(
+            models.Q(end_date__isnull=True) | models.Q(end_date__gte=now),
+            is_active=True,
+            start_date__lte=now,
+        ).filter(models.Q(is_restricted=False) | models.Exists(members))
+
+
 class Coupon(models.Model):
     """نموذج الكوبونات"""
     TYPE_CHOICES = [
@@ -90,6 +105,25 @@ class Coupon(models.Model):
         related_name='coupons'
     )
 
+    # دفعة التوليد الجماعي التي أنشأت الكوبون (للحملات)
+    batch = models.ForeignKey(
+        'CouponBatch',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_('الدفعة'),
+        related_name='coupons'
+    )
+
+    # عدادات محفوظة على الصف بدلاً من COUNT(*) وفحص وجود المستخدمين عند كل تحقق
+    times_used = models.PositiveIntegerField(_('عدد مرات الاستخدام'), default=0, editable=False)
+    is_restricted = models.BooleanField(
+        _('مقصور على مستخدمين محددين'),
+        default=False,
+        editable=False
+    )
+
     # الطوابع الزمنية
     created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
     updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
@@ -98,12 +132,24 @@ class Coupon(models.Model):
         verbose_name = _('كوبون')
         verbose_name_plural = _('الكوبونات')
         ordering = ['-created_at']
+        indexes = [
+            # البحث بالكود دون حساسية لحالة الأحرف (code__iexact)
+            models.Index(Upper('code'), name='coupon_code_upper_idx'),
+            models.Index(fields=['is_active', 'start_date', 'end_date']),
+        ]
+
+    objects = CouponQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.code} - {self.name}"
 
     def is_valid(self, user=None, cart_total=None):
-        """التحقق من صلاحية الكوبون"""
+        """
+        التحقق من صلاحية الكوبون: الشروط العامة من الصف نفسه، وشروط المستخدم
+        (العضوية وعدد استخداماته) من التخزين المؤقت أو باستعلام واحد مفهرس
+        """
+        from .eligibility import get_user_eligibility
+
         # التحقق من النشاط
         if not self.is_active:
             return False, _('الكوبون غير نشط')
@@ -117,20 +163,15 @@ class Coupon(models.Model):
             return False, _('انتهت صلاحية الكوبون')
 
         # التحقق من حد الاستخدام
-        if self.usage_limit and self.usage_count >= self.usage_limit:
+        if self.usage_limit and self.times_used >= self.usage_limit:
             return False, _('تم الوصول إلى الحد الأقصى لاستخدام الكوبون')
 
-        # التحقق من المستخدم
-        if self.users.exists() and (not user or user not in self.users.all()):
-            return False, _('الكوبون غير متاح لهذا المستخدم')
-
-        # التحقق من حد الاستخدام لكل مستخدم
-        if self.usage_limit_per_user and user:
-            user_usage_count = CouponUsage.objects.filter(
-                coupon=self, 
-                user=user
-            ).count()
-            if user_usage_count >= self.usage_limit_per_user:
+        # التحقق من المستخدم وحد الاستخدام لكل مستخدم
+        if self.is_restricted or self.usage_limit_per_user:
+            is_member, user_usage_count = get_user_eligibility(self, user)
+            if self.is_restricted and not is_member:
+                return False, _('الكوبون غير متاح لهذا المستخدم')
+            if self.usage_limit_per_user and user_usage_count >= self.usage_limit_per_user:
                 return False, _('تم الوصول إلى الحد الأقصى لاستخدام الكوبون لهذا المستخدم')
 
         # التحقق من الحد الأدنى للطلب
@@ -155,10 +196,65 @@ class Coupon(models.Model):
 
         return discount
 
+    def calculate_line_discounts(self, lines):
+        """خصم الكوبون موزعاً على الأسطر المشمولة بنطاقه (انظر discounts.calculate_line_discounts)"""
+        from .discounts import calculate_line_discounts
+        return calculate_line_discounts(self, lines)
+
     @property
     def usage_count(self):
         """الحصول على عدد مرات الاستخدام"""
-        return CouponUsage.objects.filter(coupon=self).count()
+        return self.times_used
+
+
+class CouponBatch(models.Model):
+    """
+    دفعة كوبونات حملة تسويقية: عدد كبير من الأكواد أحادية الاستخدام تنسخ إعداداتها
+    من كوبون قالب، وتحفظ الدفعة تقدم التوليد والتوزيع لاستئنافه بعد أي انقطاع
+    """
+    STATUS_CHOICES = [
+        ('pending', _('بانتظار التوليد')),
+        ('generating', _('قيد التوليد')),
+        ('generated', _('تم التوليد')),
+        ('failed', _('فشل')),
+    ]
+
+    name = models.CharField(_('الاسم'), max_length=100)
+    template = models.ForeignKey(
+        Coupon,
+        on_delete=models.PROTECT,
+        verbose_name=_('الكوبون القالب'),
+        related_name='template_batches',
+        help_text=_('تنسخ منه إعدادات الخصم والتاريخ والمنتجات والفئات')
+    )
+    prefix = models.CharField(_('بادئة الكود'), max_length=10, blank=True)
+    code_length = models.PositiveSmallIntegerField(
+        _('طول الجزء العشوائي'),
+        default=10,
+        validators=[MinValueValidator(6), MaxValueValidator(32)]
+    )
+    quantity = models.PositiveIntegerField(_('عدد الأكواد'), validators=[MinValueValidator(1)])
+
+    # التقدم: يحدّث مع كل مجموعة في معاملتها نفسها
+    status = models.CharField(_('الحالة'), max_length=20, choices=STATUS_CHOICES, default='pending')
+    generated = models.PositiveIntegerField(_('الأكواد المولدة'), default=0, editable=False)
+    assigned = models.PositiveIntegerField(_('الأكواد الموزعة'), default=0, editable=False)
+    assigned_rows = models.PositiveIntegerField(
+        _('أسطر ملف المستخدمين المعالجة'),
+        default=0,
+        editable=False
+    )
+
+    created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('دفعة كوبونات')
+        verbose_name_plural = _('دفعات الكوبونات')
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.generated}/{self.quantity})"
 
 
 class CouponUsage(models.Model):
@@ -196,6 +292,31 @@ class CouponUsage(models.Model):
         return f"{self.user.username} - {self.coupon.code} - {self.discount_amount}"
 
 
+class CouponUserCounter(models.Model):
+    """عدد مرات استخدام المستخدم للكوبون، يحدّث بـ F() عند كل استخدام"""
+    coupon = models.ForeignKey(
+        Coupon,
+        on_delete=models.CASCADE,
+        verbose_name=_('الكوبون'),
+        related_name='user_counters'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name=_('المستخدم'),
+        related_name='coupon_counters'
+    )
+    times_used = models.PositiveIntegerField(_('عدد مرات الاستخدام'), default=0)
+
+    class Meta:
+        verbose_name = _('عداد استخدام الكوبون')
+        verbose_name_plural = _('عدادات استخدام الكوبونات')
+        unique_together = ('coupon', 'user')
+
+    def __str__(self):
+        return f"{self.user_id} - {self.coupon_id}: {self.times_used}"
+
+
 class UserCoupon(models.Model):
     """نموذج كوبونات المستخدم"""
     user = models.ForeignKey(
@@ -1,8 +1,9 @@
 
-from django.db.models.signals import post_save
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
 from django.utils import timezone
-from .models import CouponUsage
+from .models import Coupon, CouponUsage
 
 
 @receiver(post_save, sender=CouponUsage)
@@ -22,3 +23,32 @@ def update_user_coupon(sender, instance, created, **kwargs):
             user_coupon.save()
         except UserCoupon.DoesNotExist:
             pass
+
+
+@receiver(m2m_changed, sender=Coupon.users.through)
+@receiver(m2m_changed, sender=Coupon.products.through)
+@receiver(m2m_changed, sender=Coupon.categories.through)
+def refresh_coupon_on_relations_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    تحديث علم تقييد الكوبون بمستخدمين وتاريخ تعديله عند تغيير مستخدميه أو منتجاته أو فئاته،
+    فتُهمل نتائج التحقق المخزنة مؤقتاً
+    """
+    if reverse and action == 'pre_clear':
+        # post_clear من جهة المستخدم أو المنتج أو الفئة لا يحمل المعرفات؛ تُحفظ كوبوناته قبل الحذف
+        field = next(field.attname for field in sender._meta.fields if field.related_model is type(instance))
+        instance._cleared_coupon_ids = list(
+            sender.objects.filter(**{field: instance.pk}).values_list('coupon_id', flat=True)
+        )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        coupon_ids = pk_set if action != 'post_clear' else instance.__dict__.pop('_cleared_coupon_ids', ())
+        coupons = Coupon.objects.filter(pk__in=coupon_ids)
+    else:
+        coupons = Coupon.objects.filter(pk=instance.pk)
+
+    updates = {'updated_at': timezone.now()}
+    if sender is Coupon.users.through:
+        updates['is_restricted'] = Exists(Coupon.users.through.objects.filter(coupon_id=OuterRef('pk')))
+    coupons.update(**updates)
@@ -0,0 +1,32 @@
+import io
+from celery import shared_task
+from django.core.files.storage import default_storage
+from .campaigns import assign_batch, generate_batch
+from .models import CouponBatch
+
+
+@shared_task(bind=True)
+def generate_coupon_batch(self, batch_id, chunk_size=2000):
+    """توليد أكواد دفعة كوبونات (أو استئنافه) مع نشر التقدم في حالة المهمة"""
+    batch = CouponBatch.objects.select_related('template').get(pk=batch_id)
+    return generate_batch(
+        batch,
+        chunk_size=chunk_size,
+        progress=lambda done, total: self.update_state(state='PROGRESS', meta={'done': done, 'total': total}),
+    )
+
+
+@shared_task(bind=True)
+def assign_coupon_batch(self, batch_id, path, chunk_size=2000):
+    """توزيع أكواد الدفعة على مستخدمي ملف CSV محفوظ في التخزين الافتراضي (أو استئنافه)"""
+    batch = CouponBatch.objects.get(pk=batch_id)
+    with default_storage.open(path, 'rb') as raw:
+        stream = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+        return assign_batch(
+            batch,
+            stream,
+            chunk_size=chunk_size,
+            progress=lambda rows, assigned: self.update_state(
+                state='PROGRESS', meta={'rows': rows, 'assigned': assigned}
+            ),
+        )
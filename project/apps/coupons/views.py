@@ -1,5 +1,6 @@
 
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import render, get_object_or_404, redirect
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
@@ -11,10 +12,11 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from decimal import Decimal
 
+from .discounts import calculate_cart_discounts
 from .models import Coupon, CouponUsage, UserCoupon
 from .serializers import CouponSerializer, CouponUsageSerializer, UserCouponSerializer
 from .forms import CouponForm, ApplyCouponForm
-from apps.cart.views import get_or_create_cart
+from apps.cart.storage import build_items, get_cart_store
 from apps.cart.models import Cart
 
 
@@ -24,14 +26,7 @@ class CouponListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        return Coupon.objects.filter(
-            is_active=True,
-            start_date__lte=timezone.now(),
-            end_date__gte=timezone.now()
-        ).filter(
-            models.Q(users__in=[user]) | models.Q(users__isnull=True)
-        ).distinct()
+        return Coupon.objects.available_to(self.request.user)
 
 
 class UserCouponListView(generics.ListAPIView):
@@ -63,9 +58,9 @@ def apply_coupon(request):
             status=status.HTTP_404_NOT_FOUND
         )
 
-    # الحصول على سلة التسوق
-    cart = get_or_create_cart(request)
-    cart_total = cart.get_total_price()
+    # الحصول على عناصر سلة التسوق
+    items = build_items(get_cart_store(request).get_lines())
+    cart_total = sum((item.get_total_price() for item in items), Decimal('0'))
 
     # التحقق من صلاحية الكوبون
     is_valid, message = coupon.is_valid(
@@ -79,8 +74,14 @@ def apply_coupon(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    # حساب الخصم
-    discount = coupon.calculate_discount(cart_total)
+    # حساب الخصم على العناصر المشمولة بنطاق الكوبون
+    breakdown = calculate_cart_discounts(coupon, items)
+    if not breakdown.eligible_subtotal:
+        return Response(
+            {'error': _('الكوبون لا يشمل أياً من منتجات السلة')},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    discount = breakdown.discount
 
     # حفظ الكوبون في الجلسة
     request.session['coupon_code'] = coupon.code
@@ -94,6 +95,9 @@ def apply_coupon(request):
             'discount_value': float(coupon.discount_value),
             'discount': float(discount)
         },
+        'lines': {
+            line.key: float(line.discount) for line in breakdown.lines if line.eligible
+        },
         'cart_total': float(cart_total),
         'new_total': float(cart_total - discount)
     })
@@ -108,8 +112,7 @@ def remove_coupon(request):
     request.session.pop('coupon_discount', None)
 
     # الحصول على سلة التسوق
-    cart = get_or_create_cart(request)
-    cart_total = cart.get_total_price()
+    cart_total = get_cart_store(request).get_total()
 
     return Response({
         'cart_total': float(cart_total),
@@ -171,13 +174,7 @@ def validate_coupon(request):
 def my_coupons(request):
     """صفحة كوبونات المستخدم"""
     # الكوبونات المتاحة
-    available_coupons = Coupon.objects.filter(
-        is_active=True,
-        start_date__lte=timezone.now(),
-        end_date__gte=timezone.now()
-    ).filter(
-        models.Q(users__in=[request.user]) | models.Q(users__isnull=True)
-    ).distinct()
+    available_coupons = Coupon.objects.available_to(request.user)
 
     # كوبونات المستخدم
     user_coupons = UserCoupon.objects.filter(user=request.user)
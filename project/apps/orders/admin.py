@@ -1,16 +1,18 @@
 
-from django.contrib import admin
-from .models import Order, OrderItem, OrderStatusHistory
+from django import forms
+from django.contrib import admin, messages
+from django.utils.translation import gettext_lazy as _, ngettext
+from .models import InvalidTransitionError, Order, OrderItem, OrderStatusHistory
 
 
 class OrderItemInline(admin.TabularInline):
     """عرض عناصر الطلب كعناصر مضمنة في صفحة الطلب"""
     model = OrderItem
     extra = 0
-    readonly_fields = ('product_name', 'product_sku', 'price', 'compare_price', 'total')
+    readonly_fields = ('product_name', 'product_sku', 'price', 'compare_price', 'total', 'discount')
     fields = (
         'product', 'variant', 'product_name', 'product_sku', 'product_image',
-        'price', 'compare_price', 'quantity', 'total'
+        'price', 'compare_price', 'quantity', 'total', 'discount'
     )
 
 
@@ -22,30 +24,48 @@ class OrderStatusHistoryInline(admin.TabularInline):
     fields = ('status', 'notes', 'created_at', 'created_by')
 
 
+class OrderAdminForm(forms.ModelForm):
+    """نموذج الطلب في لوحة التحكم مع التحقق من انتقال الحالة"""
+
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+    def clean_status(self):
+        status = self.cleaned_data['status']
+        order = self.instance
+        if order.pk and status != order.status and not order.can_transition_to(status):
+            raise forms.ValidationError(str(InvalidTransitionError(order.status, status)))
+        return status
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     """إعدادات عرض الطلبات في لوحة التحكم"""
+    form = OrderAdminForm
     list_display = (
         'order_number', 'user', 'status', 'payment_status', 
         'total', 'created_at'
     )
     list_filter = (
         'status', 'payment_status', 'payment_method', 
-        'shipping_method', 'created_at'
+        'shipping_method', 'requires_review', 'created_at'
     )
     search_fields = (
         'order_number', 'user__email', 'user__username', 
         'transaction_id', 'tracking_number'
     )
     readonly_fields = (
-        'order_number', 'created_at', 'updated_at'
+        'order_number', 'amount_paid', 'amount_refunded', 'created_at', 'updated_at'
     )
     inlines = [OrderItemInline, OrderStatusHistoryInline]
+    actions = ['mark_processing', 'mark_shipped', 'mark_delivered']
 
     fieldsets = (
         ('معلومات الطلب', {
             'fields': (
-                'order_number', 'user', 'status', 'notes'
+                'order_number', 'user', 'status', 'notes',
+                'requires_review', 'review_reason'
             )
         }),
         ('معلومات الشحن', {
@@ -56,7 +76,8 @@ class OrderAdmin(admin.ModelAdmin):
         }),
         ('معلومات الدفع', {
             'fields': (
-                'payment_method', 'payment_status', 'transaction_id'
+                'payment_method', 'payment_status', 'transaction_id',
+                'amount_paid', 'amount_refunded'
             )
         }),
         ('التكاليف', {
@@ -72,6 +93,38 @@ class OrderAdmin(admin.ModelAdmin):
     )
 
 
+    def save_model(self, request, obj, form, change):
+        if change and obj.has_status_changed():
+            # الانتقال يحفظ الطلب ويطبق آثاره على المخزون
+            status, obj.status = obj.status, obj.get_original_status()
+            obj.transition_to(status, user=request.user)
+        else:
+            super().save_model(request, obj, form, change)
+
+    def _set_status(self, request, queryset, status):
+        # تحديثات وإدراجات جماعية لسجلات الحالة مهما كان عدد الطلبات المحددة
+        result = queryset.transition(status, user=request.user)
+        self.message_user(request, ngettext(
+            'تم تحديث حالة %d طلب', 'تم تحديث حالة %d طلبات', result.transitioned
+        ) % result.transitioned, messages.SUCCESS)
+        if result.failures:
+            self.message_user(request, ngettext(
+                'تعذر تحديث %d طلب', 'تعذر تحديث %d طلبات', len(result.failures)
+            ) % len(result.failures), messages.WARNING)
+
+    @admin.action(description=_('تحديد كقيد المعالجة'))
+    def mark_processing(self, request, queryset):
+        self._set_status(request, queryset, 'processing')
+
+    @admin.action(description=_('تحديد كتم الشحن'))
+    def mark_shipped(self, request, queryset):
+        self._set_status(request, queryset, 'shipped')
+
+    @admin.action(description=_('تحديد كتم التسليم'))
+    def mark_delivered(self, request, queryset):
+        self._set_status(request, queryset, 'delivered')
+
+
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     """إعدادات عرض عناصر الطلب في لوحة التحكم"""
@@ -0,0 +1,190 @@
+"""
+تصدير الطلبات للمالية
+
+سطر لكل عنصر طلب مع بيانات طلبه وعميله وعنوان شحنه، من استعلام واحد بالربط
+يُقرأ بمؤشر من جهة الخادم (iterator(chunk_size))، ويُكتب تدفقياً بصيغة CSV أو NDJSON أو Parquet.
+لا يُحتفظ في الذاكرة إلا بمجموعة الأسطر الحالية (ومجموعة أسطر Parquet)، فيبقى استهلاكها ثابتاً
+مهما كان عدد العناصر، سواء كُتب التصدير إلى ملف أو بُث في استجابة HTTP.
+"""
+import csv
+import io
+from datetime import datetime, time, timedelta
+from itertools import chain
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .models import OrderItem
+
+
+# (اسم العمود، مسار الحقل من عنصر الطلب، نوع Parquet)
+EXPORT_COLUMNS = (
+    ('order_number', 'order__order_number', 'string'),
+    ('created_at', 'order__created_at', 'timestamp'),
+    ('status', 'order__status', 'string'),
+    ('payment_method', 'order__payment_method', 'string'),
+    ('payment_status', 'order__payment_status', 'string'),
+    ('customer_email', 'order__user__email', 'string'),
+    ('shipping_city', 'order__shipping_address__city', 'string'),
+    ('shipping_country', 'order__shipping_address__country', 'string'),
+    ('order_subtotal', 'order__subtotal', 'decimal'),
+    ('order_discount', 'order__discount', 'decimal'),
+    ('order_tax', 'order__tax', 'decimal'),
+    ('order_shipping_cost', 'order__shipping_cost', 'decimal'),
+    ('order_total', 'order__total', 'decimal'),
+    ('product_sku', 'product_sku', 'string'),
+    ('product_name', 'product_name', 'string'),
+    ('price', 'price', 'decimal'),
+    ('quantity', 'quantity', 'integer'),
+    ('item_discount', 'discount', 'decimal'),
+    ('item_total', 'total', 'decimal'),
+)
+
+COLUMN_NAMES = [column[0] for column in EXPORT_COLUMNS]
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# حجم الكتلة المكتوبة في CSV و NDJSON قبل إرسالها، وعدد الأسطر في كل مجموعة أسطر Parquet
+BUFFER_SIZE = 64 * 1024
+PARQUET_ROW_GROUP_SIZE = 50_000
+
+
+class ExportError(Exception):
+    """تعذر التصدير بالصيغة المطلوبة"""
+
+
+def export_queryset(date_from=None, date_to=None, statuses=None):
+    """
+    عناصر الطلبات المصدرة كصفوف قيم بترتيب EXPORT_COLUMNS. التواريخ أيام شاملة بالتوقيت المحلي
+    وتحول إلى مدى على created_at كي يستخدم فهرسه.
+    """
+    items = OrderItem.objects.all()
+    if date_from:
+        items = items.filter(order__created_at__gte=timezone.make_aware(datetime.combine(date_from, time.min)))
+    if date_to:
+        items = items.filter(
+            order__created_at__lt=timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+        )
+    if statuses:
+        items = items.filter(order__status__in=statuses)
+    return items.order_by('order_id', 'pk').values_list(*(column[1] for column in EXPORT_COLUMNS))
+
+
+def _buffered(lines):
+    """ضم الأسطر النصية في كتل بحجم BUFFER_SIZE تقريباً بدلاً من إرسال كل سطر وحده"""
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer).encode()
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+class _LineWriter:
+    """كائن بواجهة الملف يعيد السطر المكتوب بدلاً من تخزينه"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_LineWriter())
+    yield from _buffered(writer.writerow(row) for row in chain([COLUMN_NAMES], rows))
+
+
+def iter_ndjson(rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    yield from _buffered(
+        encoder.encode(dict(zip(COLUMN_NAMES, row))) + '\n' for row in rows
+    )
+
+
+class _StreamSink(io.RawIOBase):
+    """ملف Parquet قابل للكتابة فقط يحتفظ بالبايتات حتى تُسحب، مع موضع الكتابة الكلي الذي يحتاجه الكاتب"""
+
+    def __init__(self):
+        super().__init__()
+        self.position = 0
+        self.pending = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.pending.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data, self.pending = b''.join(self.pending), []
+        return data
+
+
+def _parquet_schema(pa):
+    types = {
+        'string': pa.string(),
+        'timestamp': pa.timestamp('us', tz='UTC'),
+        'decimal': pa.decimal128(10, 2),
+        'integer': pa.int64(),
+    }
+    return pa.schema([(name, types[kind]) for name, path, kind in EXPORT_COLUMNS])
+
+
+def iter_parquet(rows):
+    """Parquet بمجموعة أسطر لكل PARQUET_ROW_GROUP_SIZE سطر؛ يتطلب pyarrow (يُتحقق منه قبل بدء البث)"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError(_('تصدير Parquet يتطلب تثبيت pyarrow'))
+    return _parquet_chunks(rows, pa, pq)
+
+
+def _parquet_chunks(rows, pa, pq):
+    schema = _parquet_schema(pa)
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    def write(group):
+        columns = zip(*group)
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+        ))
+        return sink.drain()
+
+    group = []
+    for row in rows:
+        group.append(row)
+        if len(group) >= PARQUET_ROW_GROUP_SIZE:
+            yield write(group)
+            group = []
+    if group:
+        yield write(group)
+    writer.close()
+    yield sink.drain()
+
+
+WRITERS = {
+    'csv': iter_csv,
+    'ndjson': iter_ndjson,
+    'parquet': iter_parquet,
+}
+
+
+def export_orders(format, date_from=None, date_to=None, statuses=None, chunk_size=2000):
+    """كتل بايتات التصدير بالصيغة (csv أو ndjson أو parquet) للطلبات المطابقة للمرشحات"""
+    if format not in WRITERS:
+        raise ExportError(_('صيغة تصدير غير مدعومة: %s') % format)
+    queryset = export_queryset(date_from=date_from, date_to=date_to, statuses=statuses)
+    return WRITERS[format](queryset.iterator(chunk_size=chunk_size))
@@ -0,0 +1,83 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, OperationalError, connections, transaction
+from apps.orders.models import Order
+from apps.orders.numbering import get_order_number_generator
+
+
+BENCHMARK_NOTE = 'benchmark_order_numbers'
+
+
+def create_orders(count, numbers_only=False):
+    """إنشاء طلبات تجريبية وإرجاع أرقامها وعدد أخطاء التكرار والأخطاء الأخرى"""
+    numbers, collisions, errors = [], 0, 0
+    try:
+        for _ in range(count):
+            if numbers_only:
+                numbers.append(get_order_number_generator().generate())
+                continue
+            try:
+                with transaction.atomic():
+                    order = Order.objects.create(subtotal=0, total=0, notes=BENCHMARK_NOTE)
+                numbers.append(order.order_number)
+            except IntegrityError:
+                collisions += 1
+            except OperationalError:
+                # مثل قفل قاعدة SQLite عند الكتابة المتزامنة؛ لا علاقة له بالترقيم
+                errors += 1
+    finally:
+        connections.close_all()
+    return numbers, collisions, errors
+
+
+class Command(BaseCommand):
+    """قياس أداء مولد أرقام الطلبات والتحقق من عدم التكرار تحت التزامن"""
+    help = 'إنشاء طلبات متزامنة من عدة خيوط أو عمليات وعرض عدد التكرارات ومعدل الإنشاء'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--orders', type=int, default=250, help='عدد الطلبات لكل عامل')
+        parser.add_argument('--mode', choices=['thread', 'process'], default='thread')
+        parser.add_argument('--numbers-only', action='store_true', help='توليد الأرقام دون إنشاء طلبات')
+        parser.add_argument('--keep', action='store_true', help='عدم حذف الطلبات التجريبية')
+
+    def handle(self, *args, **options):
+        workers, count = options['workers'], options['orders']
+        numbers_only = options['numbers_only']
+
+        if options['mode'] == 'process':
+            # تُغلق الاتصالات قبل fork لتفتح كل عملية ابنة اتصالاتها الخاصة
+            connections.close_all()
+            executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+        else:
+            executor = ThreadPoolExecutor(workers)
+
+        started = time.perf_counter()
+        with executor:
+            results = list(executor.map(create_orders, [count] * workers, [numbers_only] * workers))
+        elapsed = time.perf_counter() - started
+
+        numbers = [number for worker_numbers, _, _ in results for number in worker_numbers]
+        collisions = sum(worker_collisions for _, worker_collisions, _ in results)
+        errors = sum(worker_errors for _, _, worker_errors in results)
+        duplicates = len(numbers) - len(set(numbers))
+        unordered = sum(
+            1 for worker_numbers, _, _ in results
+            for previous, current in zip(worker_numbers, worker_numbers[1:]) if current <= previous
+        )
+
+        if not numbers_only and not options['keep']:
+            Order.objects.filter(notes=BENCHMARK_NOTE).delete()
+
+        self.stdout.write(
+            f'{get_order_number_generator().__class__.__name__}: {workers} {options["mode"]} × {count}\n'
+            f'الأرقام: {len(numbers)}، المكررة: {duplicates}، أخطاء التكرار: {collisions}، '
+            f'غير المتزايدة داخل العامل: {unordered}، أخطاء أخرى: {errors}\n'
+            f'الزمن: {elapsed:.2f} ث، المعدل: {len(numbers) / elapsed if elapsed else 0:.0f} طلب/ث'
+        )
+        if duplicates or collisions or unordered:
+            self.stdout.write(self.style.ERROR('فشل: أرقام مكررة أو غير مرتبة'))
+        else:
+            self.stdout.write(self.style.SUCCESS('لا توجد أرقام مكررة'))
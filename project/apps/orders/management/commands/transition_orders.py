@@ -0,0 +1,51 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from apps.orders.models import InvalidTransitionError, Order
+from apps.orders.services import transition_orders
+
+
+class Command(BaseCommand):
+    """نقل الطلبات إلى حالة جديدة على دفعات"""
+    help = 'نقل الطلبات المحددة بالمعرفات أو بملف أرقام أو بحالتها الحالية إلى حالة جديدة'
+
+    def add_arguments(self, parser):
+        parser.add_argument('status', choices=[choice for choice, _ in Order.STATUS_CHOICES])
+        parser.add_argument('--ids', default='', help='معرفات مفصولة بفواصل')
+        parser.add_argument('--file', help='ملف بمعرف أو رقم طلب في كل سطر')
+        parser.add_argument('--from-status', help='نقل جميع الطلبات التي في هذه الحالة')
+        parser.add_argument('--notes', default='')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--show-failures', type=int, default=20, help='عدد حالات الفشل المعروضة')
+
+    def handle(self, *args, **options):
+        ids = {int(value) for value in options['ids'].split(',') if value.strip()}
+        order_numbers = set()
+        if options['file']:
+            with open(options['file'], encoding='utf-8') as lines:
+                for line in lines:
+                    value = line.strip()
+                    if value.isdigit():
+                        ids.add(int(value))
+                    elif value:
+                        order_numbers.add(value)
+        if options['from_status']:
+            ids.update(Order.objects.filter(status=options['from_status']).values_list('pk', flat=True))
+        if not ids and not order_numbers:
+            raise CommandError('لم تُحدد أي طلبات')
+
+        started = time.perf_counter()
+        try:
+            result = transition_orders(
+                options['status'], ids=ids, order_numbers=order_numbers,
+                notes=options['notes'], batch_size=options['batch_size'],
+            )
+        except InvalidTransitionError as error:
+            raise CommandError(str(error))
+        elapsed = time.perf_counter() - started
+
+        for key, message in list(result.failures.items())[:options['show_failures']]:
+            self.stderr.write(f'{key}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f'تم نقل {result.transitioned} طلب إلى {options["status"]} '
+            f'وتعذر نقل {len(result.failures)} خلال {elapsed:.2f} ث'
+        ))
@@ -1,11 +1,135 @@
 
-from django.db import models
+from collections import namedtuple
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.db.models.base import DEFERRED
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
-from apps.products.models import Product, ProductVariant
+from apps.products.inventory import commit_orders, restock_orders
+from apps.products.models import Product, ProductImage, ProductVariant, ProductVariantOption
 from apps.users.models import Address
 
 
+# الطوابع الزمنية التي تُسجل عند الانتقال إلى الحالة
+STATUS_TIMESTAMPS = {
+    'shipped': 'shipped_at',
+    'delivered': 'delivered_at',
+}
+
+
+# آثار الانتقال على المخزون: تأكيد الطلب يخصم المحجوز وإلغاؤه يعيد الكميات
+TRANSITION_EFFECTS = {
+    'confirmed': commit_orders,
+    'cancelled': restock_orders,
+}
+
+
+class InvalidTransitionError(Exception):
+    """انتقال غير مسموح بين حالتين للطلب"""
+
+    def __init__(self, source, target):
+        self.source, self.target = source, target
+        labels = dict(Order.STATUS_CHOICES)
+        super().__init__(_('لا يمكن نقل الطلب من %(source)s إلى %(target)s') % {
+            'source': labels.get(source, source), 'target': labels.get(target, target),
+        })
+
+
+TransitionResult = namedtuple('TransitionResult', ['transitioned', 'failures'])
+
+
+class OrderQuerySet(models.QuerySet):
+    """استعلامات الطلبات المشتركة"""
+
+    def with_summary(self):
+        """
+        ملخص الطلب لقوائم الطلبات باستعلام واحد: عدد العناصر وصورة أول عنصر
+        كاستعلامين فرعيين بدلاً من تحميل العناصر
+        """
+        items = OrderItem.objects.filter(order=models.OuterRef('pk')).order_by()
+        return self.annotate(
+            item_count=Coalesce(
+                models.Subquery(items.values('order').annotate(count=models.Count('pk')).values('count')),
+                models.Value(0),
+            ),
+            thumbnail=models.Subquery(items.order_by('pk').values('product_image')[:1]),
+        )
+
+    def for_detail(self):
+        """
+        تفاصيل الطلب بعدد ثابت من الاستعلامات مهما كان عدد العناصر: الطلب مع عنوانيه،
+        ثم العناصر مع منتجاتها ومتغيراتها، والصورة الرئيسية لكل منتج، وخيارات المتغيرات، وسجل الحالة مع منشئيه
+        """
+        items = OrderItem.objects.select_related(
+            'product__category', 'product__brand', 'variant__image'
+        ).prefetch_related(
+            models.Prefetch(
+                'product__images',
+                queryset=ProductImage.objects.order_by('-is_featured', 'sort_order', 'id')[:1],
+                to_attr='listing_images',
+            ),
+            models.Prefetch(
+                'variant__productvariantoption_set',
+                queryset=ProductVariantOption.objects.select_related('option_value__option'),
+            ),
+        ).order_by('pk')
+        return self.select_related('shipping_address', 'billing_address').prefetch_related(
+            models.Prefetch('items', queryset=items),
+            models.Prefetch('status_history', queryset=OrderStatusHistory.objects.select_related('created_by')),
+        )
+
+    def transition(self, status, user=None, notes='', batch_size=1000):
+        """
+        نقل الطلبات إلى الحالة على دفعات: لكل دفعة قفل وقراءة الحالات، وتحديث واحد
+        للطلبات المسموح نقلها، وإدراج جماعي لسجلات الحالة، ثم آثار الانتقال على المخزون.
+        لا تُحمّل الطلبات ولا تُستدعى save(). يعيد عدد المنقولة وأسباب الفشل {pk: رسالة}.
+        """
+        sources = Order.get_sources(status)
+        labels = dict(Order.STATUS_CHOICES)
+        transitioned, failures = 0, {}
+        pks = list(self.order_by('pk').values_list('pk', flat=True))
+
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start + batch_size]
+            with transaction.atomic(using=self.db):
+                rows = dict(
+                    Order.objects.using(self.db).filter(pk__in=batch).select_for_update()
+                    .order_by('pk').values_list('pk', 'status')
+                )
+                allowed = []
+                for pk in batch:
+                    if pk not in rows:
+                        failures[pk] = str(_('الطلب غير موجود'))
+                    elif rows[pk] not in sources:
+                        failures[pk] = str(InvalidTransitionError(rows[pk], status))
+                    else:
+                        allowed.append(pk)
+                if not allowed:
+                    continue
+
+                now = timezone.now()
+                updates = {'status': status, 'updated_at': now}
+                if status in STATUS_TIMESTAMPS:
+                    updates[STATUS_TIMESTAMPS[status]] = now
+                Order.objects.using(self.db).filter(pk__in=allowed).update(**updates)
+                OrderStatusHistory.objects.using(self.db).bulk_create([
+                    OrderStatusHistory(
+                        order_id=pk,
+                        status=status,
+                        notes=notes or Order.status_change_notes(labels[rows[pk]], labels[status]),
+                        created_by=user,
+                    )
+                    for pk in allowed
+                ], batch_size=batch_size)
+                if status in TRANSITION_EFFECTS:
+                    TRANSITION_EFFECTS[status](allowed)
+            transitioned += len(allowed)
+
+        return TransitionResult(transitioned, failures)
+
+
 class Order(models.Model):
     """نموذج الطلبات"""
     STATUS_CHOICES = [
@@ -18,6 +142,17 @@ class Order(models.Model):
         ('refunded', _('مسترد')),
     ]
 
+    # الانتقالات المسموحة من كل حالة
+    TRANSITIONS = {
+        'pending': ('confirmed', 'cancelled'),
+        'confirmed': ('processing', 'cancelled', 'refunded'),
+        'processing': ('shipped', 'cancelled', 'refunded'),
+        'shipped': ('delivered', 'refunded'),
+        'delivered': ('refunded',),
+        'cancelled': (),
+        'refunded': (),
+    }
+
     # معلومات الطلب
     order_number = models.CharField(_('رقم الطلب'), max_length=50, unique=True)
     user = models.ForeignKey(
@@ -82,6 +217,19 @@ class Order(models.Model):
         max_length=100, 
         blank=True
     )
+    # أرصدة دفتر الدفعات: تزاد بفروق F() مع كل معاملة، وحالة الدفع مشتقة منها
+    amount_paid = models.DecimalField(
+        _('المبلغ المدفوع'),
+        max_digits=10,
+        decimal_places=2,
+        default=0
+    )
+    amount_refunded = models.DecimalField(
+        _('المبلغ المسترد'),
+        max_digits=10,
+        decimal_places=2,
+        default=0
+    )
 
     # التكاليف
     subtotal = models.DecimalField(
@@ -110,6 +258,10 @@ class Order(models.Model):
     # ملاحظات
     notes = models.TextField(_('ملاحظات'), blank=True)
 
+    # المراجعة اليدوية (نقص المخزون عند التأكيد، أو دفع لطلب لا يقبل التأكيد)
+    requires_review = models.BooleanField(_('يحتاج مراجعة'), default=False)
+    review_reason = models.CharField(_('سبب المراجعة'), max_length=255, blank=True)
+
     # الطوابع الزمنية
     created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
     updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
@@ -135,19 +287,123 @@ class Order(models.Model):
             models.Index(fields=['order_number']),
             models.Index(fields=['created_at']),
             models.Index(fields=['total']),
+            models.Index(fields=['user', 'created_at', 'id']),
         ]
 
+    objects = OrderQuerySet.as_manager()
+
+    # الحالة كما قُرئت من قاعدة البيانات (None للطلب الجديد)، وبيانات سجل الحالة التالي
+    _loaded_status = None
+    status_changed_by = None
+    status_notes = ''
+
     def __str__(self):
         return f"طلب #{self.order_number}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status', DEFERRED)
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        if fields is None or 'status' in fields:
+            self._loaded_status = self.status
+
+    def get_original_status(self):
+        """الحالة المحفوظة قبل التعديلات غير المحفوظة، دون استعلام إلا إذا كان الحقل مؤجلاً"""
+        if self._loaded_status is DEFERRED:
+            self._loaded_status = type(self)._base_manager.filter(pk=self.pk).order_by('pk').values_list(
+                'status', flat=True
+            ).first()
+        return self._loaded_status
+
+    def has_status_changed(self):
+        """هل تغيرت الحالة منذ التحميل أو الحفظ الأخير"""
+        if 'status' not in self.__dict__:
+            # حقل مؤجل لم يُقرأ ولم يُعدل
+            return False
+        return self.get_original_status() != self.status
+
+    def set_status(self, status, user=None, notes=''):
+        """تغيير الحالة مع المستخدم والملاحظات التي تُسجل في سجل الحالة عند الحفظ"""
+        self.status = status
+        self.status_changed_by = user
+        self.status_notes = notes
+
+    @classmethod
+    def get_sources(cls, status):
+        """الحالات التي يمكن الانتقال منها إلى الحالة"""
+        if status not in cls.TRANSITIONS:
+            raise InvalidTransitionError(None, status)
+        return [source for source, targets in cls.TRANSITIONS.items() if status in targets]
+
+    @staticmethod
+    def derive_payment_status(paid, refunded, total):
+        """حالة الدفع من المدفوع والمسترد وإجمالي الطلب"""
+        if paid >= total:
+            if refunded >= total:
+                return 'refunded'
+            return 'partially_refunded' if refunded > 0 else 'paid'
+        return 'partially_paid' if paid > 0 else 'unpaid'
+
+    @staticmethod
+    def payment_status_expression(paid, refunded):
+        """derive_payment_status كتعبير استعلام على قيم المدفوع والمسترد الجديدة (تعبيرات F)"""
+        total = models.F('total')
+        return models.Case(
+            models.When(models.Q(GreaterThanOrEqual(paid, total), GreaterThanOrEqual(refunded, total)),
+                        then=models.Value('refunded')),
+            models.When(models.Q(GreaterThanOrEqual(paid, total), GreaterThan(refunded, 0)),
+                        then=models.Value('partially_refunded')),
+            models.When(GreaterThanOrEqual(paid, total), then=models.Value('paid')),
+            models.When(GreaterThan(paid, 0), then=models.Value('partially_paid')),
+            default=models.Value('unpaid'),
+            output_field=models.CharField(),
+        )
+
+    def can_transition_to(self, status):
+        """هل يسمح بالانتقال من الحالة الحالية إلى الحالة"""
+        return status in self.TRANSITIONS.get(self.status, ())
+
+    def transition_to(self, status, user=None, notes=''):
+        """نقل الطلب إلى الحالة بعد التحقق من الانتقال، مع سجل الحالة وآثاره على المخزون"""
+        if not self.can_transition_to(status):
+            raise InvalidTransitionError(self.status, status)
+        with transaction.atomic():
+            self.set_status(status, user=user, notes=notes)
+            self.save()
+            if status in TRANSITION_EFFECTS:
+                TRANSITION_EFFECTS[status]([self.pk])
+
+    @staticmethod
+    def status_change_notes(old_label, new_label):
+        return f'تم تغيير الحالة من {old_label} إلى {new_label}'
+
     def save(self, *args, **kwargs):
         # إنشاء رقم الطلب تلقائياً
         if not self.order_number:
-            from django.utils import timezone
-            now = timezone.now()
-            self.order_number = f"ORD-{now.strftime('%Y%m%d')}-{now.strftime('%H%M%S')}"
+            from .numbering import generate_order_number
+            self.order_number = generate_order_number()
+
+        # تحديث الطوابع الزمنية عند الانتقال إلى الحالة
+        update_fields = kwargs.get('update_fields')
+        tracks_status = update_fields is None or 'status' in update_fields
+        # (has_status_changed يقرأ الحالة المؤجلة إن وجدت قبل الكتابة فوقها)
+        if not self._state.adding and tracks_status and self.has_status_changed():
+            field = STATUS_TIMESTAMPS.get(self.status)
+            if field:
+                setattr(self, field, timezone.now())
+                if update_fields is not None:
+                    kwargs['update_fields'] = {*update_fields, field}
         super().save(*args, **kwargs)
 
+        if tracks_status:
+            self._loaded_status = self.status
+            self.status_changed_by = None
+            self.status_notes = ''
+
 
 class OrderItem(models.Model):
     """نموذج عناصر الطلب"""
@@ -187,6 +443,13 @@ class OrderItem(models.Model):
     )
     quantity = models.PositiveIntegerField(_('الكمية'))
     total = models.DecimalField(_('الإجمالي'), max_digits=10, decimal_places=2)
+    discount = models.DecimalField(
+        _('خصم الكوبون'),
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        help_text=_('نصيب السطر من خصم الكوبون')
+    )
 
     class Meta:
         verbose_name = _('عنصر الطلب')
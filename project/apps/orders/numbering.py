@@ -0,0 +1,152 @@
+"""
+مولدات أرقام الطلبات
+
+رقم الطلب بالشكل ORD-YYYYMMDD-NNNNNNNN حيث NNNNNNNN تسلسل عام لا يتكرر.
+كل عملية تحجز من المصدر المشترك (تسلسل PostgreSQL أو INCRBY في Redis) كتلة من الأرقام
+دفعة واحدة ثم توزعها من الذاكرة، فلا يحتاج المسار المعتاد أي رحلة لقاعدة البيانات أو Redis.
+الأرقام متزايدة داخل العملية الواحدة ومرتبة حسب اليوم بين العمليات،
+وتضيع بقية الكتلة عند إعادة تشغيل العملية (فجوات مقبولة في الترقيم).
+"""
+import os
+import threading
+from functools import lru_cache
+from django.conf import settings
+from django.db import connection, connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from config.redis import get_redis_connection
+
+
+PREFIX = 'ORD'
+SEQUENCE_WIDTH = 8
+SEQUENCE_NAME = 'orders_order_number_seq'
+
+
+def format_order_number(value, date=None):
+    """تنسيق رقم الطلب من قيمة التسلسل وتاريخ اليوم"""
+    date = date or timezone.localdate()
+    return f'{PREFIX}-{date:%Y%m%d}-{value:0{SEQUENCE_WIDTH}d}'
+
+
+def parse_order_number(order_number):
+    """قيمة التسلسل من رقم الطلب، أو None إذا لم يكن بالشكل المتوقع"""
+    try:
+        return int(order_number.rsplit('-', 1)[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class BlockOrderNumberGenerator:
+    """
+    أساس المولدات: يوزع أرقام الكتلة المحجوزة من الذاكرة تحت قفل،
+    ويحجز كتلة جديدة عند نفادها. allocate_block يعيد أول رقم في كتلة بحجم block_size.
+    """
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size or settings.ORDER_NUMBER_BLOCK_SIZE
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = os.getpid()
+
+    def allocate_block(self):
+        raise NotImplementedError
+
+    def next_value(self):
+        """رقم التسلسل التالي"""
+        with self._lock:
+            # العملية الابنة بعد fork ترث كتلة الأب فلا يجوز استخدامها
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._next = self._end = 0
+            if self._next >= self._end:
+                self._next = self.allocate_block()
+                self._end = self._next + self.block_size
+            value = self._next
+            self._next += 1
+            return value
+
+    def generate(self):
+        """رقم طلب جديد"""
+        return format_order_number(self.next_value())
+
+
+class PostgresSequenceGenerator(BlockOrderNumberGenerator):
+    """
+    تسلسل PostgreSQL بخطوة تساوي حجم الكتلة: كل nextval يحجز كتلة كاملة.
+    nextval لا يتراجع مع المعاملة، فلا تتكرر الكتلة حتى لو فشل الطلب.
+    """
+
+    def allocate_block(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(%s)', [SEQUENCE_NAME])
+            return cursor.fetchone()[0]
+
+
+class RedisBlockGenerator(BlockOrderNumberGenerator):
+    """حجز الكتل بـ INCRBY على عداد مشترك في Redis"""
+    key = 'orders:number:sequence'
+
+    def __init__(self, block_size=None):
+        super().__init__(block_size)
+        self.redis = get_redis_connection()
+
+    def allocate_block(self):
+        return self.redis.incrby(self.key, self.block_size) - self.block_size + 1
+
+
+class LocalBlockGenerator(BlockOrderNumberGenerator):
+    """
+    عداد داخل العملية يبدأ بعد آخر رقم محفوظ، للتطوير والاختبارات فقط:
+    لا يضمن عدم التكرار بين عدة عمليات
+    """
+
+    def __init__(self, block_size=None):
+        super().__init__(block_size)
+        self._last = None
+
+    def allocate_block(self):
+        if self._last is None:
+            from .models import Order
+
+            latest = Order.objects.order_by('-pk').values_list('order_number', flat=True).first()
+            self._last = parse_order_number(latest) or 0
+        start = self._last + 1
+        self._last += self.block_size
+        return start
+
+
+@lru_cache(maxsize=None)
+def _load_generator(path):
+    return import_string(path)()
+
+
+def get_order_number_generator():
+    """الحصول على مولد أرقام الطلبات المحدد في الإعدادات"""
+    return _load_generator(settings.ORDER_NUMBER_GENERATOR)
+
+
+def generate_order_number():
+    """رقم طلب جديد من المولد المحدد في الإعدادات"""
+    return get_order_number_generator().generate()
+
+
+def ensure_order_number_sequence(using='default'):
+    """إنشاء تسلسل أرقام الطلبات في PostgreSQL أو تحديث خطوته لحجم الكتلة الحالي"""
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+    block_size = settings.ORDER_NUMBER_BLOCK_SIZE
+    with db.cursor() as cursor:
+        cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS {SEQUENCE_NAME} INCREMENT BY {block_size}')
+        cursor.execute(
+            'SELECT increment_by FROM pg_sequences WHERE sequencename = %s', [SEQUENCE_NAME]
+        )
+        increment = cursor.fetchone()[0]
+        if increment != block_size:
+            # تبدأ الكتلة التالية بعد نهاية آخر كتلة محجوزة بالخطوة القديمة
+            cursor.execute(f'ALTER SEQUENCE {SEQUENCE_NAME} INCREMENT BY {block_size}')
+            cursor.execute(
+                f'SELECT setval(%s, last_value + %s, false) FROM {SEQUENCE_NAME}',
+                [SEQUENCE_NAME, increment],
+            )
@@ -1,5 +1,6 @@
 
 from rest_framework import serializers
+from .exports import EXPORT_FORMATS
 from .models import Order, OrderItem, OrderStatusHistory
 from apps.products.serializers import ProductListSerializer as ProductSerializer, ProductVariantSerializer
 from apps.users.serializers import AddressSerializer
@@ -14,7 +15,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = [
             'id', 'product', 'variant', 'product_name', 'product_sku', 
-            'product_image', 'price', 'compare_price', 'quantity', 'total'
+            'product_image', 'price', 'compare_price', 'quantity', 'total', 'discount'
         ]
 
 
@@ -46,9 +47,60 @@ class OrderSerializer(serializers.ModelSerializer):
             'shipping_address', 'billing_address', 'shipping_method', 
             'shipping_cost', 'tracking_number', 'payment_method', 
             'payment_status', 'transaction_id', 'subtotal', 'tax', 
-            'discount', 'total', 'notes', 'created_at', 'updated_at',
+            'discount', 'total', 'amount_paid', 'amount_refunded', 'notes', 'created_at', 'updated_at',
             'shipped_at', 'delivered_at', 'items', 'status_history'
         ]
         read_only_fields = [
-            'order_number', 'created_at', 'updated_at', 'shipped_at', 'delivered_at'
+            'order_number', 'amount_paid', 'amount_refunded', 'created_at', 'updated_at',
+            'shipped_at', 'delivered_at'
         ]
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """ملخص الطلب لقوائم الطلبات؛ يتطلب Order.objects.with_summary()"""
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+    thumbnail = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'order_number', 'status', 'status_display', 'payment_status',
+            'subtotal', 'discount', 'shipping_cost', 'tax', 'total',
+            'item_count', 'thumbnail', 'created_at'
+        ]
+        read_only_fields = fields
+
+
+class OrderTransitionSerializer(serializers.Serializer):
+    """مسلسل طلب النقل الجماعي للطلبات إلى حالة جديدة"""
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+    orders = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    order_numbers = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate(self, attrs):
+        if not attrs['orders'] and not attrs['order_numbers']:
+            raise serializers.ValidationError("يجب تحديد الطلبات بالمعرفات أو الأرقام")
+        return attrs
+
+
+class OrderExportSerializer(serializers.Serializer):
+    """مرشحات تصدير الطلبات: الصيغة ومدى التاريخ (أيام شاملة) والحالات مفصولة بفواصل"""
+    file_format = serializers.ChoiceField(choices=sorted(EXPORT_FORMATS), default='csv')
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    status = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate_status(self, value):
+        statuses = [status.strip() for status in value.split(',') if status.strip()]
+        valid = dict(Order.STATUS_CHOICES)
+        unknown = [status for status in statuses if status not in valid]
+        if unknown:
+            raise serializers.ValidationError("حالات غير معروفة: %s" % ', '.join(unknown))
+        return statuses
+
+    def validate(self, attrs):
+        if attrs.get('date_from') and attrs.get('date_to') and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("تاريخ البداية بعد تاريخ النهاية")
+        return attrs
@@ -0,0 +1,128 @@
+"""
+خدمات إنشاء الطلبات
+
+ينشأ الطلب من السلة بعدد ثابت من الاستعلامات مهما كان عدد العناصر:
+جلب واحد للعناصر مع منتجاتها ومتغيراتها وصورها، وإدراج جماعي لعناصر الطلب،
+وحجز شرطي واحد للمخزون لكل جدول (المنتجات والمتغيرات) يمنع البيع بأكثر من المتوفر.
+"""
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.utils.translation import gettext as _
+
+from apps.coupons.eligibility import CouponRedemptionError, redeem_coupon
+from apps.products.inventory import OutOfStockError, reserve_items
+from apps.products.models import ProductImage
+from .models import Order, OrderItem, TransitionResult
+
+
+def get_cart_items(cart):
+    """عناصر السلة مع المنتجات والمتغيرات والصورة الرئيسية لكل منتج باستعلامين"""
+    images = ProductImage.objects.order_by('-is_featured', 'sort_order', 'id')[:1]
+    return list(
+        cart.items.select_related('product', 'variant', 'variant__image', 'variant__product').prefetch_related(
+            Prefetch('product__images', queryset=images, to_attr='listing_images')
+        ).order_by('pk')
+    )
+
+
+def get_item_image(item):
+    """رابط صورة عنصر السلة من البيانات المجلوبة مسبقاً"""
+    if item.variant and item.variant.image:
+        return item.variant.image.image.url
+    if item.product.listing_images:
+        return item.product.listing_images[0].image.url
+    return ''
+
+
+@transaction.atomic
+def create_order_from_cart(cart, user, shipping_address, billing_address,
+                           payment_method='', shipping_cost=0, notes='', coupon=None):
+    """
+    إنشاء طلب من عناصر السلة وحجز المخزون وتسجيل استخدام الكوبون وتفريغ السلة في معاملة واحدة،
+    ويرفع OutOfStockError أو CouponRedemptionError (مع التراجع عن كل شيء)
+    إذا لم تكفِ كمية أي عنصر أو لم يعد الكوبون صالحاً
+    """
+    items = get_cart_items(cart)
+
+    lines = []
+    subtotal = 0
+    for item in items:
+        price = item.get_price()
+        total = price * item.quantity
+        subtotal += total
+        lines.append(OrderItem(
+            product=item.product,
+            variant=item.variant,
+            product_name=item.product.name,
+            product_sku=item.variant.sku if item.variant else item.product.sku,
+            product_image=get_item_image(item),
+            price=price,
+            compare_price=item.get_compare_price(),
+            quantity=item.quantity,
+            # bulk_create لا يستدعي save() لذا يحسب الإجمالي هنا
+            total=total,
+        ))
+
+    discount = 0
+    if coupon is not None:
+        is_valid, message = coupon.is_valid(user=user, cart_total=subtotal)
+        if not is_valid:
+            raise CouponRedemptionError(message)
+        # الخصم على الأسطر المشمولة بنطاق الكوبون فقط، ويحفظ نصيب كل سطر منه
+        breakdown = coupon.calculate_line_discounts(
+            [(index, line.product_id, line.total) for index, line in enumerate(lines)]
+        )
+        if not breakdown.eligible_subtotal:
+            raise CouponRedemptionError(_('الكوبون لا يشمل أياً من منتجات السلة'))
+        for line, line_discount in zip(lines, breakdown.lines):
+            line.discount = line_discount.discount
+        discount = breakdown.discount
+
+    order = Order(
+        user=user,
+        shipping_address=shipping_address,
+        billing_address=billing_address,
+        payment_method=payment_method,
+        shipping_cost=shipping_cost,
+        subtotal=subtotal,
+        discount=discount,
+        total=subtotal - discount + shipping_cost,
+        notes=notes,
+    )
+    # سجل الحالة الأولي يُنشأ من إشارة الحفظ
+    order.set_status('pending', user=user, notes=_('تم إنشاء الطلب بنجاح'))
+    order.save()
+    for line in lines:
+        line.order = order
+    OrderItem.objects.bulk_create(lines)
+
+    # حجز الكميات حتى تأكيد الطلب (يرفع OutOfStockError ويتراجع عن الطلب كاملاً)
+    reserve_items([(item.product, item.variant, item.quantity) for item in items], order=order)
+
+    # تفريغ سلة التسوق
+    cart.items.all().delete()
+
+    # استخدام الكوبون آخر خطوة لأن التحديث الشرطي يقفل صفه حتى نهاية المعاملة
+    if coupon is not None:
+        redeem_coupon(coupon, user, order, discount)
+
+    return order
+
+
+def transition_orders(status, ids=(), order_numbers=(), user=None, notes='', batch_size=1000):
+    """
+    نقل الطلبات المحددة بالمعرفات أو الأرقام إلى الحالة على دفعات،
+    مع أسباب الفشل لكل طلب (بما فيها الطلبات غير الموجودة) مفهرسة بالمعرف أو الرقم المرسل
+    """
+    ids, order_numbers = set(ids), set(order_numbers)
+    found = dict(
+        Order.objects.filter(Q(pk__in=ids) | Q(order_number__in=order_numbers)).values_list('pk', 'order_number')
+    )
+    missing = {str(pk) for pk in ids - found.keys()} | (order_numbers - set(found.values()))
+
+    result = Order.objects.filter(pk__in=found).transition(
+        status, user=user, notes=notes, batch_size=batch_size
+    )
+    failures = {str(pk): message for pk, message in result.failures.items()}
+    failures.update((key, _('الطلب غير موجود')) for key in sorted(missing))
+    return TransitionResult(result.transitioned, failures)
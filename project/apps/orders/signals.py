@@ -1,54 +1,40 @@
 
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_migrate, post_save
 from django.dispatch import receiver
-from django.utils import timezone
 from .models import Order, OrderStatusHistory
-
-
-@receiver(pre_save, sender=Order)
-def update_order_timestamps(sender, instance, **kwargs):
-    """
-    تحديث الطوابع الزمنية للطلب بناءً على حالته
-    """
-    if instance.pk:  # تحديث وليس إنشاء
-        try:
-            old_instance = Order.objects.get(pk=instance.pk)
-            old_status = old_instance.status
-            new_status = instance.status
-
-            # تحديث طابع الشحن
-            if old_status != 'shipped' and new_status == 'shipped':
-                instance.shipped_at = timezone.now()
-
-            # تحديث طابع التسليم
-            if old_status != 'delivered' and new_status == 'delivered':
-                instance.delivered_at = timezone.now()
-        except Order.DoesNotExist:
-            pass
+from .numbering import ensure_order_number_sequence
 
 
 @receiver(post_save, sender=Order)
-def create_order_status_history(sender, instance, created, **kwargs):
+def create_order_status_history(sender, instance, created, update_fields=None, **kwargs):
     """
-    إنشاء سجل حالة الطلب عند إنشاء الطلب أو تغيير حالته
+    إنشاء سجل حالة الطلب عند إنشاء الطلب أو تغيير حالته،
+    بمقارنة الحالة بالحالة المحمّلة من قاعدة البيانات دون استعلام إضافي
     """
     if created:
         # إنشاء سجل الحالة الأولي عند إنشاء الطلب
         OrderStatusHistory.objects.create(
             order=instance,
             status=instance.status,
-            notes=f'تم إنشاء الطلب بالحالة: {instance.get_status_display()}'
+            notes=instance.status_notes or f'تم إنشاء الطلب بالحالة: {instance.get_status_display()}',
+            created_by=instance.status_changed_by,
+        )
+    elif (update_fields is None or 'status' in update_fields) and instance.has_status_changed():
+        labels = dict(Order.STATUS_CHOICES)
+        OrderStatusHistory.objects.create(
+            order=instance,
+            status=instance.status,
+            notes=instance.status_notes or Order.status_change_notes(
+                labels.get(instance.get_original_status()), instance.get_status_display()
+            ),
+            created_by=instance.status_changed_by,
         )
-    else:
-        # التحقق مما إذا كانت الحالة قد تغيرت
-        try:
-            old_instance = Order.objects.get(pk=instance.pk)
-            if old_instance.status != instance.status:
-                # إنشاء سجل جديد للحالة
-                OrderStatusHistory.objects.create(
-                    order=instance,
-                    status=instance.status,
-                    notes=f'تم تغيير الحالة من {old_instance.get_status_display()} إلى {instance.get_status_display()}'
-                )
-        except Order.DoesNotExist:
-            pass
+
+
+@receiver(post_migrate)
+def create_order_number_sequence(sender, using, **kwargs):
+    """
+    إنشاء تسلسل أرقام الطلبات في PostgreSQL بعد تطبيق الترحيلات
+    """
+    if sender.name == 'apps.orders':
+        ensure_order_number_sequence(using)
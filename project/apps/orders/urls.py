@@ -8,6 +8,8 @@ urlpatterns = [
     # واجهات API
     path('api/', views.OrderListView.as_view(), name='order_list_api'),
     path('api/<int:pk>/', views.OrderDetailView.as_view(), name='order_detail_api'),
+    path('api/transition/', views.OrderTransitionView.as_view(), name='order_transition_api'),
+    path('api/export/', views.OrderExportView.as_view(), name='order_export_api'),
     path('api/<int:order_id>/status/', views.OrderStatusHistoryView.as_view(), name='order_status_history_api'),
 
     # واجهات HTML
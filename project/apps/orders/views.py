@@ -4,35 +4,45 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils.translation import gettext as _
 from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from django.views.decorators.http import require_POST
 from rest_framework import status, generics, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.pagination import PageNumberPagination
 
+from .exports import EXPORT_FORMATS, ExportError, export_orders
 from .models import Order, OrderItem, OrderStatusHistory
-from .serializers import OrderSerializer, OrderItemSerializer, OrderStatusHistorySerializer
+from .services import CouponRedemptionError, OutOfStockError, create_order_from_cart, transition_orders
+from .serializers import (
+    OrderExportSerializer, OrderSerializer, OrderItemSerializer, OrderStatusHistorySerializer,
+    OrderSummarySerializer, OrderTransitionSerializer
+)
+from apps.cart.storage import get_cart_store
 from apps.cart.views import get_or_create_cart
+from apps.products.pagination import KeysetPagination
 from apps.cart.models import CartItem
+from apps.coupons.models import Coupon
 from apps.users.models import Address
 
 
-class OrderPagination(PageNumberPagination):
-    """ترقيم الصفحات للطلبات"""
+class OrderPagination(KeysetPagination):
+    """ترقيم الصفحات للطلبات (بالمؤشر عند تمرير ?cursor=)"""
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
+    keyset_orderings = ('-created_at', 'created_at')
 
 
 class OrderListView(generics.ListAPIView):
-    """عرض قائمة الطلبات"""
-    serializer_class = OrderSerializer
+    """عرض قائمة الطلبات بملخص لكل طلب (التفاصيل الكاملة في OrderDetailView)"""
+    serializer_class = OrderSummarySerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = OrderPagination
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return Order.objects.filter(user=self.request.user).with_summary()
 
 
 class OrderDetailView(generics.RetrieveAPIView):
@@ -41,7 +51,7 @@ class OrderDetailView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return Order.objects.filter(user=self.request.user).for_detail()
 
 
 class OrderStatusHistoryView(generics.ListAPIView):
@@ -54,6 +64,57 @@ class OrderStatusHistoryView(generics.ListAPIView):
         return OrderStatusHistory.objects.filter(order_id=order_id, order__user=self.request.user)
 
 
+class OrderTransitionView(APIView):
+    """نقل مجموعة من الطلبات إلى حالة جديدة دفعة واحدة (لأنظمة التنفيذ والمستودعات)"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        serializer = OrderTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        result = transition_orders(
+            data['status'],
+            ids=data['orders'],
+            order_numbers=data['order_numbers'],
+            user=request.user,
+            notes=data['notes'],
+        )
+        return Response({
+            'transitioned': result.transitioned,
+            'failures': result.failures,
+        })
+
+
+class OrderExportView(APIView):
+    """
+    تصدير الطلبات للمالية بسطر لكل عنصر، مبثوثاً دون تحميل النتيجة في الذاكرة:
+    ?file_format=csv|ndjson|parquet&date_from=2025-01-01&date_to=2025-12-31&status=delivered,shipped
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        serializer = OrderExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        try:
+            chunks = export_orders(
+                data['file_format'],
+                date_from=data.get('date_from'),
+                date_to=data.get('date_to'),
+                statuses=data['status'],
+            )
+        except ExportError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type, extension = EXPORT_FORMATS[data['file_format']]
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        filename = f'orders-{timezone.localdate():%Y%m%d}.{extension}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
 @login_required
 def checkout(request):
     """صفحة إتمام الطلب"""
@@ -122,68 +183,43 @@ def create_order(request):
     # حساب تكاليف الشحن (يمكن تعديلها لاحقاً)
     shipping_cost = 10  # قيمة ثابتة للتوضيح
 
-    with transaction.atomic():
-        # إنشاء الطلب
-        order = Order.objects.create(
-            user=request.user,
-            shipping_address=shipping_address,
-            billing_address=billing_address,
-            payment_method=payment_method,
-            shipping_cost=shipping_cost,
-            subtotal=cart.get_total_price(),
-            total=cart.get_total_price() + shipping_cost,
-            notes=notes
-        )
+    # الكوبون المطبق على السلة (يُتحقق منه ويُسجل استخدامه داخل معاملة الطلب)
+    coupon = None
+    coupon_code = request.session.get('coupon_code')
+    if coupon_code:
+        coupon = Coupon.objects.filter(code__iexact=coupon_code, is_active=True).first()
+        if coupon is None:
+            request.session.pop('coupon_code', None)
+            request.session.pop('coupon_discount', None)
+            messages.error(request, _('كوبون غير صالح'))
+            return redirect('cart:cart_detail')
 
-        # إنشاء عناصر الطلب
-        for cart_item in cart.items.all():
-            product = cart_item.product
-            variant = cart_item.variant
-
-            # الحصول على صورة المنتج
-            product_image = ''
-            if variant and variant.image:
-                product_image = variant.image.image.url
-            elif product.images.filter(is_featured=True).exists():
-                product_image = product.images.filter(is_featured=True).first().image.url
-            elif product.images.exists():
-                product_image = product.images.first().image.url
-
-            # الحصول على SKU
-            product_sku = product.sku
-            if variant:
-                product_sku = variant.sku
-
-            # إنشاء عنصر الطلب
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                variant=variant,
-                product_name=product.name,
-                product_sku=product_sku,
-                product_image=product_image,
-                price=cart_item.get_price(),
-                compare_price=cart_item.get_compare_price(),
-                quantity=cart_item.quantity,
-                total=cart_item.get_total_price()
+    try:
+        with transaction.atomic():
+            order = create_order_from_cart(
+                cart,
+                user=request.user,
+                shipping_address=shipping_address,
+                billing_address=billing_address,
+                payment_method=payment_method,
+                shipping_cost=shipping_cost,
+                notes=notes,
+                coupon=coupon,
             )
 
-            # تحديث كمية المنتج في المخزون
-            product_to_update = variant if variant else product
-            if product_to_update.track_quantity:
-                product_to_update.quantity -= cart_item.quantity
-                product_to_update.save()
-
-        # إنشاء سجل حالة الطلب الأولي
-        OrderStatusHistory.objects.create(
-            order=order,
-            status='pending',
-            notes=_('تم إنشاء الطلب بنجاح'),
-            created_by=request.user
-        )
+            # تفريغ مخزن السلة بعد نجاح المعاملة
+            transaction.on_commit(get_cart_store(request).clear)
+    except OutOfStockError as error:
+        messages.error(request, str(error))
+        return redirect('cart:cart_detail')
+    except CouponRedemptionError as error:
+        request.session.pop('coupon_code', None)
+        request.session.pop('coupon_discount', None)
+        messages.error(request, str(error))
+        return redirect('cart:cart_detail')
 
-        # تفريغ سلة التسوق
-        cart.items.all().delete()
+    request.session.pop('coupon_code', None)
+    request.session.pop('coupon_discount', None)
 
     messages.success(request, _('تم إنشاء طلبك بنجاح'))
     return redirect('orders:order_detail', order_id=order.id)
@@ -192,8 +228,8 @@ def create_order(request):
 @login_required
 def order_detail(request, order_id):
     """عرض تفاصيل الطلب"""
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-    status_history = OrderStatusHistory.objects.filter(order=order).order_by('-created_at')
+    order = get_object_or_404(Order.objects.for_detail(), id=order_id, user=request.user)
+    status_history = order.status_history.all()
 
     context = {
         'order': order,
@@ -206,7 +242,7 @@ def order_detail(request, order_id):
 @login_required
 def order_list(request):
     """عرض قائمة الطلبات"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = Order.objects.filter(user=request.user).with_summary().order_by('-created_at')
 
     context = {
         'orders': orders,
@@ -227,24 +263,8 @@ def cancel_order(request, order_id):
         return redirect('orders:order_detail', order_id=order.id)
 
     with transaction.atomic():
-        # تحديث حالة الطلب
-        order.status = 'cancelled'
-        order.save()
-
-        # إعادة المنتجات إلى المخزون
-        for item in order.items.all():
-            product_to_update = item.variant if item.variant else item.product
-            if product_to_update.track_quantity:
-                product_to_update.quantity += item.quantity
-                product_to_update.save()
-
-        # إنشاء سجل حالة الطلب
-        OrderStatusHistory.objects.create(
-            order=order,
-            status='cancelled',
-            notes=_('تم إلغاء الطلب من قبل العميل'),
-            created_by=request.user
-        )
+        # تحديث حالة الطلب وتحرير حجوزاته وإعادة كمياته المخصومة إلى المخزون
+        order.transition_to('cancelled', user=request.user, notes=_('تم إلغاء الطلب من قبل العميل'))
 
     messages.success(request, _('تم إلغاء الطلب بنجاح'))
     return redirect('orders:order_detail', order_id=order.id)
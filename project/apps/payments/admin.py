@@ -1,9 +1,24 @@
 
-from django.contrib import admin
-from .models import Payment, PaymentMethod, Transaction
+from django.contrib import admin, messages
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from .models import Payment, PaymentMethod, Transaction, WebhookEvent
 
 
-class TransactionInline(admin.TabularInline):
+class ReadOnlyLedgerMixin:
+    """الدفتر للإضافة فقط، والمعاملات تسجلها خدمات الدفع مع أرصدة الطلب"""
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class TransactionInline(ReadOnlyLedgerMixin, admin.TabularInline):
     """عرض المعاملات كعناصر مضمنة في صفحة الدفع"""
     model = Transaction
     extra = 0
@@ -88,7 +103,7 @@ class PaymentMethodAdmin(admin.ModelAdmin):
 
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(ReadOnlyLedgerMixin, admin.ModelAdmin):
     """إعدادات عرض المعاملات في لوحة التحكم"""
     list_display = (
         'id', 'payment', 'transaction_type', 'amount', 'status',
@@ -121,3 +136,27 @@ class TransactionAdmin(admin.ModelAdmin):
             )
         }),
     )
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    """إعدادات عرض إشعارات البوابات في لوحة التحكم"""
+    list_display = (
+        'event_id', 'provider', 'event_type', 'status', 'attempts',
+        'received_at', 'processed_at'
+    )
+    list_filter = ('provider', 'status', 'event_type', 'received_at')
+    search_fields = ('event_id', 'event_type')
+    readonly_fields = (
+        'provider', 'event_id', 'event_type', 'payload', 'headers', 'status', 'attempts',
+        'error', 'received_at', 'updated_at', 'processed_at'
+    )
+    actions = ['retry_events']
+
+    @admin.action(description=_('إعادة معالجة الإشعارات المحددة'))
+    def retry_events(self, request, queryset):
+        # الأحداث المعالجة أو الجارية معالجتها لا تعاد كي لا يطبق حدث مرتين
+        updated = queryset.filter(status__in=['failed', 'ignored']).update(
+            status='pending', attempts=0, error='', updated_at=timezone.now()
+        )
+        self.message_user(request, _('تمت جدولة %d إشعار لإعادة المعالجة') % updated, messages.SUCCESS)
@@ -6,6 +6,3 @@ class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.payments'
     verbose_name = 'الدفعات'
-
-    def ready(self):
-        import apps.payments.signals
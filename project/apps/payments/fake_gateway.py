@@ -0,0 +1,174 @@
+"""
+بوابة دفع وهمية محلية
+
+خادم HTTP في خيط خلفي يحاكي نقاط واجهتي Stripe و PayPal التي تستخدمها المحولات،
+مع تأخير اختياري لكل طلب، وحقن أخطاء عابرة للطلبات التالية، واحترام مفاتيح منع التكرار.
+يستخدم في الاختبارات، وفي قياس الأداء بتوجيه STRIPE_API_BASE و PAYPAL_API_BASE إليه
+(انظر benchmark_payment_gateway --serve).
+"""
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeGatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # اتصالات دائمة كي يظهر أثر مجمع الاتصالات
+    disable_nagle_algorithm = True  # دون تأخير الإقرار بين الترويسات والمحتوى على الاتصال الدائم
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        gateway = self.server.gateway
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            data = json.loads(body or '{}')
+        else:
+            data = dict(parse_qsl(body))
+        status, payload = gateway.handle(urlsplit(self.path).path, data, self.headers, self.client_address)
+        encoded = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+
+class FakeGatewayServer:
+    """
+    البوابة الوهمية: FakeGatewayServer(latency=0.2).start() ثم url،
+    و fail_next(503, 2) لرفض الطلبين التاليين. requests يعد الطلبات،
+    و connections عدد الاتصالات المختلفة التي وصلت منها.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0):
+        self.latency = latency
+        self.requests = 0
+        self.connections = set()
+        self.payment_intents = {}
+        self.paypal_payments = {}
+        self.sales = {}
+        self._failures = []
+        self._idempotent = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), FakeGatewayHandler)
+        self._server.daemon_threads = True
+        self._server.gateway = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def fail_next(self, status=503, count=1):
+        """رفض الطلبات التالية بالحالة (لاختبار إعادة المحاولة)"""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def handle(self, path, data, headers, client_address):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            self.connections.add(client_address)
+            if self._failures:
+                return self._failures.pop(0), {'error': {'message': 'fake gateway failure'}}
+
+            key = headers.get('Idempotency-Key') or headers.get('PayPal-Request-Id')
+            if key and key in self._idempotent:
+                return self._idempotent[key]
+            response = self.route(path, data)
+            if key and response[0] < 400:
+                self._idempotent[key] = response
+            return response
+
+    def next_id(self, prefix):
+        return f'{prefix}_{next(self._ids)}'
+
+    def route(self, path, data):
+        if path == '/v1/customers':
+            return 200, {'id': self.next_id('cus'), 'object': 'customer', 'email': data.get('email', '')}
+
+        if path == '/v1/payment_intents':
+            intent_id = self.next_id('pi')
+            intent = {
+                'id': intent_id, 'object': 'payment_intent', 'client_secret': f'{intent_id}_secret',
+                'amount': int(data['amount']), 'currency': data.get('currency', ''),
+                'customer': data.get('customer'), 'status': 'requires_payment_method', 'refunded': 0,
+                'metadata': {
+                    key[9:-1]: value for key, value in data.items() if key.startswith('metadata[')
+                },
+            }
+            self.payment_intents[intent_id] = intent
+            return 200, intent
+
+        if path == '/v1/refunds':
+            intent = self.payment_intents.get(data.get('payment_intent'))
+            amount = int(data.get('amount', 0))
+            if intent is None or intent['refunded'] + amount > intent['amount']:
+                return 400, {'error': {'message': 'invalid refund'}}
+            intent['refunded'] += amount
+            return 200, {'id': self.next_id('re'), 'object': 'refund', 'amount': amount, 'status': 'succeeded'}
+
+        if path == '/v1/oauth2/token':
+            return 200, {'access_token': self.next_id('token'), 'token_type': 'Bearer', 'expires_in': 32400}
+
+        if path == '/v1/payments/payment':
+            payment_id = self.next_id('PAY')
+            payment = {
+                'id': payment_id, 'state': 'created', 'transactions': data.get('transactions', []),
+                'links': [{'rel': 'approval_url', 'href': f'{self.url}/approve/{payment_id}'}],
+            }
+            self.paypal_payments[payment_id] = payment
+            return 201, payment
+
+        match = re.fullmatch(r'/v1/payments/payment/([^/]+)/execute', path)
+        if match:
+            payment = self.paypal_payments.get(match.group(1))
+            if payment is None:
+                return 404, {'message': 'payment not found'}
+            sale_id = self.next_id('SALE')
+            total = payment['transactions'][0]['amount']['total'] if payment['transactions'] else '0'
+            self.sales[sale_id] = {'total': total, 'refunded': 0}
+            payment['state'] = 'approved'
+            for transaction in payment['transactions']:
+                transaction['related_resources'] = [{'sale': {'id': sale_id, 'state': 'completed'}}]
+            return 200, payment
+
+        match = re.fullmatch(r'/v1/payments/sale/([^/]+)/refund', path)
+        if match:
+            sale = self.sales.get(match.group(1))
+            if sale is None:
+                return 404, {'message': 'sale not found'}
+            return 201, {'id': self.next_id('REF'), 'state': 'completed', 'amount': data.get('amount', {})}
+
+        if path == '/v1/notifications/verify-webhook-signature':
+            valid = bool(data.get('transmission_sig')) and data.get('transmission_sig') != 'invalid'
+            return 200, {'verification_status': 'SUCCESS' if valid else 'FAILURE'}
+
+        return 404, {'message': f'unknown path {path}'}
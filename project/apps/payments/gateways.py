@@ -0,0 +1,270 @@
+"""
+محولات بوابات الدفع
+
+كل طريقة دفع لها محول بواجهة موحدة: إنشاء الدفع، وتنفيذه بعد موافقة المشتري، والإرجاع.
+المحولات لا تلمس قاعدة البيانات، وتستدعى خارج معاملاتها (انظر services)
+فلا تبقى الاتصالات ولا أقفال الصفوف محجوزة أثناء انتظار البوابة.
+
+كل محول يحتفظ بجلسة requests واحدة في العملية بمجمع اتصالات دائمة، مع مهلة اتصال وقراءة
+لكل طلب، وإعادة محاولة الأخطاء العابرة بتأخير متزايد. طلبات الإنشاء ترسل مفتاح منع التكرار
+(Idempotency-Key أو PayPal-Request-Id) فلا تنشئ إعادة المحاولة دفعة أو إرجاعاً مكرراً.
+"""
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext as _
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# نتيجة استدعاء البوابة: status هي حالة الدفع الجديدة (processing بانتظار المشتري أو completed أو refunded)
+GatewayResult = namedtuple(
+    'GatewayResult', 'transaction_id status response client_secret redirect_url customer_id',
+    defaults=('', '', ''),
+)
+
+
+class GatewayError(Exception):
+    """رفض البوابة للطلب أو تعذر الوصول إليها"""
+
+    def __init__(self, message, response=None):
+        self.response = response or {}
+        super().__init__(message)
+
+
+def to_minor_units(amount):
+    """المبلغ بأصغر وحدة للعملة (الهللة أو السنت)"""
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+class PaymentGateway:
+    """محول بوابة دفع عبر HTTP بجلسة مشتركة"""
+    base_url = ''
+
+    def __init__(self, base_url=None, timeout=None, retries=None, pool_size=None, currency='sar'):
+        self.base_url = (base_url or self.base_url).rstrip('/')
+        self.timeout = tuple(timeout or settings.PAYMENT_GATEWAY_TIMEOUT)
+        self.retries = settings.PAYMENT_GATEWAY_RETRIES if retries is None else retries
+        self.pool_size = pool_size or settings.PAYMENT_GATEWAY_POOL_SIZE
+        self.currency = currency
+
+    @cached_property
+    def session(self):
+        """جلسة بمجمع اتصالات؛ تعاد المحاولة لأي طريقة لأن طلبات الإنشاء تحمل مفتاح منع التكرار"""
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=0.2,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self.configure_session(session)
+        return session
+
+    def configure_session(self, session):
+        """إعداد المصادقة والترويسات الثابتة للجلسة"""
+
+    def get_headers(self, idempotency_key=None):
+        return {}
+
+    def request(self, method, path, idempotency_key=None, headers=None, **kwargs):
+        """طلب إلى البوابة يعيد JSON الاستجابة، أو يرفع GatewayError"""
+        try:
+            response = self.session.request(
+                method, self.base_url + path, timeout=self.timeout,
+                headers={**self.get_headers(idempotency_key), **(headers or {})}, **kwargs
+            )
+        except requests.RequestException as error:
+            raise GatewayError(_('تعذر الاتصال ببوابة الدفع: %s') % error)
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        if response.status_code >= 400:
+            raise GatewayError(self.error_message(data) or _('رفضت بوابة الدفع الطلب'), data)
+        return data
+
+    def error_message(self, data):
+        return ''
+
+    def create_payment(self, payment, user=None, **context):
+        raise NotImplementedError
+
+    def execute_payment(self, payment, **params):
+        raise GatewayError(_('طريقة الدفع لا تتطلب تنفيذاً'))
+
+    def refund(self, payment, amount, reason='', idempotency_key=None):
+        raise GatewayError(_('طريقة الدفع لا تدعم الإرجاع'))
+
+
+class StripeGateway(PaymentGateway):
+    """بطاقات الائتمان عبر واجهة Stripe: نية دفع يؤكدها المتصفح ثم يصل الإشعار"""
+    base_url = 'https://api.stripe.com'
+
+    def __init__(self, api_key='', **options):
+        super().__init__(**options)
+        self.api_key = api_key
+
+    def configure_session(self, session):
+        session.auth = (self.api_key, '')
+
+    def get_headers(self, idempotency_key=None):
+        return {'Idempotency-Key': idempotency_key} if idempotency_key else {}
+
+    def error_message(self, data):
+        return data.get('error', {}).get('message', '')
+
+    def create_payment(self, payment, user=None, **context):
+        customer_id = getattr(user, 'stripe_customer_id', '')
+        if user is not None and not customer_id:
+            customer = self.request('POST', '/v1/customers', idempotency_key=f'customer-{user.pk}', data={
+                'email': user.email,
+                'name': user.get_full_name() or user.username,
+            })
+            customer_id = customer['id']
+
+        data = {
+            'amount': to_minor_units(payment.amount),
+            'currency': self.currency,
+            'metadata[order_id]': payment.order_id,
+            'metadata[payment_id]': payment.pk,
+        }
+        if customer_id:
+            data['customer'] = customer_id
+        intent = self.request('POST', '/v1/payment_intents', idempotency_key=f'payment-{payment.pk}', data=data)
+        return GatewayResult(
+            intent['id'], 'processing', intent,
+            client_secret=intent.get('client_secret', ''), customer_id=customer_id,
+        )
+
+    def refund(self, payment, amount, reason='', idempotency_key=None):
+        refund = self.request('POST', '/v1/refunds', idempotency_key=idempotency_key, data={
+            'payment_intent': payment.transaction_id,
+            'amount': to_minor_units(amount),
+            'reason': 'requested_by_customer',
+            'metadata[reason]': reason,
+        })
+        return GatewayResult(refund['id'], 'refunded', refund)
+
+
+class PayPalGateway(PaymentGateway):
+    """PayPal عبر واجهة REST: دفعة يوافق عليها المشتري في PayPal ثم تنفذ عند عودته"""
+    base_url = 'https://api-m.sandbox.paypal.com'
+
+    # ترويسات الإشعار اللازمة للتحقق من توقيعه
+    WEBHOOK_HEADERS = {
+        'auth_algo': 'PAYPAL-AUTH-ALGO',
+        'cert_url': 'PAYPAL-CERT-URL',
+        'transmission_id': 'PAYPAL-TRANSMISSION-ID',
+        'transmission_sig': 'PAYPAL-TRANSMISSION-SIG',
+        'transmission_time': 'PAYPAL-TRANSMISSION-TIME',
+    }
+
+    def __init__(self, client_id='', client_secret='', currency='USD', webhook_id='', **options):
+        super().__init__(currency=currency, **options)
+        self.client_id, self.client_secret = client_id, client_secret
+        self.webhook_id = webhook_id
+        self._token, self._token_expires = None, 0
+        self._token_lock = threading.Lock()
+
+    def access_token(self):
+        """رمز الوصول مخزن حتى قبيل انتهائه، ويطلب رمز جديد مرة واحدة بين الخيوط"""
+        with self._token_lock:
+            if self._token is None or time.monotonic() >= self._token_expires:
+                data = self.request(
+                    'POST', '/v1/oauth2/token', auth=(self.client_id, self.client_secret),
+                    data={'grant_type': 'client_credentials'},
+                )
+                self._token = data['access_token']
+                self._token_expires = time.monotonic() + int(data.get('expires_in', 0)) - 60
+            return self._token
+
+    def get_headers(self, idempotency_key=None):
+        return {'PayPal-Request-Id': idempotency_key} if idempotency_key else {}
+
+    def authorized(self, method, path, **kwargs):
+        return self.request(method, path, headers={'Authorization': f'Bearer {self.access_token()}'}, **kwargs)
+
+    def error_message(self, data):
+        return data.get('message') or data.get('error_description', '')
+
+    def create_payment(self, payment, user=None, return_url='', cancel_url='', **context):
+        """return_url يضاف إليه معرف الدفعة ليعرف عنوان التنفيذ أي دفعة عاد بها المشتري"""
+        order = payment.order
+        if return_url:
+            return_url = f'{return_url}?payment_id={payment.pk}'
+        total = str(payment.amount)
+        data = self.authorized('POST', '/v1/payments/payment', idempotency_key=f'payment-{payment.pk}', json={
+            'intent': 'sale',
+            'payer': {'payment_method': 'paypal'},
+            'redirect_urls': {'return_url': return_url, 'cancel_url': cancel_url},
+            'transactions': [{
+                'item_list': {'items': [{
+                    'name': f'الطلب #{order.order_number}', 'sku': order.order_number,
+                    'price': total, 'currency': self.currency, 'quantity': 1,
+                }]},
+                'amount': {'total': total, 'currency': self.currency},
+                'description': f'دفع للطلب #{order.order_number}',
+            }],
+        })
+        approval_url = next(
+            (link['href'] for link in data.get('links', ()) if link.get('rel') == 'approval_url'), ''
+        )
+        return GatewayResult(data['id'], 'processing', data, redirect_url=approval_url)
+
+    def execute_payment(self, payment, payer_id='', **params):
+        data = self.authorized(
+            'POST', f'/v1/payments/payment/{payment.transaction_id}/execute',
+            idempotency_key=f'execute-{payment.pk}', json={'payer_id': payer_id},
+        )
+        if data.get('state') != 'approved':
+            raise GatewayError(_('فشل عملية الدفع'), data)
+        return GatewayResult(data['id'], 'completed', data)
+
+    def refund(self, payment, amount, reason='', idempotency_key=None):
+        try:
+            sale_id = payment.gateway_response['transactions'][0]['related_resources'][0]['sale']['id']
+        except (KeyError, IndexError, TypeError):
+            raise GatewayError(_('لا توجد عملية بيع لإرجاعها'))
+        refund = self.authorized(
+            'POST', f'/v1/payments/sale/{sale_id}/refund', idempotency_key=idempotency_key,
+            json={'amount': {'total': str(amount), 'currency': self.currency}},
+        )
+        return GatewayResult(refund['id'], 'refunded', refund)
+
+
+    def verify_webhook(self, headers, event):
+        """التحقق من توقيع الإشعار عبر واجهة PayPal؛ headers بأسماء WEBHOOK_HEADERS"""
+        data = self.authorized('POST', '/v1/notifications/verify-webhook-signature', json={
+            **{field: headers.get(name, '') for field, name in self.WEBHOOK_HEADERS.items()},
+            'webhook_id': self.webhook_id,
+            'webhook_event': event,
+        })
+        return data.get('verification_status') == 'SUCCESS'
+
+
+class CashOnDeliveryGateway(PaymentGateway):
+    """الدفع عند الاستلام: لا بوابة خارجية، والدفع مقبول فوراً"""
+
+    def create_payment(self, payment, user=None, **context):
+        return GatewayResult('', 'completed', {})
+
+
+@lru_cache(maxsize=None)
+def get_gateway(method):
+    """محول البوابة لطريقة الدفع حسب PAYMENT_GATEWAYS، نسخة واحدة لكل عملية لمشاركة مجمع الاتصالات"""
+    config = settings.PAYMENT_GATEWAYS.get(method)
+    if config is None:
+        raise GatewayError(_('طريقة الدفع غير مدعومة'))
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
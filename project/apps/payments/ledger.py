@@ -0,0 +1,62 @@
+"""
+دفتر معاملات الدفع
+
+كل حدث مالي (دفع أو إرجاع) يُسجل صف Transaction ويضيف مبلغه إلى رصيدي الطلب
+amount_paid و amount_refunded بفرق F()، وتُشتق حالة الدفع من الرصيدين الجديدين في التحديث نفسه.
+تسجيل الحدث يكلف إدراجاً واحداً وتحديثاً واحداً مهما كان عدد دفعات الطلب، دون تجميع
+على الدفعات ولا حفظ كامل للطلب ولا إشاراته.
+"""
+from decimal import Decimal
+from django.db.models import F, Value
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from apps.orders.models import Order
+from .models import Transaction
+
+
+# أثر كل نوع معاملة على رصيدي الطلب (المدفوع، المسترد)
+LEDGER_EFFECTS = {
+    'payment': (1, 0),
+    'capture': (1, 0),
+    'refund': (0, 1),
+    'void': (0, 0),
+}
+
+
+def record_transaction(payment, transaction_type, amount, transaction_id='', response=None):
+    """
+    تسجيل معاملة مكتملة للدفعة وتطبيق أثرها على رصيدي الطلب وحالة دفعه.
+    يستدعى داخل معاملة قاعدة البيانات بعد قفل الدفعة؛ نسخة payment.order في الذاكرة تُحدّث أيضاً
+    كي لا يكتب حفظها اللاحق فوق الأرصدة.
+    """
+    amount = Decimal(amount)
+    now = timezone.now()
+    entry = Transaction.objects.create(
+        payment=payment,
+        transaction_type=transaction_type,
+        amount=amount,
+        status='completed',
+        transaction_id=transaction_id,
+        gateway_response=response or {},
+        completed_at=now,
+    )
+
+    paid_sign, refunded_sign = LEDGER_EFFECTS[transaction_type]
+    paid_delta, refunded_delta = amount * paid_sign, amount * refunded_sign
+    if paid_delta or refunded_delta:
+        paid = F('amount_paid') + Value(paid_delta)
+        refunded = F('amount_refunded') + Value(refunded_delta)
+        Order.objects.filter(pk=payment.order_id).update(
+            amount_paid=paid,
+            amount_refunded=refunded,
+            payment_status=Order.payment_status_expression(paid, refunded),
+            # التحديث لا يطبق auto_now
+            updated_at=Now(),
+        )
+
+        order = payment.order
+        order.amount_paid += paid_delta
+        order.amount_refunded += refunded_delta
+        order.payment_status = Order.derive_payment_status(order.amount_paid, order.amount_refunded, order.total)
+    return entry
@@ -0,0 +1,72 @@
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from apps.payments.fake_gateway import FakeGatewayServer
+from apps.payments.gateways import StripeGateway
+
+
+# ما يحتاجه المحول من الدفعة دون قاعدة البيانات
+BenchmarkPayment = namedtuple('BenchmarkPayment', 'pk order_id amount')
+
+
+class Command(BaseCommand):
+    """قياس زمن استدعاءات بوابة الدفع على البوابة الوهمية المحلية، أو تشغيلها لقياس خارجي"""
+    help = (
+        'إنشاء نوايا دفع متزامنة عبر محول Stripe على البوابة الوهمية بمجمع اتصالات مشترك '
+        'أو بجلسة جديدة لكل طلب، أو تشغيل البوابة الوهمية فقط بـ --serve'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--payments', type=int, default=50, help='عدد الدفعات لكل عامل')
+        parser.add_argument('--latency', type=float, default=0.05, help='تأخير البوابة لكل طلب بالثواني')
+        parser.add_argument('--no-pool', action='store_true', help='جلسة واتصال جديدان لكل طلب')
+        parser.add_argument('--serve', action='store_true', help='تشغيل البوابة الوهمية حتى الإيقاف')
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            server = FakeGatewayServer(port=options['port'], latency=options['latency'])
+            self.stdout.write(f'البوابة الوهمية على {server.url} (STRIPE_API_BASE و PAYPAL_API_BASE)')
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                server.stop()
+            return
+
+        workers, count = options['workers'], options['payments']
+        with FakeGatewayServer(latency=options['latency']) as server:
+            gateway = StripeGateway(api_key='sk_test', base_url=server.url, pool_size=workers)
+
+            def create(worker):
+                durations = []
+                for index in range(count):
+                    payment = BenchmarkPayment(worker * count + index + 1, 1, Decimal('100.00'))
+                    adapter = (
+                        StripeGateway(api_key='sk_test', base_url=server.url) if options['no_pool'] else gateway
+                    )
+                    started = time.perf_counter()
+                    adapter.create_payment(payment)
+                    durations.append(time.perf_counter() - started)
+                    if options['no_pool']:
+                        adapter.session.close()
+                return durations
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(workers) as executor:
+                durations = sorted(
+                    duration for worker_durations in executor.map(create, range(workers))
+                    for duration in worker_durations
+                )
+            elapsed = time.perf_counter() - started
+
+        total = len(durations)
+        self.stdout.write(
+            f'{"دون مجمع" if options["no_pool"] else "مجمع مشترك"}: {workers} عامل × {count}\n'
+            f'الطلبات: {server.requests}، الاتصالات: {len(server.connections)}\n'
+            f'الوسيط: {durations[total // 2] * 1000:.1f} م.ث، '
+            f'p95: {durations[int(total * 0.95) - 1] * 1000:.1f} م.ث، '
+            f'المعدل: {total / elapsed if elapsed else 0:.0f} دفعة/ث'
+        )
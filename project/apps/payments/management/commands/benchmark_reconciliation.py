@@ -0,0 +1,56 @@
+import os
+import resource
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from apps.payments.reconciliation import SETTLEMENT_FORMATS, ledger_lookup, reconcile_file
+from apps.payments.settlement_samples import sample_lookup, write_sample_settlement
+
+
+class Command(BaseCommand):
+    """قياس زمن مطابقة ملف تسوية كبير وذاكرتها على نواة واحدة"""
+    help = (
+        'توليد ملف تسوية اصطناعي (أو استخدام ملف موجود بـ --settlement) ثم مطابقته وقياس المعدل '
+        'وأقصى ذاكرة مقيمة. المطابقة تستخدم دفتراً اصطناعياً، أو قاعدة البيانات بـ --ledger'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=10_000_000)
+        parser.add_argument('--format', choices=sorted(SETTLEMENT_FORMATS), default='stripe')
+        parser.add_argument('--mismatch-every', type=int, default=10_000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--settlement', help='ملف تسوية موجود بدلاً من التوليد')
+        parser.add_argument('--ledger', action='store_true', help='المطابقة مع المعاملات في قاعدة البيانات')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            source = options['settlement']
+            if not source:
+                source = os.path.join(directory, 'settlement.csv')
+                started = time.perf_counter()
+                with open(source, 'w', newline='', encoding='utf-8') as file:
+                    write_sample_settlement(
+                        file, options['lines'], format=options['format'],
+                        mismatch_every=options['mismatch_every'],
+                    )
+                self.stdout.write(
+                    f'التوليد: {time.perf_counter() - started:.1f} ث، '
+                    f'الحجم: {os.path.getsize(source) / 2 ** 20:.0f} م.ب'
+                )
+
+            lookup = ledger_lookup if options['ledger'] else sample_lookup(options['format'])
+            memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            started = time.perf_counter()
+            result = reconcile_file(
+                source, os.path.join(directory, 'report.csv'),
+                format=options['format'], lookup=lookup, batch_size=options['batch_size'],
+            )
+            elapsed = time.perf_counter() - started
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        self.stdout.write(
+            f'الأسطر: {result.lines}، المطابقة: {result.matched}، الفروق: {result.mismatched}، '
+            f'المتخطاة: {result.skipped}\n'
+            f'المطابقة: {elapsed:.1f} ث ({result.lines / elapsed if elapsed else 0:.0f} سطر/ث)، '
+            f'أقصى ذاكرة مقيمة: {peak // 1024} م.ب (الزيادة أثناء المطابقة {(peak - memory) // 1024} م.ب)'
+        )
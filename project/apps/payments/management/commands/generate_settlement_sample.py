@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from apps.payments.reconciliation import SETTLEMENT_FORMATS
+from apps.payments.settlement_samples import write_sample_settlement
+
+
+class Command(BaseCommand):
+    """توليد ملف تسوية اصطناعي لقياس أداء المطابقة"""
+    help = 'كتابة ملف تسوية CSV اصطناعي بعدد الأسطر المطلوب مع فروق متعمدة'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='مسار الملف')
+        parser.add_argument('--lines', type=int, default=1_000_000)
+        parser.add_argument('--format', choices=sorted(SETTLEMENT_FORMATS), default='stripe')
+        parser.add_argument('--mismatch-every', type=int, default=10_000, help='إفساد سطر من كل عدد (0 دون فروق)')
+
+    def handle(self, *args, **options):
+        with open(options['output'], 'w', newline='', encoding='utf-8') as file:
+            broken = write_sample_settlement(
+                file, options['lines'], format=options['format'], mismatch_every=options['mismatch_every']
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'تمت كتابة {options["lines"]} سطر منها {broken} فرقاً متعمداً'
+        ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, Exists, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Now
+from apps.orders.models import Order
+from apps.payments.models import Transaction
+
+
+class Command(BaseCommand):
+    """إعادة بناء رصيدي المدفوع والمسترد وحالة الدفع لكل طلب من دفتر المعاملات لإصلاح أي انحراف"""
+    help = 'إعادة حساب amount_paid و amount_refunded وحالة الدفع للطلبات من المعاملات المكتملة'
+
+    def handle(self, *args, **options):
+        entries = Transaction.objects.filter(payment__order=OuterRef('pk'), status='completed').order_by()
+
+        def total(*types):
+            sums = entries.filter(transaction_type__in=types).values('payment__order').annotate(total=Sum('amount'))
+            return Coalesce(
+                Subquery(sums.values('total')), Value(0),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            )
+
+        with transaction.atomic():
+            orders = Order.objects.update(
+                amount_paid=total('payment', 'capture'),
+                amount_refunded=total('refund'),
+                updated_at=Now(),
+            )
+            # حالة الطلبات دون معاملات (مثل الدفع عند الاستلام) قد تكون محددة يدوياً فتبقى كما هي
+            derived = Order.objects.filter(Exists(entries)).update(
+                payment_status=Order.payment_status_expression(F('amount_paid'), F('amount_refunded')),
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'تمت إعادة بناء أرصدة {orders} طلب وحالة دفع {derived} منها'
+        ))
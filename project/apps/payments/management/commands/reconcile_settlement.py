@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from apps.payments.reconciliation import SETTLEMENT_FORMATS, ReconciliationError, reconcile_file
+
+
+class Command(BaseCommand):
+    """مطابقة ملف تسوية بوابة مع دفتر المعاملات وكتابة تقرير الفروق"""
+    help = 'قراءة ملف تسوية CSV (Stripe أو PayPal) تدفقياً ومطابقته مع المعاملات وكتابة الفروق إلى تقرير CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('settlement', help='مسار ملف التسوية')
+        parser.add_argument('--format', choices=sorted(SETTLEMENT_FORMATS), default='stripe')
+        parser.add_argument('--output', default='reconciliation.csv', help='مسار تقرير الفروق')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            result = reconcile_file(
+                options['settlement'], options['output'],
+                format=options['format'], batch_size=options['batch_size'],
+            )
+        except (OSError, ReconciliationError) as error:
+            raise CommandError(str(error))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'الأسطر: {result.lines}، المطابقة: {result.matched}، '
+            f'الفروق: {result.mismatched}، المتخطاة: {result.skipped}'
+        ))
@@ -86,54 +86,14 @@ class Payment(models.Model):
         verbose_name = _('دفع')
         verbose_name_plural = _('الدفعات')
         ordering = ['-created_at']
+        indexes = [
+            # إشعارات البوابات تبحث عن الدفعة بمعرف معاملتها
+            models.Index(fields=['transaction_id']),
+        ]
 
     def __str__(self):
         return f"دفع للطلب #{self.order.order_number} - {self.amount}"
 
-    def save(self, *args, **kwargs):
-        # تحديث حالة الدفع في الطلب
-        if self.pk:
-            old_payment = Payment.objects.get(pk=self.pk)
-            if old_payment.status != self.status:
-                self.update_order_payment_status()
-        else:
-            # عند إنشاء دفعة جديدة
-            self.update_order_payment_status()
-
-        super().save(*args, **kwargs)
-
-    def update_order_payment_status(self):
-        """تحديث حالة الدفع في الطلب"""
-        from django.db.models import Sum
-
-        order = self.order
-        payments = Payment.objects.filter(order=order)
-
-        # حساب المجموع المدفوع
-        total_paid = payments.filter(
-            status__in=['completed', 'partially_refunded']
-        ).aggregate(total=Sum('amount'))['total'] or 0
-
-        # حساب المجموع المسترد
-        total_refunded = payments.filter(
-            status__in=['refunded', 'partially_refunded']
-        ).aggregate(total=Sum('refund_amount'))['total'] or 0
-
-        # تحديث حالة الدفع في الطلب
-        if total_paid >= order.total:
-            if total_refunded >= order.total:
-                order.payment_status = 'refunded'
-            elif total_refunded > 0:
-                order.payment_status = 'partially_refunded'
-            else:
-                order.payment_status = 'paid'
-        elif total_paid > 0:
-            order.payment_status = 'partially_paid'
-        else:
-            order.payment_status = 'unpaid'
-
-        order.save()
-
 
 class PaymentMethod(models.Model):
     """نموذج طرق الدفع المتاحة"""
@@ -224,6 +184,66 @@ class Transaction(models.Model):
         verbose_name = _('معاملة')
         verbose_name_plural = _('المعاملات')
         ordering = ['-created_at']
+        indexes = [
+            # مطابقة ملفات تسوية البوابات تبحث عن المعاملات بمعرفاتها على دفعات
+            models.Index(fields=['transaction_id']),
+        ]
 
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.amount} - {self.get_status_display()}"
+
+    def save(self, *args, **kwargs):
+        # الدفتر للإضافة فقط: التصحيح يكون بمعاملة جديدة (إرجاع أو إلغاء) لا بتعديل معاملة مسجلة
+        if not self._state.adding:
+            raise ValueError(_('لا يمكن تعديل معاملة مسجلة في الدفتر'))
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError(_('لا يمكن حذف معاملة مسجلة في الدفتر'))
+
+
+class WebhookEvent(models.Model):
+    """
+    صندوق وارد إشعارات بوابات الدفع: يحفظ الإشعار الخام بعد التحقق ويعالج لاحقاً على دفعات.
+    القيد الفريد على (البوابة، معرف الحدث) يجعل إعادة إرسال الإشعار نفسه بلا أثر.
+    """
+    PROVIDER_CHOICES = [
+        ('stripe', 'Stripe'),
+        ('paypal', 'PayPal'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', _('بانتظار المعالجة')),
+        ('processing', _('قيد المعالجة')),
+        ('processed', _('تمت المعالجة')),
+        ('ignored', _('متجاهل')),
+        ('failed', _('فشل')),
+    ]
+
+    provider = models.CharField(_('البوابة'), max_length=20, choices=PROVIDER_CHOICES)
+    event_id = models.CharField(_('معرف الحدث'), max_length=255)
+    event_type = models.CharField(_('نوع الحدث'), max_length=100)
+    payload = models.JSONField(_('محتوى الإشعار'), default=dict)
+    # ترويسات التحقق من التوقيع التي يحتاجها المعالج (PayPal يتحقق عبر واجهته)
+    headers = models.JSONField(_('الترويسات'), default=dict, blank=True)
+    status = models.CharField(_('الحالة'), max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(_('عدد المحاولات'), default=0)
+    error = models.TextField(_('الخطأ'), blank=True)
+
+    received_at = models.DateTimeField(_('تاريخ الاستلام'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
+    processed_at = models.DateTimeField(_('تاريخ المعالجة'), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('إشعار بوابة')
+        verbose_name_plural = _('إشعارات البوابات')
+        ordering = ['-received_at']
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'event_id'], name='unique_webhook_event'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_type} ({self.event_id})"
@@ -0,0 +1,143 @@
+"""
+مطابقة ملفات تسوية البوابات مع دفتر المعاملات
+
+ملف التسوية (تقرير Stripe المفصل أو سجل نشاط PayPal بصيغة CSV) يُقرأ سطراً سطراً،
+وتُجمع أسطره في دفعات ثابتة الحجم تُطابق كل منها باستعلام واحد على فهرس Transaction.transaction_id،
+وتُكتب الفروق إلى التقرير فور اكتشافها. لا يُحتفظ إلا بالدفعة الحالية في الذاكرة،
+فيبقى استهلاكها ثابتاً مهما كبر الملف.
+
+المطابقة من جهة ملف التسوية: كل سطر له معاملة مكتملة في الدفتر بالنوع والمبلغ نفسيهما،
+وأنواع الأسطر غير المالية (التحويلات والرسوم) تُتخطى.
+"""
+import csv
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from django.utils.translation import gettext as _
+
+from .models import Transaction
+
+
+# أعمدة صيغة ملف التسوية، و types يحول نوع السطر في البوابة إلى نوع المعاملة في الدفتر
+SettlementFormat = namedtuple('SettlementFormat', 'id_column type_column amount_column currency_column types')
+
+SETTLEMENT_FORMATS = {
+    # تقرير Stripe «Balance change from activity» المفصل (المبالغ بالوحدة الكبرى والإرجاع سالب)
+    'stripe': SettlementFormat(
+        'source_id', 'reporting_category', 'gross', 'currency',
+        {'charge': 'payment', 'refund': 'refund'},
+    ),
+    # سجل نشاط PayPal
+    'paypal': SettlementFormat(
+        'Transaction ID', 'Type', 'Gross', 'Currency',
+        {'Express Checkout Payment': 'payment', 'General Payment': 'payment', 'Payment Refund': 'refund'},
+    ),
+}
+
+SettlementLine = namedtuple('SettlementLine', 'line_number transaction_id transaction_type amount currency')
+
+Mismatch = namedtuple('Mismatch', 'line_number transaction_id reason settlement_amount ledger_amount')
+
+ReconcileResult = namedtuple('ReconcileResult', 'lines matched mismatched skipped')
+
+REPORT_HEADER = ('line', 'transaction_id', 'reason', 'settlement_amount', 'ledger_amount')
+
+
+class ReconciliationError(Exception):
+    """ملف تسوية لا يمكن قراءته"""
+
+
+def read_settlement(file, format='stripe'):
+    """
+    أسطر ملف التسوية كمولد SettlementLine؛ أنواع الأسطر غير المعرفة في الصيغة تعطى نوعاً فارغاً (تُتخطى)،
+    والسطر الناقص نوعه None والمبلغ غير الصالح None، فيظهران في التقرير دون إيقاف القراءة
+    """
+    spec = SETTLEMENT_FORMATS[format]
+    reader = csv.reader(file)
+    header = next(reader, None)
+    try:
+        columns = [header.index(name) for name in (
+            spec.id_column, spec.type_column, spec.amount_column, spec.currency_column
+        )]
+    except (AttributeError, ValueError):
+        raise ReconciliationError(_('أعمدة ملف التسوية لا تطابق صيغة %s') % format)
+    id_index, type_index, amount_index, currency_index = columns
+    types = spec.types
+
+    width = max(columns)
+    # السطر الأول ترويسة
+    for line_number, row in enumerate(reader, start=2):
+        if len(row) <= width:
+            yield SettlementLine(line_number, '', None, None, '')
+            continue
+        try:
+            amount = Decimal(row[amount_index].replace(',', ''))
+        except InvalidOperation:
+            amount = None
+        yield SettlementLine(
+            line_number, row[id_index], types.get(row[type_index], ''), amount, row[currency_index]
+        )
+
+
+def ledger_lookup(transaction_ids):
+    """المعاملات المكتملة للمعرفات باستعلام واحد: {المعرف: {النوع: المبلغ}}"""
+    ledger = {}
+    rows = Transaction.objects.filter(transaction_id__in=transaction_ids, status='completed').values_list(
+        'transaction_id', 'transaction_type', 'amount'
+    ).order_by()
+    for transaction_id, transaction_type, amount in rows:
+        if transaction_type == 'capture':
+            transaction_type = 'payment'
+        entries = ledger.setdefault(transaction_id, {})
+        entries[transaction_type] = entries.get(transaction_type, 0) + amount
+    return ledger
+
+
+def _batches(lines, batch_size):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def reconcile(lines, report, lookup=ledger_lookup, batch_size=1000):
+    """
+    مطابقة أسطر التسوية مع الدفتر على دفعات، واستدعاء report(Mismatch) لكل فرق فور اكتشافه.
+    lookup يعيد معاملات الدفعة ({المعرف: {النوع: المبلغ}})، ويستبدل في قياس الأداء.
+    """
+    counts = {'lines': 0, 'matched': 0, 'mismatched': 0, 'skipped': 0}
+    for batch in _batches(lines, batch_size):
+        counts['lines'] += len(batch)
+        ledger = lookup({line.transaction_id for line in batch if line.transaction_type})
+        for line in batch:
+            if line.transaction_type == '':
+                counts['skipped'] += 1
+                continue
+            entries = ledger.get(line.transaction_id)
+            ledger_amount = entries.get(line.transaction_type) if entries else None
+            if line.transaction_type is None or line.amount is None:
+                reason = 'malformed'
+            elif entries is None:
+                reason = 'missing'
+            elif ledger_amount is None:
+                reason = 'type'
+            elif abs(line.amount) != ledger_amount:
+                reason = 'amount'
+            else:
+                counts['matched'] += 1
+                continue
+            counts['mismatched'] += 1
+            report(Mismatch(line.line_number, line.transaction_id, reason, line.amount, ledger_amount))
+    return ReconcileResult(**counts)
+
+
+def reconcile_file(source, output, format='stripe', lookup=ledger_lookup, batch_size=1000):
+    """مطابقة ملف تسوية (مسار) وكتابة تقرير الفروق CSV إلى output (مسار) أثناء القراءة"""
+    with open(source, newline='', encoding='utf-8-sig') as settlement, \
+            open(output, 'w', newline='', encoding='utf-8') as report:
+        writer = csv.writer(report)
+        writer.writerow(REPORT_HEADER)
+        return reconcile(read_settlement(settlement, format), writer.writerow, lookup=lookup, batch_size=batch_size)
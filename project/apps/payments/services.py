@@ -0,0 +1,184 @@
+"""
+خدمات الدفع على مرحلتين
+
+استدعاءات البوابات تتم خارج معاملات قاعدة البيانات: تُنشأ الدفعة (أو يُحجز الإرجاع) في معاملة قصيرة،
+ثم تُستدعى البوابة دون أي قفل أو معاملة مفتوحة، ثم تُحفظ النتيجة في معاملة قصيرة ثانية
+بعد قفل صف الدفعة. الدفعة العالقة بين المرحلتين تبقى pending أو processing
+ومعرفها في مفتاح منع التكرار، فإعادة المحاولة لا تنشئ دفعة مكررة في البوابة.
+"""
+import logging
+import uuid
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from apps.products.inventory import release_order
+from .gateways import GatewayError, get_gateway
+from .ledger import record_transaction
+from .models import Payment
+
+
+logger = logging.getLogger(__name__)
+
+# حالات تأكد فيها الطلب سابقاً، فيكفي حفظ حالة الدفع
+CONFIRMED_STATUSES = ('confirmed', 'processing', 'shipped', 'delivered')
+
+PaymentStart = namedtuple('PaymentStart', 'payment client_secret redirect_url')
+
+
+class PaymentError(Exception):
+    """تعذر إنشاء الدفع أو إرجاعه"""
+
+
+def confirm_order(order):
+    """
+    تأكيد الطلب بعد نجاح الدفع (ويخصم كمياته المحجوزة)، أو حفظ حالة الدفع فقط إذا كان مؤكداً.
+    الدفع لطلب ملغي أو مسترد لا يعيده للتأكيد، بل يُعلّم للمراجعة اليدوية واسترداد المبلغ.
+    """
+    if order.can_transition_to('confirmed'):
+        order.transition_to('confirmed')
+    elif order.status in CONFIRMED_STATUSES:
+        order.save()
+    else:
+        logger.warning('دفع لطلب لا يمكن تأكيده: %s (الحالة %s)', order.order_number, order.status)
+        order.requires_review = True
+        order.review_reason = _('تم الدفع لطلب في حالة %s ويحتاج استرداد المبلغ') % order.get_status_display()
+        order.save()
+
+
+def _locked(payment):
+    return Payment.objects.select_for_update().select_related('order').get(pk=payment.pk)
+
+
+@transaction.atomic
+def fail_payment(payment, error):
+    """تسجيل فشل الدفع وتحرير حجوزات الطلب"""
+    payment = _locked(payment)
+    if payment.status in ('completed', 'refunded', 'partially_refunded'):
+        return payment
+    payment.status = 'failed'
+    payment.gateway_response = {'error': str(error), **getattr(error, 'response', {})}
+    payment.save()
+    release_order(payment.order)
+    return payment
+
+
+@transaction.atomic
+def finalize_payment(payment, result, user=None):
+    """
+    حفظ نتيجة البوابة على الدفعة المقفلة. إشعار البوابة قد يسبق عودة الاستدعاء،
+    فالدفعة المكتملة لا تعاد إلى processing.
+    """
+    if user is not None and result.customer_id and result.customer_id != user.stripe_customer_id:
+        type(user).objects.filter(pk=user.pk).update(stripe_customer_id=result.customer_id)
+        user.stripe_customer_id = result.customer_id
+
+    payment = _locked(payment)
+    completed_now = result.status == 'completed' and payment.status != 'completed'
+    payment.transaction_id = result.transaction_id or payment.transaction_id
+    payment.gateway_response = result.response
+    if payment.status != 'completed':
+        payment.status = result.status
+    if result.status == 'completed' and not payment.completed_at:
+        payment.completed_at = timezone.now()
+    payment.save()
+    if result.status == 'completed':
+        if payment.method == 'cash_on_delivery':
+            # سيتم الدفع عند الاستلام، فلا يُسجل في الدفتر حتى يُستلم المبلغ
+            payment.order.payment_status = 'unpaid'
+        elif completed_now:
+            record_transaction(payment, 'payment', payment.amount, payment.transaction_id, result.response)
+        confirm_order(payment.order)
+    return payment
+
+
+def start_payment(order, method, user=None, **context):
+    """
+    إنشاء دفعة للطلب: دفعة pending في معاملة، ثم البوابة خارج أي معاملة، ثم حفظ النتيجة.
+    يرفع PaymentError إذا رفضت البوابة الدفع (وتُسجل الدفعة فاشلة وتُحرر الحجوزات).
+    """
+    gateway = get_gateway(method)
+    with transaction.atomic():
+        payment = Payment.objects.create(order=order, amount=order.total, method=method)
+
+    try:
+        result = gateway.create_payment(payment, user=user, **context)
+    except GatewayError as error:
+        fail_payment(payment, error)
+        raise PaymentError(str(error)) from error
+
+    payment = finalize_payment(payment, result, user=user)
+    return PaymentStart(payment, result.client_secret, result.redirect_url)
+
+
+def execute_payment(payment, **params):
+    """تنفيذ الدفع بعد موافقة المشتري في البوابة (PayPal)، على مرحلتين أيضاً"""
+    if payment.status == 'completed':
+        return payment
+    try:
+        result = get_gateway(payment.method).execute_payment(payment, **params)
+    except GatewayError as error:
+        fail_payment(payment, error)
+        raise PaymentError(str(error)) from error
+    return finalize_payment(payment, result)
+
+
+@transaction.atomic
+def complete_payment(payment, response):
+    """إكمال الدفع من إشعار البوابة (مثل payment_intent.succeeded) وتأكيد الطلب مرة واحدة"""
+    payment = _locked(payment)
+    if payment.status == 'completed':
+        return payment
+    payment.status = 'completed'
+    payment.completed_at = timezone.now()
+    payment.gateway_response = response
+    payment.save()
+    record_transaction(payment, 'payment', payment.amount, payment.transaction_id, response)
+    confirm_order(payment.order)
+    return payment
+
+
+def parse_refund_amount(payment, amount):
+    """مبلغ الإرجاع Decimal بين الصفر ومبلغ الدفعة، أو PaymentError"""
+    try:
+        amount = Decimal(str(amount))
+    except (InvalidOperation, ValueError, TypeError):
+        raise PaymentError(_('مبلغ الإرجاع غير صالح'))
+    if not amount.is_finite() or amount <= 0 or amount > payment.amount:
+        raise PaymentError(_('مبلغ الإرجاع غير صالح'))
+    return amount
+
+
+def refund_payment(payment, amount, reason=''):
+    """
+    إرجاع مبلغ من دفعة مكتملة: حجز الدفعة بتحديث شرطي (completed إلى processing) يمنع إرجاعين متزامنين،
+    ثم البوابة خارج أي معاملة، ثم حفظ الإرجاع أو إعادة الدفعة مكتملة إذا رفضته البوابة
+    """
+    amount = parse_refund_amount(payment, amount)
+    gateway = get_gateway(payment.method)
+    if not Payment.objects.filter(pk=payment.pk, status='completed').update(
+        status='processing', updated_at=timezone.now()
+    ):
+        raise PaymentError(_('لا يمكن إرجاع هذا الدفع'))
+
+    try:
+        result = gateway.refund(payment, amount, reason, idempotency_key=f'refund-{payment.pk}-{uuid.uuid4()}')
+    except GatewayError as error:
+        Payment.objects.filter(pk=payment.pk, status='processing').update(
+            status='completed', updated_at=timezone.now()
+        )
+        raise PaymentError(str(error)) from error
+
+    with transaction.atomic():
+        payment = _locked(payment)
+        refunded = amount == payment.amount
+        payment.status = 'refunded' if refunded else 'partially_refunded'
+        payment.refund_amount = amount
+        payment.refund_reason = reason
+        payment.refund_transaction_id = result.transaction_id
+        payment.gateway_response = {**payment.gateway_response, 'refund': result.response}
+        payment.save()
+        record_transaction(payment, 'refund', amount, result.transaction_id, result.response)
+    return payment
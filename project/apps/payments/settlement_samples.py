@@ -0,0 +1,77 @@
+"""
+ملفات تسوية اصطناعية لقياس أداء المطابقة
+
+كل سطر يشتق معرفه ونوعه ومبلغه من رقمه، فيمكن توليد ملفات بعشرات الملايين من الأسطر دون ذاكرة،
+و sample_lookup يعيد المعاملات «الصحيحة» لأي دفعة معرفات دون قاعدة بيانات.
+كل mismatch_every سطر يُفسد عمداً (مبلغ مختلف أو معرف غير موجود) ليظهر في التقرير.
+"""
+import csv
+from decimal import Decimal
+
+from .reconciliation import SETTLEMENT_FORMATS
+
+
+# بادئات المعرفات وأنواع الأسطر لكل صيغة: (دفع، إرجاع، تحويل يُتخطى)
+SAMPLE_KINDS = {
+    'stripe': (('pi_', 'charge'), ('re_', 'refund'), ('po_', 'payout')),
+    'paypal': (('PAY-', 'Express Checkout Payment'), ('REF-', 'Payment Refund'), ('WD-', 'General Withdrawal')),
+}
+
+DIGITS = 12
+
+
+def _kind(number):
+    # كل عاشر سطر إرجاع وكل خمسين تحويل
+    if number % 50 == 49:
+        return 2
+    return 1 if number % 10 == 9 else 0
+
+
+def _cents(number):
+    return 100 + number * 7919 % 99900
+
+
+def _format(cents):
+    sign = '-' if cents < 0 else ''
+    cents = abs(cents)
+    return f'{sign}{cents // 100}.{cents % 100:02d}'
+
+
+def write_sample_settlement(file, lines, format='stripe', mismatch_every=0):
+    """كتابة ملف تسوية اصطناعي بعدد الأسطر؛ يعيد عدد الأسطر المفسدة"""
+    spec = SETTLEMENT_FORMATS[format]
+    kinds = SAMPLE_KINDS[format]
+    writer = csv.writer(file)
+    writer.writerow((spec.id_column, spec.type_column, spec.amount_column, spec.currency_column, 'description'))
+    broken = 0
+    for number in range(lines):
+        kind = _kind(number)
+        prefix, line_type = kinds[kind]
+        transaction_id = f'{prefix}{number:0{DIGITS}d}'
+        cents = _cents(number)
+        if kind:
+            cents = -cents
+        if mismatch_every and kind != 2 and number % mismatch_every == 0:
+            broken += 1
+            if broken % 2:
+                cents += 1
+            else:
+                transaction_id += 'x'
+        writer.writerow((transaction_id, line_type, _format(cents), 'sar', f'sample {number}'))
+    return broken
+
+
+def sample_lookup(format='stripe'):
+    """بديل ledger_lookup يعيد المعاملات الصحيحة لمعرفات الملف الاصطناعي"""
+    kinds = {prefix: 'refund' if kind == 1 else 'payment' for kind, (prefix, _) in enumerate(SAMPLE_KINDS[format][:2])}
+
+    def lookup(transaction_ids):
+        ledger = {}
+        for transaction_id in transaction_ids:
+            number = transaction_id[-DIGITS:]
+            transaction_type = kinds.get(transaction_id[:-DIGITS])
+            if transaction_type and number.isdigit():
+                ledger[transaction_id] = {transaction_type: Decimal(_cents(int(number))) / 100}
+        return ledger
+
+    return lookup
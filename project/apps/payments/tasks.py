@@ -0,0 +1,8 @@
+from celery import shared_task
+from .webhooks import process_events
+
+
+@shared_task
+def process_webhook_events(batch_size=100):
+    """معالجة إشعارات البوابات المحفوظة على دفعات"""
+    return process_events(batch_size=batch_size)._asdict()
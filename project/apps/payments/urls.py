@@ -10,6 +10,7 @@ urlpatterns = [
     path('api/', views.PaymentListView.as_view(), name='payment_list_api'),
     path('api/<int:pk>/', views.PaymentDetailView.as_view(), name='payment_detail_api'),
     path('api/create/', views.create_payment, name='create_payment_api'),
+    path('api/<int:payment_id>/refund/', views.refund_payment, name='refund_payment_api'),
 
     # واجهات HTML
     path('order/<int:order_id>/', views.payment_page, name='payment_page'),
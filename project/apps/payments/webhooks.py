@@ -0,0 +1,152 @@
+"""
+صندوق وارد إشعارات بوابات الدفع
+
+الطلب الوارد يتحقق من التوقيع (Stripe محلياً) ويحفظ الحدث الخام بإدراج يتجاهل التعارض
+على القيد الفريد (البوابة، معرف الحدث) ثم يعيد 200 فوراً؛ الحدث المعاد إرساله لا يُدرج مرة ثانية.
+عمال Celery يحجزون الأحداث على دفعات بتحديث شرطي (مع تخطي الصفوف المقفلة)،
+ثم يطبق كل حدث ويعلّم معالجاً في معاملة واحدة، فلا يطبق الحدث مرتين ولا يضيع إذا توقف العامل.
+"""
+import logging
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .gateways import get_gateway
+from .models import Payment, WebhookEvent
+from .services import complete_payment, fail_payment
+
+
+logger = logging.getLogger(__name__)
+
+ProcessResult = namedtuple('ProcessResult', 'processed ignored failed')
+
+
+class WebhookError(Exception):
+    """إشعار لا يمكن قبوله أو معالجته"""
+
+
+def record_event(provider, event_id, event_type, payload, headers=None):
+    """حفظ الحدث مرة واحدة وجدولة معالجته بعد نجاح المعاملة"""
+    if not event_id or not event_type:
+        raise WebhookError(_('إشعار دون معرف أو نوع'))
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(
+            provider=provider, event_id=event_id, event_type=event_type,
+            payload=payload, headers=headers or {},
+        )],
+        ignore_conflicts=True,
+    )
+    transaction.on_commit(_schedule_processing)
+
+
+def _schedule_processing():
+    """إرسال مهمة المعالجة دون إفشال الاستجابة؛ المهمة الدورية تلتقط ما فات"""
+    from .tasks import process_webhook_events
+
+    try:
+        process_webhook_events.delay()
+    except Exception:
+        logger.exception('تعذر جدولة معالجة إشعارات البوابات')
+
+
+def _payment_for(transaction_id):
+    payment = Payment.objects.filter(transaction_id=transaction_id).first() if transaction_id else None
+    if payment is None:
+        raise WebhookError(_('الدفع غير موجود: %s') % transaction_id)
+    return payment
+
+
+def stripe_payment_succeeded(event):
+    intent = event.payload['data']['object']
+    complete_payment(_payment_for(intent['id']), intent)
+
+
+def stripe_payment_failed(event):
+    intent = event.payload['data']['object']
+    error = intent.get('last_payment_error') or {}
+    fail_payment(_payment_for(intent['id']), error.get('message') or event.event_type)
+
+
+def paypal_sale_completed(event):
+    sale = event.payload['resource']
+    complete_payment(_payment_for(sale.get('parent_payment')), event.payload)
+
+
+def paypal_sale_denied(event):
+    sale = event.payload['resource']
+    fail_payment(_payment_for(sale.get('parent_payment')), event.event_type)
+
+
+# معالجات الأحداث حسب (البوابة، النوع)؛ غيرها يعلّم متجاهلاً
+EVENT_HANDLERS = {
+    ('stripe', 'payment_intent.succeeded'): stripe_payment_succeeded,
+    ('stripe', 'payment_intent.payment_failed'): stripe_payment_failed,
+    ('paypal', 'PAYMENT.SALE.COMPLETED'): paypal_sale_completed,
+    ('paypal', 'PAYMENT.SALE.DENIED'): paypal_sale_denied,
+}
+
+
+def claim_events(batch_size):
+    """
+    حجز دفعة من الأحداث المستحقة للمعالجة: الجديدة، والفاشلة دون الحد الأقصى للمحاولات
+    بعد مهلة إعادة المحاولة، والعالقة قيد المعالجة بعد توقف عاملها
+    """
+    now = timezone.now()
+    due = (
+        Q(status='pending')
+        | Q(
+            status='failed', attempts__lt=settings.WEBHOOK_MAX_ATTEMPTS,
+            updated_at__lt=now - timedelta(seconds=settings.WEBHOOK_RETRY_DELAY),
+        )
+        | Q(status='processing', updated_at__lt=now - timedelta(seconds=settings.WEBHOOK_PROCESSING_TIMEOUT))
+    )
+    with transaction.atomic():
+        ids = list(
+            WebhookEvent.objects.filter(due).select_for_update(skip_locked=True)
+            .order_by('received_at', 'pk').values_list('pk', flat=True)[:batch_size]
+        )
+        WebhookEvent.objects.filter(pk__in=ids).update(
+            status='processing', attempts=F('attempts') + 1, updated_at=now
+        )
+    return list(WebhookEvent.objects.filter(pk__in=ids).order_by('received_at', 'pk'))
+
+
+def verify_event(event):
+    """التحقق المؤجل من توقيع إشعار PayPal (يتطلب استدعاء واجهته، فيتم خارج الطلب والمعاملة)"""
+    if event.provider == 'paypal' and not get_gateway('paypal').verify_webhook(event.headers, event.payload):
+        raise WebhookError(_('توقيع إشعار PayPal غير صالح'))
+
+
+def process_event(event):
+    """تطبيق الحدث وتعليمه معالجاً في معاملة واحدة، أو تسجيل الخطأ لإعادة المحاولة"""
+    handler = EVENT_HANDLERS.get((event.provider, event.event_type))
+    try:
+        if handler is not None:
+            verify_event(event)
+        with transaction.atomic():
+            if handler is not None:
+                handler(event)
+            WebhookEvent.objects.filter(pk=event.pk).update(
+                status='processed' if handler else 'ignored', error='', processed_at=timezone.now(),
+                updated_at=timezone.now(),
+            )
+    except Exception as error:
+        logger.exception('تعذرت معالجة إشعار %s', event)
+        WebhookEvent.objects.filter(pk=event.pk).update(
+            status='failed', error=str(error), updated_at=timezone.now()
+        )
+        return 'failed'
+    return 'processed' if handler else 'ignored'
+
+
+def process_events(batch_size=100):
+    """معالجة الأحداث المستحقة على دفعات حتى لا يبقى منها شيء"""
+    counts = {'processed': 0, 'ignored': 0, 'failed': 0}
+    while events := claim_events(batch_size):
+        for event in events:
+            counts[process_event(event)] += 1
+    return ProcessResult(**counts)
@@ -5,14 +5,14 @@ from django.utils.translation import gettext_lazy as _
 from .models import (
     Category, Tag, Brand, Product, ProductImage, 
     ProductVariant, ProductOption, ProductOptionValue,
-    ProductVariantOption, ProductReview, ProductReviewImage
+    ProductVariantOption, ProductReview, ProductReviewImage, StockReservation
 )
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     """إعدادات إدارة الفئات"""
-    list_display = ('name', 'slug', 'parent', 'is_active', 'created_at')
+    list_display = ('name', 'slug', 'parent', 'depth', 'is_active', 'created_at')
     list_filter = ('is_active', 'parent')
     search_fields = ('name', 'slug', 'description')
     prepopulated_fields = {'slug': ('name',)}
@@ -83,7 +83,7 @@ class ProductVariantOptionInline(admin.TabularInline):
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     """إعدادات إدارة المنتجات"""
-    list_display = ('name', 'category', 'brand', 'price', 'quantity', 'status', 'featured', 'created_at')
+    list_display = ('name', 'category', 'brand', 'price', 'quantity', 'status', 'featured', 'rating_average', 'created_at')
     list_filter = ('status', 'featured', 'category', 'brand', 'created_at')
     search_fields = ('name', 'sku', 'description', 'short_description')
     prepopulated_fields = {'slug': ('name',)}
@@ -139,6 +139,16 @@ class ProductVariantAdmin(admin.ModelAdmin):
     inlines = [ProductVariantOptionInline]
 
 
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    """إعدادات إدارة حجوزات المخزون"""
+    list_display = ('product', 'variant', 'order', 'quantity', 'status', 'expires_at', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('product__name', 'variant__sku', 'order__order_number')
+    raw_id_fields = ('product', 'variant', 'order')
+    readonly_fields = ('quantity', 'status', 'expires_at', 'created_at')
+
+
 @admin.register(ProductOption)
 class ProductOptionAdmin(admin.ModelAdmin):
     """إعدادات إدارة خيارات المنتجات"""
@@ -173,13 +183,13 @@ class ProductReviewAdmin(admin.ModelAdmin):
 
     def approve_reviews(self, request, queryset):
         """موافقة على التقييمات المحددة"""
-        count = queryset.update(is_approved=True)
+        count = queryset.set_approved(True)
         self.message_user(request, f'تمت الموافقة على {count} تقييم بنجاح')
     approve_reviews.short_description = _('موافقة على التقييمات المحددة')
 
     def unapprove_reviews(self, request, queryset):
         """إلغاء موافقة على التقييمات المحددة"""
-        count = queryset.update(is_approved=False)
+        count = queryset.set_approved(False)
         self.message_user(request, f'تم إلغاء موافقة على {count} تقييم بنجاح')
     unapprove_reviews.short_description = _('إلغاء موافقة على التقييمات المحددة')
 
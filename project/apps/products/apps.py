@@ -1,4 +1,3 @@
-
 from django.apps import AppConfig
 
 
@@ -6,3 +5,6 @@ class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.products'
     verbose_name = 'المنتجات'
+
+    def ready(self):
+        import apps.products.signals
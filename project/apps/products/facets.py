@@ -0,0 +1,172 @@
+"""
+محرك الفلاتر الوجهية (Facets) فوق ProductFilter
+
+يحسب لمجموعة النتائج المصفاة أعداد المنتجات لكل فئة وعلامة تجارية ووسم
+وشريحة سعر وحالة توفر، بعدد ثابت من الاستعلامات المجمعة (أربعة إلى ستة)،
+ويخزن النتيجة مؤقتاً حسب مفتاح الفلاتر بعد توحيده.
+الفلاتر وجهية منفصلة: أعداد كل وجه تحسب دون فلتره هو (مع بقية الفلاتر)،
+فيبقى اختيار فئة أو علامة تجارية معروضاً مع بدائله وأعدادها.
+"""
+import hashlib
+import json
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Model, Q
+
+from .models import IN_STOCK, Product
+
+
+GENERATION_KEY = 'products:facets:generation'
+
+# شرائح السعر: (الحد الأدنى، الحد الأعلى) والحد الأعلى غير مشمول
+PRICE_BUCKETS = [
+    (None, 100),
+    (100, 500),
+    (500, 1000),
+    (1000, 5000),
+    (5000, None),
+]
+
+
+# فلاتر ProductFilter التي يحسب كل وجه دونها
+FACET_FILTERS = {
+    'categories': ('category',),
+    'brands': ('brand',),
+    'price_ranges': ('price_min', 'price_max'),
+    'in_stock': ('in_stock',),
+}
+
+
+def _price_bucket_key(low, high):
+    return f'{low or ""}-{high or ""}'
+
+
+def _price_bucket_filter(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+
+def _normalize_value(value):
+    if isinstance(value, Model):
+        return value.pk
+    if isinstance(value, Decimal):
+        return format(value.normalize(), 'f')
+    if isinstance(value, (list, tuple)):
+        return [_normalize_value(item) for item in value]
+    return str(value)
+
+
+def get_generation():
+    """رقم جيل الفلاتر الوجهية؛ يتغير عند تعديل المنتجات فتُهمل النتائج القديمة"""
+    return cache.get_or_set(GENERATION_KEY, 1, timeout=None)
+
+
+def invalidate_facets():
+    """إبطال جميع النتائج المخزنة بزيادة رقم الجيل"""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, timeout=None)
+
+
+class ProductFacets:
+    """حساب الفلاتر الوجهية لمجموعة نتائج ProductFilter"""
+
+    def __init__(self, filterset, scope=''):
+        self.filterset = filterset
+        self.scope = scope
+
+    def get_cache_key(self):
+        """مفتاح التخزين المؤقت من قيم الفلاتر الصالحة غير الفارغة بترتيب ثابت"""
+        data = self.filterset.form.cleaned_data if self.filterset.is_valid() else {}
+        normalized = {
+            name: _normalize_value(value)
+            for name, value in sorted(data.items())
+            if value not in (None, '', [])
+        }
+        raw = json.dumps([self.scope, normalized], sort_keys=True, ensure_ascii=False)
+        digest = hashlib.md5(raw.encode()).hexdigest()
+        return f'products:facets:{get_generation()}:{digest}'
+
+    def get(self):
+        """الأعداد من التخزين المؤقت أو حسابها"""
+        key = self.get_cache_key()
+        facets = cache.get(key)
+        if facets is None:
+            facets = self.compute()
+            cache.set(key, facets, settings.PRODUCT_FACETS_CACHE_TIMEOUT)
+        return facets
+
+    def is_filtered(self, names):
+        """هل أي من الفلاتر مستخدم في الطلب"""
+        return any(self.filterset.data.get(name) not in (None, '') for name in names)
+
+    def get_queryset(self, excluded=()):
+        """نتائج الفلاتر دون الفلاتر المستبعدة، أو النتائج المصفاة نفسها إن لم يكن أي منها مستخدماً"""
+        if not self.is_filtered(excluded):
+            return self.filterset.qs.order_by()
+        data = self.filterset.data.copy()
+        for name in excluded:
+            data.pop(name, None)
+        filterset = type(self.filterset)(data, queryset=self.filterset.queryset, request=self.filterset.request)
+        return filterset.qs.order_by()
+
+    def compute(self):
+        """
+        حساب الأعداد باستعلامات مجمعة: الفئات والعلامات والوسوم والإجمالي،
+        واستعلام إضافي لشرائح السعر أو التوفر إذا كان فلتره مستخدماً
+        """
+        queryset = self.get_queryset()
+
+        categories = self.get_queryset(FACET_FILTERS['categories']).values(
+            'category_id', 'category__name', 'category__slug'
+        ).annotate(count=Count('pk')).order_by('-count', 'category__name')
+        brands = self.get_queryset(FACET_FILTERS['brands']).filter(brand__isnull=False).values(
+            'brand_id', 'brand__name', 'brand__slug'
+        ).annotate(count=Count('pk')).order_by('-count', 'brand__name')
+        tags = Product.tags.through.objects.filter(product__in=queryset.values('pk')).values(
+            'tag_id', 'tag__name', 'tag__slug'
+        ).annotate(count=Count('product_id')).order_by('-count', 'tag__name')
+
+        # تجميع أعداد الوجوه التي تحسب على المجموعة نفسها في استعلام واحد
+        aggregates = {
+            'price_ranges': {
+                f'price_{index}': Count('pk', filter=_price_bucket_filter(low, high))
+                for index, (low, high) in enumerate(PRICE_BUCKETS)
+            },
+            'in_stock': {'in_stock': Count('pk', filter=IN_STOCK)},
+        }
+        shared = {'total': Count('pk')}
+        totals = {}
+        for facet, counts in aggregates.items():
+            if self.is_filtered(FACET_FILTERS[facet]):
+                totals.update(self.get_queryset(FACET_FILTERS[facet]).aggregate(**counts))
+            else:
+                shared.update(counts)
+        totals.update(queryset.aggregate(**shared))
+
+        return {
+            'total': totals['total'],
+            'categories': [
+                {'id': row['category_id'], 'name': row['category__name'], 'slug': row['category__slug'], 'count': row['count']}
+                for row in categories
+            ],
+            'brands': [
+                {'id': row['brand_id'], 'name': row['brand__name'], 'slug': row['brand__slug'], 'count': row['count']}
+                for row in brands
+            ],
+            'tags': [
+                {'id': row['tag_id'], 'name': row['tag__name'], 'slug': row['tag__slug'], 'count': row['count']}
+                for row in tags
+            ],
+            'price_ranges': [
+                {'key': _price_bucket_key(low, high), 'min': low, 'max': high, 'count': totals[f'price_{index}']}
+                for index, (low, high) in enumerate(PRICE_BUCKETS)
+            ],
+            'in_stock': totals['in_stock'],
+        }
@@ -0,0 +1,282 @@
+"""
+خدمة حجز المخزون
+
+عند إنشاء الطلب تُحجز كمياته مؤقتاً (حتى انتهاء مدة الحجز) بدلاً من خصمها،
+ويبقى المتاح للبيع = quantity - reserved_quantity محفوظاً كعداد على الصف نفسه.
+عند تأكيد الطلب تُخصم الكميات المحجوزة، وعند الإلغاء أو فشل الدفع أو انتهاء المدة تُحرر.
+كل عملية تجمع الكميات حسب المنتج وتنفذ تحديثاً واحداً لكل جدول (المنتجات والمتغيرات)
+بتعبيرات F() بدلاً من حلقات القراءة والتعديل والحفظ.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .facets import invalidate_facets
+from .models import Product, ProductVariant, StockReservation
+
+
+class OutOfStockError(Exception):
+    """كمية غير متوفرة لعنصر أو أكثر من عناصر الطلب"""
+
+    def __init__(self, names):
+        self.names = names
+        super().__init__(_('الكمية المطلوبة غير متوفرة: %s') % '، '.join(names))
+
+
+def _case(deltas):
+    return Case(
+        *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _invalidate_facets_on_availability_change(model, deltas):
+    """
+    إبطال الفلاتر الوجهية المخزنة (وجه التوفر) بعد نجاح المعاملة إذا نفد منتج أو عاد متوفراً
+    بتغير المتاح للبيع {pk: delta}؛ التحديثات الجماعية لا ترسل post_save
+    """
+    changed = [pk for pk, delta in deltas.items() if delta]
+    if model is not Product or not changed:
+        return
+    rows = Product.objects.filter(pk__in=changed, track_quantity=True).values_list(
+        'pk', 'quantity', 'reserved_quantity'
+    )
+    for pk, quantity, reserved in rows:
+        available = quantity - reserved
+        if (available > 0) != (available - deltas[pk] > 0):
+            transaction.on_commit(invalidate_facets)
+            return
+
+
+def adjust_stock(model, quantity=None, reserved=None):
+    """
+    تعديل الكمية و/أو الكمية المحجوزة بفروق {pk: delta} في تحديث واحد
+    """
+    quantity, reserved = quantity or {}, reserved or {}
+    updates = {}
+    if any(quantity.values()):
+        updates['quantity'] = F('quantity') + _case(quantity)
+    if any(reserved.values()):
+        updates['reserved_quantity'] = F('reserved_quantity') + _case(reserved)
+    if updates:
+        pks = set(quantity) | set(reserved)
+        model.objects.filter(pk__in=pks).update(**updates)
+        _invalidate_facets_on_availability_change(
+            model, {pk: quantity.get(pk, 0) - reserved.get(pk, 0) for pk in pks}
+        )
+
+
+def reserve_stock(model, quantities):
+    """
+    زيادة الكمية المحجوزة {pk: quantity} بتحديث شرطي واحد:
+    reserved_quantity = reserved_quantity + n WHERE quantity - reserved_quantity >= n
+    ويعيد المعرفات التي لم تكفِ كميتها المتاحة
+    """
+    if not quantities:
+        return []
+    enough = Q()
+    for pk, quantity in quantities.items():
+        enough |= Q(pk=pk, quantity__gte=F('reserved_quantity') + quantity)
+    updated = model.objects.filter(enough).update(
+        reserved_quantity=F('reserved_quantity') + _case(quantities)
+    )
+    if updated == len(quantities):
+        _invalidate_facets_on_availability_change(model, {pk: -quantity for pk, quantity in quantities.items()})
+        return []
+    available = {
+        pk: quantity - reserved
+        for pk, quantity, reserved in model.objects.filter(pk__in=quantities).values_list(
+            'pk', 'quantity', 'reserved_quantity'
+        )
+    }
+    return [pk for pk, quantity in quantities.items() if available.get(pk, 0) < quantity]
+
+
+@transaction.atomic
+def reserve_items(lines, order=None, ttl=None):
+    """
+    حجز الأسطر [(product, variant, quantity)] للطلب حتى انتهاء المدة.
+    المنتجات التي لا تتبع كميتها لا تُحجز. يرفع OutOfStockError إذا لم تكفِ أي كمية.
+    """
+    product_quantities = defaultdict(int)
+    variant_quantities = defaultdict(int)
+    names = {}
+    reservations = []
+    expires_at = timezone.now() + (ttl or timedelta(seconds=settings.STOCK_RESERVATION_TTL))
+
+    for product, variant, quantity in lines:
+        if not product.track_quantity:
+            continue
+        if variant:
+            variant_quantities[variant.pk] += quantity
+            names[(ProductVariant, variant.pk)] = f'{product.name} - {variant.sku}'
+        else:
+            product_quantities[product.pk] += quantity
+            names[(Product, product.pk)] = product.name
+        reservations.append(StockReservation(
+            product=product, variant=variant, order=order, quantity=quantity, expires_at=expires_at
+        ))
+
+    short = [(Product, pk) for pk in reserve_stock(Product, product_quantities)]
+    short += [(ProductVariant, pk) for pk in reserve_stock(ProductVariant, variant_quantities)]
+    if short:
+        raise OutOfStockError([names[key] for key in short])
+
+    return StockReservation.objects.bulk_create(reservations)
+
+
+def _group_by_target(rows):
+    """تجميع (product_id, variant_id, status, quantity) إلى فروق لكل جدول"""
+    groups = {
+        Product: (defaultdict(int), defaultdict(int)),
+        ProductVariant: (defaultdict(int), defaultdict(int)),
+    }
+    for product_id, variant_id, status, quantity in rows:
+        model, pk = (ProductVariant, variant_id) if variant_id else (Product, product_id)
+        quantities, reserved = groups[model]
+        if status == 'active':
+            reserved[pk] += quantity
+        quantities[pk] += quantity
+    return groups
+
+
+def _lock(reservations):
+    """قفل صفوف الحجوزات (لا يسمح PostgreSQL بـ FOR UPDATE مع التجميع)"""
+    ids = list(reservations.select_for_update().values_list('pk', flat=True))
+    return StockReservation.objects.filter(pk__in=ids)
+
+
+def _reservation_rows(reservations):
+    return reservations.values('product_id', 'variant_id', 'status').annotate(
+        total=Sum('quantity')
+    ).values_list('product_id', 'variant_id', 'status', 'total').order_by()
+
+
+@transaction.atomic
+def release_reservations(reservations, status='released'):
+    """تحرير الحجوزات النشطة من QuerySet وإعادة كمياتها إلى المتاح للبيع"""
+    reservations = _lock(reservations.filter(status='active'))
+    rows = list(_reservation_rows(reservations))
+    if not rows:
+        return 0
+    released = reservations.update(status=status)
+    for model, (quantities, reserved) in _group_by_target(rows).items():
+        adjust_stock(model, reserved={pk: -delta for pk, delta in reserved.items()})
+    return released
+
+
+def _rereserve(reservations):
+    """
+    إعادة حجز كميات الحجوزات المنتهية أو المحررة بالتحديث الشرطي نفسه في نقطة حفظ،
+    فإذا لم تكفِ أي كمية تُلغى إعادة الحجز كلها ويعيد False
+    """
+    rows = list(_reservation_rows(reservations))
+    with transaction.atomic():
+        for model, (quantities, reserved) in _group_by_target(rows).items():
+            if reserve_stock(model, quantities):
+                transaction.set_rollback(True)
+                return False
+        reservations.update(status='active')
+    return True
+
+
+@transaction.atomic
+def commit_orders(order_ids):
+    """
+    خصم كميات الطلبات المؤكدة من المخزون: الحجوزات النشطة تخصم من الكمية والمحجوز معاً.
+    المنتهية أو المحررة (إذا نجح الدفع بعد انتهاء المدة أو بعد محاولة فاشلة) يعاد حجزها أولاً
+    بشرط توفر الكمية، وإلا لا يخصم شيء من الطلب ويُعلّم للمراجعة بدلاً من البيع بما ليس في المخزون.
+    """
+    from apps.orders.models import Order
+
+    reservations = _lock(StockReservation.objects.filter(
+        order_id__in=order_ids, status__in=['active', 'expired', 'released']
+    ))
+    stale_orders = set(
+        reservations.exclude(status='active').values_list('order_id', flat=True).distinct()
+    )
+    short_orders = [
+        order_id for order_id in sorted(stale_orders)
+        if not _rereserve(reservations.filter(order_id=order_id).exclude(status='active'))
+    ]
+    if short_orders:
+        Order.objects.filter(pk__in=short_orders).update(
+            requires_review=True,
+            review_reason=_('الكمية غير متوفرة عند التأكيد بعد انتهاء الحجز'),
+            updated_at=timezone.now(),
+        )
+
+    reservations = reservations.filter(status='active').exclude(order_id__in=short_orders)
+    rows = list(_reservation_rows(reservations))
+    if not rows:
+        return 0
+    committed = reservations.update(status='committed')
+    for model, (quantity, reserved) in _group_by_target(rows).items():
+        adjust_stock(
+            model,
+            quantity={pk: -delta for pk, delta in quantity.items()},
+            reserved={pk: -delta for pk, delta in reserved.items()},
+        )
+    return committed
+
+
+def commit_order(order):
+    """خصم كميات الطلب المؤكد من المخزون"""
+    return commit_orders([order.pk])
+
+
+def release_order(order):
+    """تحرير حجوزات الطلب عند فشل الدفع"""
+    return release_reservations(order.stock_reservations.all())
+
+
+@transaction.atomic
+def restock_orders(order_ids):
+    """
+    إعادة كميات الطلبات الملغاة: تحرير الحجوزات النشطة وإرجاع الكميات المخصومة.
+    الطلبات السابقة لنظام الحجز تعاد كمياتها من عناصر الطلب.
+    """
+    from apps.orders.models import OrderItem
+
+    reservations = _lock(StockReservation.objects.filter(order_id__in=order_ids))
+    reserved_orders = set(reservations.values_list('order_id', flat=True).distinct())
+
+    committed = reservations.filter(status='committed')
+    rows = list(_reservation_rows(committed))
+    committed.update(status='released')
+    release_reservations(reservations)
+
+    legacy_orders = set(order_ids) - reserved_orders
+    if legacy_orders:
+        items = OrderItem.objects.filter(order_id__in=legacy_orders, product__track_quantity=True).values(
+            'product_id', 'variant_id'
+        ).annotate(total=Sum('quantity')).values_list('product_id', 'variant_id', 'total').order_by()
+        rows += [(product_id, variant_id, 'committed', total) for product_id, variant_id, total in items]
+
+    for model, (quantities, reserved) in _group_by_target(rows).items():
+        adjust_stock(model, quantity=quantities)
+
+
+def restock_order(order):
+    """إعادة كميات الطلب الملغي إلى المخزون"""
+    return restock_orders([order.pk])
+
+
+def release_expired_reservations(batch_size=1000):
+    """تحرير الحجوزات المنتهية على دفعات، مع تخطي الصفوف المقفلة من عمليات أخرى"""
+    released = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                StockReservation.objects.filter(status='active', expires_at__lte=timezone.now())
+                .select_for_update(skip_locked=True)
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return released
+            released += release_reservations(StockReservation.objects.filter(pk__in=ids), status='expired')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.products.models import Category
+
+
+class Command(BaseCommand):
+    """إعادة بناء مسارات شجرة الفئات من علاقة الأب"""
+    help = 'إعادة حساب المسار والعمق لجميع الفئات'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        categories = {category.pk: category for category in Category.objects.only('pk', 'parent_id', 'path', 'depth')}
+        children = {}
+        for category in categories.values():
+            children.setdefault(category.parent_id, []).append(category)
+
+        changed = []
+        stack = [(category, '') for category in children.get(None, [])]
+        while stack:
+            category, parent_path = stack.pop()
+            path = parent_path + Category.make_path_step(category.pk)
+            depth = path.count('/') - 1
+            if category.path != path or category.depth != depth:
+                category.path = path
+                category.depth = depth
+                changed.append(category)
+            stack.extend((child, path) for child in children.get(category.pk, []))
+
+        with transaction.atomic():
+            Category.objects.bulk_update(changed, ['path', 'depth'], batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'تم تحديث مسارات {len(changed)} فئة'))
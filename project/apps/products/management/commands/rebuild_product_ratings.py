@@ -0,0 +1,55 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from apps.products.models import Product, ProductReview
+
+
+class Command(BaseCommand):
+    """إعادة بناء القيم المجمعة لتقييمات المنتجات من الصفر لإصلاح أي انحراف"""
+    help = 'إعادة حساب مجموع وعدد ومتوسط وتوزيع التقييمات الموافق عليها لكل منتج'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        histograms = defaultdict(dict)
+        rows = (
+            ProductReview.objects.filter(is_approved=True)
+            .values('product_id', 'rating')
+            .annotate(total=Count('id'))
+            .order_by()
+        )
+        for row in rows:
+            histograms[row['product_id']][row['rating']] = row['total']
+
+        fields = ['rating_sum', 'rating_count', 'rating_average'] + [
+            f'rating_{rating}_count' for rating in range(1, 6)
+        ]
+
+        updated = 0
+        with transaction.atomic():
+            batch = []
+            for product in Product.objects.only('pk').iterator(chunk_size=batch_size):
+                histogram = histograms.get(product.pk, {})
+                product.rating_count = sum(histogram.values())
+                product.rating_sum = sum(rating * total for rating, total in histogram.items())
+                product.rating_average = (
+                    product.rating_sum / product.rating_count if product.rating_count else None
+                )
+                for rating in range(1, 6):
+                    setattr(product, f'rating_{rating}_count', histogram.get(rating, 0))
+                batch.append(product)
+
+                if len(batch) >= batch_size:
+                    Product.objects.bulk_update(batch, fields)
+                    updated += len(batch)
+                    batch = []
+
+            if batch:
+                Product.objects.bulk_update(batch, fields)
+                updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'تمت إعادة بناء تقييمات {updated} منتج'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from apps.products.search import ensure_search_indexes, get_search_backend
+
+
+class Command(BaseCommand):
+    """إعادة بناء فهرس البحث لجميع المنتجات"""
+    help = 'إعادة بناء فهرس البحث عن المنتجات باستخدام المحرك المحدد في الإعدادات'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        ensure_search_indexes()
+        backend = get_search_backend()
+        count = backend.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'تمت فهرسة {count} منتج باستخدام {backend.__class__.__name__}'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from apps.products.suggest import ensure_trigram_indexes, get_suggest_index
+
+
+class Command(BaseCommand):
+    """إعادة بناء فهرس الإكمال التلقائي"""
+    help = 'إعادة بناء فهرس البادئات للمنتجات والعلامات التجارية والفئات والوسوم'
+
+    def handle(self, *args, **options):
+        ensure_trigram_indexes()
+        index = get_suggest_index()
+        count = index.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'تمت فهرسة {count} عنصر باستخدام {index.__class__.__name__}'
+        ))
@@ -1,22 +1,79 @@
 
-from django.db import models
+from collections import defaultdict
+
+from django.db import models, transaction
+from django.core.exceptions import ValidationError
+from django.db.models import Case, Count, F, FloatField, Max, OuterRef, Prefetch, Q, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce, Concat, Length, Substr
+from django.db.models.lookups import GreaterThan
 from django.utils.translation import gettext_lazy as _
 from django.urls import reverse
 from ckeditor.fields import RichTextField
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
+
+
+class CategoryQuerySet(models.QuerySet):
+    """استعلامات الفئات"""
+
+    def with_product_counts(self):
+        """إضافة عدد المنتجات المنشورة في كل فئة ضمن نفس الاستعلام"""
+        published = Product.objects.filter(
+            category=OuterRef('pk'), status='published'
+        ).order_by().values('category')
+
+        return self.annotate(
+            product_count=Coalesce(
+                Subquery(published.annotate(total=Count('pk')).values('total')), 0
+            )
+        )
+
+    def build_tree(self):
+        """
+        بناء شجرة الفئات من استعلام واحد، كل عقدة تحمل قائمة أبنائها في tree_children
+        وتعاد العقد الجذرية ضمن المجموعة
+        """
+        nodes = list(self.order_by('path'))
+        by_id = {node.pk: node for node in nodes}
+        roots = []
+
+        for node in nodes:
+            node.tree_children = []
+        for node in nodes:
+            parent = by_id.get(node.parent_id)
+            if parent is not None:
+                parent.tree_children.append(node)
+            else:
+                roots.append(node)
+
+        return roots
 
 
 class Category(models.Model):
-    """نموذج الفئات"""
+    """
+    نموذج الفئات
+
+    يحتفظ كل صنف بمساره الكامل من الجذر (path) وعمقه (depth)، بحيث تُجلب
+    الفئات الفرعية أو الآباء أو الشجرة كاملة باستعلام واحد
+    """
+    PATH_STEP_WIDTH = 10
+    PATH_MAX_LENGTH = 255
+    # كل مستوى يشغل PATH_STEP_WIDTH رقماً وفاصلاً من طول المسار
+    MAX_DEPTH = PATH_MAX_LENGTH // (PATH_STEP_WIDTH + 1)
+
     name = models.CharField(_('اسم الفئة'), max_length=100)
     slug = models.SlugField(_('الرابط'), unique=True)
     description = models.TextField(_('الوصف'), blank=True)
     image = models.ImageField(_('صورة الفئة'), upload_to='categories/', blank=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    path = models.CharField(_('المسار'), max_length=PATH_MAX_LENGTH, editable=False, default='')
+    depth = models.PositiveIntegerField(_('العمق'), editable=False, default=0)
     is_active = models.BooleanField(_('نشط'), default=True)
     created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
     updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
 
+    objects = CategoryQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('فئة')
         verbose_name_plural = _('الفئات')
@@ -25,6 +82,7 @@ class Category(models.Model):
             models.Index(fields=['slug']),
             models.Index(fields=['parent']),
             models.Index(fields=['is_active']),
+            models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
         ]
 
     def __str__(self):
@@ -33,6 +91,92 @@ class Category(models.Model):
     def get_absolute_url(self):
         return reverse('products:category_detail', kwargs={'slug': self.slug})
 
+    @classmethod
+    def make_path_step(cls, pk):
+        """جزء المسار الخاص بفئة واحدة"""
+        return f'{pk:0{cls.PATH_STEP_WIDTH}d}/'
+
+    def get_path_ids(self):
+        """معرفات الفئات على المسار من الجذر حتى هذه الفئة"""
+        return [int(step) for step in self.path.split('/') if step]
+
+    def is_own_descendant(self, category):
+        """التحقق مما إذا كانت الفئة المعطاة هي هذه الفئة أو إحدى فئاتها الفرعية"""
+        return category.pk == self.pk or self.make_path_step(self.pk) in category.path
+
+    def clean(self):
+        if self.pk and self.parent_id and self.is_own_descendant(self.parent):
+            raise ValidationError({'parent': _('لا يمكن نقل الفئة إلى إحدى فئاتها الفرعية')})
+        if self.parent_id and self.parent.depth + 1 >= self.MAX_DEPTH:
+            raise ValidationError({'parent': self.depth_error()})
+
+    @classmethod
+    def depth_error(cls):
+        return _('لا يمكن أن يتجاوز عمق شجرة الفئات %(depth)d مستوى') % {'depth': cls.MAX_DEPTH}
+
+    def save(self, *args, **kwargs):
+        step = self.PATH_STEP_WIDTH + 1
+
+        with transaction.atomic():
+            # مسار الأب يقرأ من قاعدة البيانات ويقفل صفه، فلا يُبنى المسار من نسخة قديمة في الذاكرة
+            parent_path = ''
+            if self.parent_id:
+                parent_path = Category.objects.select_for_update().values_list('path', flat=True).get(
+                    pk=self.parent_id
+                )
+                if len(parent_path) + step > self.PATH_MAX_LENGTH:
+                    raise ValidationError({'parent': self.depth_error()})
+
+            if self.pk is None:
+                super().save(*args, **kwargs)
+                self.path = parent_path + self.make_path_step(self.pk)
+                self.depth = len(self.get_path_ids()) - 1
+                Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+                return
+
+            if self.make_path_step(self.pk) in parent_path:
+                raise ValidationError({'parent': _('لا يمكن نقل الفئة إلى إحدى فئاتها الفرعية')})
+
+            old_path, depth = Category.objects.select_for_update().values_list('path', 'depth').get(pk=self.pk)
+            new_path = parent_path + self.make_path_step(self.pk)
+
+            # أعمق فئة فرعية يجب أن يتسع مسارها الجديد في الحقل
+            if old_path and old_path != new_path:
+                deepest = Category.objects.filter(path__startswith=old_path).aggregate(
+                    length=Max(Length('path'))
+                )['length'] or len(old_path)
+                if deepest - len(old_path) + len(new_path) > self.PATH_MAX_LENGTH:
+                    raise ValidationError({'parent': self.depth_error()})
+
+            self.path = new_path
+            self.depth = len(self.get_path_ids()) - 1
+            super().save(*args, **kwargs)
+
+            # نقل الفئة: تحديث مسارات جميع الفئات الفرعية بعبارة واحدة
+            if old_path and old_path != new_path:
+                Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (self.depth - depth),
+                )
+
+    def get_ancestors(self, include_self=False):
+        """الفئات الأب من الجذر حتى هذه الفئة"""
+        ids = self.get_path_ids()
+        if not include_self:
+            ids = ids[:-1]
+        return Category.objects.filter(pk__in=ids).order_by('depth')
+
+    def get_descendants(self, include_self=False):
+        """جميع الفئات الفرعية على أي عمق"""
+        queryset = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            queryset = queryset.exclude(pk=self.pk)
+        return queryset
+
+    def get_breadcrumbs(self):
+        """مسار التنقل من الجذر حتى هذه الفئة"""
+        return list(self.get_ancestors(include_self=True))
+
 
 class Tag(models.Model):
     """نموذج الوسوم"""
@@ -66,6 +210,68 @@ class Brand(models.Model):
         return self.name
 
 
+# المنتج متوفر إذا لم تتبع كميته أو زادت كميته عن المحجوز منها
+IN_STOCK = Q(track_quantity=False) | Q(quantity__gt=F('reserved_quantity'))
+
+
+class ProductQuerySet(models.QuerySet):
+    """استعلامات المنتجات المشتركة"""
+
+    def published(self):
+        """المنتجات المنشورة فقط"""
+        return self.filter(status='published')
+
+    def in_stock(self):
+        """المنتجات المتاحة للبيع"""
+        return self.filter(IN_STOCK)
+
+    def for_listing(self):
+        """
+        تجهيز الاستعلام لعرض قوائم المنتجات بعدد ثابت من الاستعلامات:
+        جلب الفئة والعلامة التجارية بنفس الاستعلام وجلب الصورة الرئيسية فقط مسبقاً
+        (الجلب المقسم يحدد صورة واحدة لكل منتج بدالة نافذة)،
+        أما التقييمات فمخزنة مجمعة على المنتج نفسه
+        """
+        return self.select_related('category', 'brand').prefetch_related(
+            Prefetch(
+                'images',
+                queryset=ProductImage.objects.order_by('-is_featured', 'sort_order', 'id')[:1],
+                to_attr='listing_images',
+            )
+        )
+
+    def apply_rating_deltas(self, deltas):
+        """
+        تحديث القيم المجمعة للتقييمات تدريجياً
+
+        deltas: قاموس {معرف المنتج: {التقييم: التغير في العدد}}
+        """
+        for product_id, stars in deltas.items():
+            stars = {rating: change for rating, change in stars.items() if change}
+            if not stars:
+                continue
+
+            sum_change = sum(rating * change for rating, change in stars.items())
+            count_change = sum(stars.values())
+            new_sum = F('rating_sum') + sum_change
+            new_count = F('rating_count') + count_change
+
+            fields = {
+                'rating_sum': new_sum,
+                'rating_count': new_count,
+                'rating_average': Case(
+                    When(GreaterThan(new_count, 0), then=Cast(new_sum, FloatField()) / new_count),
+                    default=None,
+                    output_field=FloatField(),
+                ),
+            }
+            for rating, change in stars.items():
+                field_name = f'rating_{rating}_count'
+                fields[field_name] = F(field_name) + change
+
+            self.filter(pk=product_id).update(**fields)
+
+
 class Product(models.Model):
     """نموذج المنتجات"""
     STATUS_CHOICES = [
@@ -90,6 +296,8 @@ class Product(models.Model):
     barcode = models.CharField(_('الباركود'), max_length=50, blank=True)
     track_quantity = models.BooleanField(_('تتبع الكمية'), default=True)
     quantity = models.IntegerField(_('الكمية'), default=0)
+    # مجموع الحجوزات النشطة (عداد يحدث مع كل حجز أو تحرير)
+    reserved_quantity = models.IntegerField(_('الكمية المحجوزة'), default=0, editable=False)
 
     # الشحن
     weight = models.DecimalField(_('الوزن'), max_digits=10, decimal_places=2, null=True, blank=True)
@@ -100,6 +308,19 @@ class Product(models.Model):
     brand = models.ForeignKey(Brand, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_('العلامة التجارية'))
     tags = models.ManyToManyField(Tag, blank=True, verbose_name=_('الوسوم'))
 
+    # التقييمات (قيم مجمعة تُحدَّث مع كل تغيير في التقييمات الموافق عليها)
+    rating_sum = models.PositiveIntegerField(_('مجموع التقييمات'), default=0)
+    rating_count = models.PositiveIntegerField(_('عدد التقييمات'), default=0)
+    rating_average = models.FloatField(_('متوسط التقييم'), null=True, blank=True)
+    rating_1_count = models.PositiveIntegerField(_('تقييمات نجمة واحدة'), default=0)
+    rating_2_count = models.PositiveIntegerField(_('تقييمات نجمتين'), default=0)
+    rating_3_count = models.PositiveIntegerField(_('تقييمات ثلاث نجوم'), default=0)
+    rating_4_count = models.PositiveIntegerField(_('تقييمات أربع نجوم'), default=0)
+    rating_5_count = models.PositiveIntegerField(_('تقييمات خمس نجوم'), default=0)
+
+    # البحث (متجه نصي مفهرس يُحدَّث عند الحفظ)
+    search_vector = SearchVectorField(null=True, editable=False)
+
     # SEO
     meta_title = models.CharField(_('عنوان الصفحة'), max_length=200, blank=True)
     meta_description = models.CharField(_('وصف الصفحة'), max_length=300, blank=True)
@@ -112,6 +333,8 @@ class Product(models.Model):
     created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
     updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('منتج')
         verbose_name_plural = _('المنتجات')
@@ -124,6 +347,11 @@ class Product(models.Model):
             models.Index(fields=['created_at']),
             models.Index(fields=['price']),
             models.Index(fields=['sku']),
+            models.Index(fields=['rating_average']),
+            # فهارس الترقيم بالمؤشر على مفاتيح الترتيب مع id لكسر التعادل
+            models.Index(fields=['status', 'created_at', 'id']),
+            models.Index(fields=['status', 'price', 'id']),
+            models.Index(fields=['status', 'name', 'id']),
         ]
 
     def __str__(self):
@@ -132,9 +360,28 @@ class Product(models.Model):
     def get_absolute_url(self):
         return reverse('products:product_detail', kwargs={'slug': self.slug})
 
+    @property
+    def average_rating(self):
+        """متوسط التقييمات الموافق عليها"""
+        return self.rating_average
+
+    @property
+    def reviews_count(self):
+        """عدد التقييمات الموافق عليها"""
+        return self.rating_count
+
+    def get_rating_distribution(self):
+        """توزيع التقييمات حسب عدد النجوم"""
+        return {rating: getattr(self, f'rating_{rating}_count') for rating in range(1, 6)}
+
+    @property
+    def available_quantity(self):
+        """الكمية المتاحة للبيع بعد خصم الحجوزات النشطة"""
+        return self.quantity - self.reserved_quantity
+
     def is_in_stock(self):
         """التحقق من توفر المنتج في المخزون"""
-        return not self.track_quantity or self.quantity > 0
+        return not self.track_quantity or self.available_quantity > 0
 
     def get_display_price(self):
         """الحصول على سعر العرض"""
@@ -173,6 +420,7 @@ class ProductVariant(models.Model):
     price = models.DecimalField(_('السعر'), max_digits=10, decimal_places=2)
     compare_price = models.DecimalField(_('سعر للمقارنة'), max_digits=10, decimal_places=2, null=True, blank=True)
     quantity = models.IntegerField(_('الكمية'), default=0)
+    reserved_quantity = models.IntegerField(_('الكمية المحجوزة'), default=0, editable=False)
     image = models.ForeignKey(ProductImage, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_('الصورة'))
     is_active = models.BooleanField(_('نشط'), default=True)
 
@@ -183,6 +431,45 @@ class ProductVariant(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.sku}"
 
+    @property
+    def track_quantity(self):
+        """المتغير يتبع إعداد تتبع الكمية للمنتج"""
+        return self.product.track_quantity
+
+    @property
+    def available_quantity(self):
+        """الكمية المتاحة للبيع بعد خصم الحجوزات النشطة"""
+        return self.quantity - self.reserved_quantity
+
+
+class StockReservation(models.Model):
+    """حجز مؤقت لكمية من المنتج أو المتغير لطلب لم يكتمل دفعه"""
+    STATUS_CHOICES = [
+        ('active', _('نشط')),
+        ('committed', _('مخصوم من المخزون')),
+        ('released', _('محرر')),
+        ('expired', _('منتهي')),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations', verbose_name=_('المنتج'))
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, null=True, blank=True, related_name='reservations', verbose_name=_('متغير المنتج'))
+    order = models.ForeignKey('orders.Order', on_delete=models.CASCADE, null=True, blank=True, related_name='stock_reservations', verbose_name=_('الطلب'))
+    quantity = models.PositiveIntegerField(_('الكمية'))
+    status = models.CharField(_('الحالة'), max_length=20, choices=STATUS_CHOICES, default='active')
+    expires_at = models.DateTimeField(_('تاريخ الانتهاء'))
+    created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('حجز مخزون')
+        verbose_name_plural = _('حجوزات المخزون')
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+            models.Index(fields=['order', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} x {self.quantity} ({self.status})"
+
 
 class ProductOption(models.Model):
     """نموذج خيارات المنتج"""
@@ -226,6 +513,36 @@ class ProductVariantOption(models.Model):
         return f"{self.variant.sku} - {self.option_value.value}"
 
 
+class ProductReviewQuerySet(models.QuerySet):
+    """استعلامات تقييمات المنتجات"""
+
+    def set_approved(self, approved):
+        """
+        تغيير حالة الموافقة لمجموعة تقييمات مع تحديث القيم المجمعة للمنتجات،
+        بديلاً عن update() الذي يتجاوز الإشارات
+        """
+        with transaction.atomic():
+            changing = list(
+                self.filter(is_approved=not approved)
+                .select_for_update()
+                .values_list('pk', 'product_id', 'rating')
+            )
+            if not changing:
+                return 0
+
+            count = ProductReview.objects.filter(
+                pk__in=[pk for pk, _product_id, _rating in changing]
+            ).update(is_approved=approved)
+
+            sign = 1 if approved else -1
+            deltas = defaultdict(lambda: defaultdict(int))
+            for _pk, product_id, rating in changing:
+                deltas[product_id][rating] += sign
+            Product.objects.apply_rating_deltas(deltas)
+
+        return count
+
+
 class ProductReview(models.Model):
     """نموذج تقييمات المنتجات"""
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews', verbose_name=_('المنتج'))
@@ -241,6 +558,8 @@ class ProductReview(models.Model):
     created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
     updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
 
+    objects = ProductReviewQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('تقييم المنتج')
         verbose_name_plural = _('تقييمات المنتجات')
@@ -249,6 +568,22 @@ class ProductReview(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.user.username} - {self.rating}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_rating_state()
+        return instance
+
+    def get_rating_state(self):
+        """أثر التقييم على القيم المجمعة للمنتج: (المنتج، التقييم) أو None إذا لم يكن موافقاً عليه"""
+        if self.is_approved:
+            return self.product_id, self.rating
+        return None
+
+    def remember_rating_state(self):
+        """حفظ أثر التقييم كما هو مخزن في قاعدة البيانات"""
+        self._stored_rating_state = self.get_rating_state()
+
 
 class ProductReviewImage(models.Model):
     """نموذج صور تقييمات المنتجات"""
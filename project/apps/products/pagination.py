@@ -0,0 +1,176 @@
+"""
+ترقيم الصفحات بالمؤشر (Keyset) مع عدد تقديري اختياري
+
+الترقيم بالمؤشر يستبدل OFFSET المتزايد بشرط على مفتاح الترتيب
+(مثل created_at < x أو created_at = x و id < y)، فتبقى تكلفة الصفحات العميقة ثابتة
+ولا يلزم COUNT(*) على النتائج المصفاة.
+"""
+import base64
+import binascii
+import json
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimate_count(queryset):
+    """عدد تقديري من خطة التنفيذ في PostgreSQL، وعدد دقيق لغيرها من قواعد البيانات"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """مرقم صفحات Django يستخدم العدد التقديري بدلاً من COUNT(*)"""
+
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    ترقيم بالصفحات افتراضياً، وبالمؤشر عند وجود المعامل ?cursor= (فارغاً للصفحة الأولى).
+    المؤشر مبهم: JSON مرمز بـ base64 يحوي قيمة مفتاح الترتيب ومعرف آخر عنصر.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering_query_param = 'ordering'
+
+    # النتائج المرتبة بتعبير لا يصلح مفتاحاً للمؤشر (مثل صلة البحث) ترقم بالصفحات دائماً
+    cursor_enabled = True
+
+    # الترتيبات المسموحة للمؤشر، ويضاف id دائماً لكسر التعادل
+    keyset_orderings = ('-created_at', 'created_at', 'price', '-price', 'name', '-name')
+    default_ordering = '-created_at'
+
+    invalid_cursor_message = _('مؤشر غير صالح')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.use_cursor = self.cursor_enabled and self.cursor_query_param in request.query_params
+        self.estimate = request.query_params.get(self.count_query_param) == 'estimate'
+
+        if not self.use_cursor:
+            self.django_paginator_class = EstimatedCountPaginator if self.estimate else Paginator
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_by_cursor(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+
+        payload = {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+        if self.estimate:
+            payload['count'] = self.estimated_count
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['required'] = ['results']
+        return response_schema
+
+    # --- وضع المؤشر ---
+
+    def get_keyset_ordering(self, request, view):
+        """الترتيب المطلوب إذا كان من الترتيبات المسموحة، وإلا الترتيب الافتراضي"""
+        requested = request.query_params.get(self.ordering_query_param, '').split(',')[0].strip()
+        if requested in self.keyset_orderings:
+            return requested
+        default = getattr(view, 'ordering', None)
+        if isinstance(default, (list, tuple)):
+            default = default[0] if default else None
+        return default if default in self.keyset_orderings else self.default_ordering
+
+    def encode_cursor(self, values):
+        """ترميز مؤشر مبهم"""
+        raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """فك ترميز المؤشر"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(raw)
+            return values['o'], values['v'], int(values['id']), bool(values.get('p'))
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_by_cursor(self, queryset, request, view):
+        """جلب صفحة بعد (أو قبل) آخر عنصر في الصفحة السابقة"""
+        ordering = self.get_keyset_ordering(request, view)
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+        page_size = self.get_page_size(request)
+
+        # العدد التقديري لكامل النتائج قبل تطبيق شرط المؤشر
+        self.estimated_count = estimate_count(queryset) if self.estimate else None
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        previous = False
+        if cursor:
+            cursor_ordering, value, pk, previous = self.decode_cursor(cursor)
+            if cursor_ordering != ordering:
+                raise NotFound(self.invalid_cursor_message)
+            value = queryset.model._meta.get_field(field).to_python(value)
+            # الصفحة السابقة تُجلب بالترتيب المعكوس ثم تعكس النتيجة
+            after = descending == previous
+            lookup = 'gt' if after else 'lt'
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'pk__{lookup}': pk})
+            )
+
+        reverse = descending != previous
+        order_by = [f'-{field}', '-pk'] if reverse else [field, 'pk']
+        rows = list(queryset.order_by(*order_by)[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if previous:
+            rows.reverse()
+
+        self.ordering = ordering
+        self.field = field
+        self.first = rows[0] if rows else None
+        self.last = rows[-1] if rows else None
+        self.has_next = has_more if not previous else bool(cursor)
+        self.has_previous = bool(cursor) if not previous else has_more
+        return rows
+
+    def _cursor_for(self, obj, previous):
+        values = {'o': self.ordering, 'v': getattr(obj, self.field), 'id': obj.pk}
+        if previous:
+            values['p'] = 1
+        return self.encode_cursor(values)
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super().get_next_link()
+        if not self.has_next or self.last is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, self._cursor_for(self.last, False))
+
+    def get_previous_link(self):
+        if not self.use_cursor:
+            return super().get_previous_link()
+        if not self.has_previous or self.first is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, self._cursor_for(self.first, True))
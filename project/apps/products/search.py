@@ -0,0 +1,197 @@
+"""
+محركات البحث عن المنتجات
+
+جميع المحركات تتبع نفس الواجهة: search() تعيد QuerySet مرتباً حسب الصلة
+يمكن تطبيق ProductFilter عليه، و update() تحدث فهرس المنتجات المعطاة.
+"""
+from functools import lru_cache
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection, connections
+from django.db.models import Case, Exists, F, Func, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+
+from .models import Product, Tag
+
+
+POSTGRES_BACKEND = 'apps.products.search.PostgresSearchBackend'
+SIMPLE_BACKEND = 'apps.products.search.SimpleSearchBackend'
+
+
+class BaseSearchBackend:
+    """الواجهة المشتركة لمحركات البحث"""
+
+    def search(self, queryset, query):
+        """تصفية وترتيب المنتجات حسب كلمة البحث"""
+        raise NotImplementedError
+
+    def update(self, product_ids):
+        """تحديث فهرس البحث للمنتجات المعطاة (قائمة معرفات أو QuerySet)"""
+
+    def rebuild(self, batch_size=1000):
+        """إعادة بناء فهرس البحث لجميع المنتجات على دفعات"""
+        ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(ids), batch_size):
+            self.update(ids[start:start + batch_size])
+        return len(ids)
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """
+    بحث نصي بسيط لقواعد البيانات التي لا تدعم البحث الكامل (مثل SQLite في التطوير)،
+    يستخدم EXISTS للوسوم بدلاً من الربط و distinct()
+    """
+
+    def search(self, queryset, query):
+        tags = Tag.objects.filter(product=OuterRef('pk'), name__icontains=query)
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(short_description__icontains=query) |
+            Q(description__icontains=query) |
+            Exists(tags)
+        )
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    بحث كامل عبر عمود tsvector مفهرس بـ GIN، بأوزان:
+    الاسم > الوصف المختصر > الوسوم > الوصف
+    """
+
+    def __init__(self):
+        self.config = settings.PRODUCT_SEARCH_CONFIG
+
+    def get_vector(self):
+        """تعبير بناء متجه البحث لكل منتج"""
+        tags = Tag.objects.filter(product=OuterRef('pk')).order_by().values('product').annotate(
+            names=StringAgg('name', ' ')
+        ).values('names')
+        # إزالة وسوم HTML من الوصف المنسق قبل الفهرسة
+        description = Func(
+            F('description'), Value('<[^>]*>'), Value(' '), Value('g'),
+            function='regexp_replace',
+        )
+
+        return (
+            SearchVector('name', weight='A', config=self.config) +
+            SearchVector('short_description', weight='B', config=self.config) +
+            SearchVector(Coalesce(Subquery(tags), Value('')), weight='C', config=self.config) +
+            SearchVector(description, weight='D', config=self.config)
+        )
+
+    def search(self, queryset, query):
+        search_query = SearchQuery(query, config=self.config, search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-search_rank', '-created_at')
+
+    def update(self, product_ids):
+        Product.objects.filter(pk__in=product_ids).update(search_vector=self.get_vector())
+
+
+class ElasticsearchSearchBackend(BaseSearchBackend):
+    """
+    محرك اختياري يعتمد على Elasticsearch، يعيد المعرفات حسب الصلة
+    ثم يطبقها على QuerySet قاعدة البيانات ليبقى ProductFilter قابلاً للتطبيق
+    """
+    max_results = 1000
+
+    def __init__(self):
+        from elasticsearch import Elasticsearch
+
+        self.client = Elasticsearch([{'host': settings.ELASTICSEARCH_HOST, 'port': settings.ELASTICSEARCH_PORT}])
+        self.index = f'{settings.ELASTICSEARCH_INDEX}_products'
+
+    def ensure_index(self):
+        """إنشاء الفهرس بمحلل اللغة العربية إذا لم يكن موجوداً"""
+        if self.client.indices.exists(index=self.index):
+            return
+        text = {'type': 'text', 'analyzer': 'arabic'}
+        self.client.indices.create(index=self.index, body={
+            'mappings': {
+                'properties': {
+                    'name': text,
+                    'short_description': text,
+                    'tags': text,
+                    'description': text,
+                }
+            }
+        })
+
+    def search(self, queryset, query):
+        result = self.client.search(index=self.index, body={
+            'query': {
+                'multi_match': {
+                    'query': query,
+                    'fields': ['name^4', 'short_description^3', 'tags^2', 'description'],
+                }
+            },
+            'size': self.max_results,
+            '_source': False,
+        })
+        ids = [int(hit['_id']) for hit in result['hits']['hits']]
+        if not ids:
+            return queryset.none()
+
+        rank = Case(
+            *[When(pk=pk, then=Value(len(ids) - position)) for position, pk in enumerate(ids)],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        return queryset.filter(pk__in=ids).annotate(search_rank=rank).order_by('-search_rank')
+
+    def update(self, product_ids):
+        from elasticsearch import helpers
+
+        self.ensure_index()
+        product_ids = list(product_ids)
+        actions = []
+        found = set()
+        for product in Product.objects.filter(pk__in=product_ids).prefetch_related('tags'):
+            found.add(product.pk)
+            if product.status != 'published':
+                actions.append({'_op_type': 'delete', '_index': self.index, '_id': product.pk})
+                continue
+            actions.append({
+                '_index': self.index,
+                '_id': product.pk,
+                '_source': {
+                    'name': product.name,
+                    'short_description': product.short_description,
+                    'tags': ' '.join(tag.name for tag in product.tags.all()),
+                    'description': product.description,
+                },
+            })
+        actions.extend(
+            {'_op_type': 'delete', '_index': self.index, '_id': pk}
+            for pk in product_ids if pk not in found
+        )
+        helpers.bulk(self.client, actions, raise_on_error=False)
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path):
+    return import_string(path)()
+
+
+def get_search_backend():
+    """الحصول على محرك البحث المحدد في الإعدادات أو المناسب لقاعدة البيانات"""
+    path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', '')
+    if not path:
+        path = POSTGRES_BACKEND if connection.vendor == 'postgresql' else SIMPLE_BACKEND
+    return _load_backend(path)
+
+
+def ensure_search_indexes(using='default'):
+    """إنشاء فهرس GIN لمتجه البحث في PostgreSQL (غير مدعوم في Meta.indexes مع SQLite)"""
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+    table = Product._meta.db_table
+    with db.cursor() as cursor:
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {table}_search_vector_gin '
+            f'ON {table} USING gin (search_vector)'
+        )
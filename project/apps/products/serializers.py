@@ -1,4 +1,5 @@
 
+from django.db import models
 from rest_framework import serializers
 from .models import (
     Category, Tag, Brand, Product, ProductImage, 
@@ -8,7 +9,12 @@ from .models import (
 
 
 class CategorySerializer(serializers.ModelSerializer):
-    """مسلسل بيانات الفئات"""
+    """
+    مسلسل بيانات الفئات
+
+    تُجلب الشجرة الفرعية مع عدد المنتجات المنشورة لكل عقدة باستعلام واحد
+    وتُحفظ في سياق المسلسل لتشاركها جميع العقد المتداخلة
+    """
     children = serializers.SerializerMethodField()
     product_count = serializers.SerializerMethodField()
 
@@ -17,14 +23,37 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug', 'description', 'image', 'parent', 'children', 'product_count', 'is_active']
         read_only_fields = ['id']
 
+    def get_tree_nodes(self, obj):
+        """الحصول على عقد الشجرة مفهرسة بالمعرف"""
+        nodes = self.context.get('category_tree_nodes')
+        if nodes is None or obj.pk not in nodes:
+            queryset = Category.objects.filter(is_active=True).with_product_counts().order_by('name')
+            if not isinstance(self.root.instance, (list, models.QuerySet)):
+                queryset = queryset.filter(path__startswith=obj.path)
+            nodes = {node.pk: node for node in queryset}
+
+            children = {}
+            for node in nodes.values():
+                children.setdefault(node.parent_id, []).append(node)
+            for node in nodes.values():
+                node.tree_children = children.get(node.pk, [])
+
+            self.context['category_tree_nodes'] = nodes
+        return nodes
+
     def get_children(self, obj):
         """الحصول على الفئات الفرعية"""
-        children = obj.children.filter(is_active=True)
-        return CategorySerializer(children, many=True).data
+        node = self.get_tree_nodes(obj).get(obj.pk)
+        children = node.tree_children if node is not None else []
+        return CategorySerializer(children, many=True, context=self.context).data
 
     def get_product_count(self, obj):
         """الحصول على عدد المنتجات في الفئة"""
-        return Product.objects.filter(category=obj, status='published').count()
+        product_count = getattr(obj, 'product_count', None)
+        if product_count is None:
+            node = self.get_tree_nodes(obj).get(obj.pk)
+            product_count = node.product_count if node is not None else 0
+        return product_count
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -106,7 +135,7 @@ class ProductVariantOptionSerializer(serializers.ModelSerializer):
 
 class ProductVariantSerializer(serializers.ModelSerializer):
     """مسلسل بيانات متغيرات المنتج"""
-    options = ProductVariantOptionSerializer(source='variantoption_set', many=True, read_only=True)
+    options = ProductVariantOptionSerializer(source='productvariantoption_set', many=True, read_only=True)
     image_url = serializers.SerializerMethodField()
     discount_percentage = serializers.SerializerMethodField()
 
@@ -162,13 +191,18 @@ class ProductReviewSerializer(serializers.ModelSerializer):
 
 
 class ProductListSerializer(serializers.ModelSerializer):
-    """مسلسل بيانات قائمة المنتجات"""
-    category_name = serializers.SerializerMethodField()
+    """
+    مسلسل بيانات قائمة المنتجات
+
+    يقرأ الصورة المجلوبة مسبقاً من Product.objects.for_listing() عند توفرها،
+    ويعود للاستعلام المباشر فقط عند تمرير منتج غير مجهز
+    """
+    category_name = serializers.CharField(source='category.name', read_only=True)
     brand_name = serializers.SerializerMethodField()
     image_url = serializers.SerializerMethodField()
     discount_percentage = serializers.SerializerMethodField()
-    average_rating = serializers.SerializerMethodField()
-    reviews_count = serializers.SerializerMethodField()
+    average_rating = serializers.FloatField(source='rating_average', read_only=True)
+    reviews_count = serializers.IntegerField(source='rating_count', read_only=True)
 
     class Meta:
         model = Product
@@ -177,39 +211,22 @@ class ProductListSerializer(serializers.ModelSerializer):
                   'featured', 'average_rating', 'reviews_count', 'created_at']
         read_only_fields = ['id']
 
-    def get_category_name(self, obj):
-        """الحصول على اسم الفئة"""
-        return obj.category.name
-
     def get_brand_name(self, obj):
         """الحصول على اسم العلامة التجارية"""
         return obj.brand.name if obj.brand else None
 
     def get_image_url(self, obj):
         """الحصول على رابط الصورة الرئيسية"""
-        featured_image = obj.images.filter(is_featured=True).first()
-        if featured_image:
-            return featured_image.image.url
-        elif obj.images.exists():
-            return obj.images.first().image.url
+        images = getattr(obj, 'listing_images', None)
+        if images is None:
+            images = obj.images.order_by('-is_featured', 'sort_order', 'id')[:1]
+        for image in images:
+            return image.image.url
         return None
 
     def get_discount_percentage(self, obj):
         """الحصول على نسبة الخصم"""
-        if obj.compare_price and obj.compare_price > obj.price:
-            return int((obj.compare_price - obj.price) / obj.compare_price * 100)
-        return None
-
-    def get_average_rating(self, obj):
-        """الحصول على متوسط التقييمات"""
-        reviews = ProductReview.objects.filter(product=obj, is_approved=True)
-        if reviews.exists():
-            return sum(review.rating for review in reviews) / reviews.count()
-        return None
-
-    def get_reviews_count(self, obj):
-        """الحصول على عدد التقييمات"""
-        return ProductReview.objects.filter(product=obj, is_approved=True).count()
+        return obj.get_discount_percentage()
 
 
 class ProductDetailSerializer(serializers.ModelSerializer):
@@ -222,8 +239,9 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     options = ProductOptionSerializer(many=True, read_only=True)
     reviews = ProductReviewSerializer(many=True, read_only=True)
     discount_percentage = serializers.SerializerMethodField()
-    average_rating = serializers.SerializerMethodField()
-    reviews_count = serializers.SerializerMethodField()
+    average_rating = serializers.FloatField(source='rating_average', read_only=True)
+    reviews_count = serializers.IntegerField(source='rating_count', read_only=True)
+    rating_distribution = serializers.DictField(source='get_rating_distribution', read_only=True)
 
     class Meta:
         model = Product
@@ -232,7 +250,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
                   'weight', 'requires_shipping', 'category', 'brand', 'tags', 'images', 
                   'variants', 'options', 'meta_title', 'meta_description', 'status', 
                   'featured', 'discount_percentage', 'average_rating', 'reviews_count', 
-                  'created_at', 'updated_at']
+                  'rating_distribution', 'created_at', 'updated_at']
         read_only_fields = ['id']
 
     def get_discount_percentage(self, obj):
@@ -240,14 +258,3 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         if obj.compare_price and obj.compare_price > obj.price:
             return int((obj.compare_price - obj.price) / obj.compare_price * 100)
         return None
-
-    def get_average_rating(self, obj):
-        """الحصول على متوسط التقييمات"""
-        reviews = ProductReview.objects.filter(product=obj, is_approved=True)
-        if reviews.exists():
-            return sum(review.rating for review in reviews) / reviews.count()
-        return None
-
-    def get_reviews_count(self, obj):
-        """الحصول على عدد التقييمات"""
-        return ProductReview.objects.filter(product=obj, is_approved=True).count()
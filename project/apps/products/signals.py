@@ -0,0 +1,150 @@
+import logging
+from collections import defaultdict
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_migrate, post_save, post_delete
+from django.dispatch import receiver
+from .models import Brand, Category, Product, ProductReview, Tag
+from .facets import invalidate_facets
+from .search import ensure_search_indexes, get_search_backend
+from .suggest import MODEL_KINDS, ensure_trigram_indexes, get_suggest_index
+
+logger = logging.getLogger(__name__)
+
+
+def _rating_deltas(old_state, new_state):
+    """حساب التغير في القيم المجمعة بين حالتين للتقييم"""
+    deltas = defaultdict(lambda: defaultdict(int))
+    if old_state:
+        product_id, rating = old_state
+        deltas[product_id][rating] -= 1
+    if new_state:
+        product_id, rating = new_state
+        deltas[product_id][rating] += 1
+    return deltas
+
+
+@receiver(post_save, sender=ProductReview)
+def update_product_rating_on_save(sender, instance, created, **kwargs):
+    """
+    تحديث القيم المجمعة لتقييمات المنتج عند إنشاء تقييم أو تعديله أو تغيير الموافقة عليه
+    """
+    old_state = None if created else getattr(instance, '_stored_rating_state', None)
+    new_state = instance.get_rating_state()
+
+    if old_state != new_state:
+        Product.objects.apply_rating_deltas(_rating_deltas(old_state, new_state))
+    instance.remember_rating_state()
+
+
+@receiver(post_delete, sender=ProductReview)
+def update_product_rating_on_delete(sender, instance, **kwargs):
+    """
+    خصم التقييم من القيم المجمعة للمنتج عند حذفه
+    """
+    old_state = getattr(instance, '_stored_rating_state', instance.get_rating_state())
+    if old_state:
+        Product.objects.apply_rating_deltas(_rating_deltas(old_state, None))
+
+
+def _update_search_index(product_ids):
+    """تحديث فهرس البحث بعد نجاح المعاملة"""
+    backend = get_search_backend()
+    transaction.on_commit(lambda: backend.update(product_ids))
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_index(sender, instance, **kwargs):
+    """
+    تحديث متجه البحث عند حفظ المنتج
+    """
+    _update_search_index([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def update_search_index_on_tags_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    تحديث متجه البحث عند تغيير وسوم المنتج
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        _update_search_index([instance.pk])
+    elif pk_set:
+        _update_search_index(list(pk_set))
+    else:
+        _update_search_index(list(instance.product_set.values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=Tag)
+def update_search_index_on_tag_rename(sender, instance, created, **kwargs):
+    """
+    تحديث متجه البحث للمنتجات المرتبطة عند تعديل الوسم
+    """
+    if not created:
+        _update_search_index(list(instance.product_set.values_list('pk', flat=True)))
+
+
+@receiver(post_migrate)
+def create_search_indexes(sender, using, **kwargs):
+    """
+    إنشاء فهارس البحث الخاصة بـ PostgreSQL بعد تطبيق الترحيلات
+    """
+    if sender.name == 'apps.products':
+        ensure_search_indexes(using)
+        ensure_trigram_indexes(using)
+
+
+def _update_suggest_index_safely(operation, *args):
+    """
+    تنفيذ تحديث فهرس الإكمال التلقائي دون إفشال الطلب: البيانات محفوظة قبله،
+    وتعطل Redis يسجل فقط ويصلحه rebuild_suggest_index لاحقاً
+    """
+    def run():
+        try:
+            operation(*args)
+        except Exception:
+            logger.exception('تعذر تحديث فهرس الإكمال التلقائي')
+    transaction.on_commit(run)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+def update_suggest_index(sender, instance, **kwargs):
+    """
+    تحديث فهرس الإكمال التلقائي بعد نجاح المعاملة عند حفظ العنصر
+    """
+    _update_suggest_index_safely(get_suggest_index().update, MODEL_KINDS[sender], instance)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Tag)
+def remove_from_suggest_index(sender, instance, **kwargs):
+    """
+    إزالة العنصر المحذوف من فهرس الإكمال التلقائي
+    """
+    _update_suggest_index_safely(get_suggest_index().remove, MODEL_KINDS[sender], instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+def invalidate_product_facets(sender, **kwargs):
+    """
+    إبطال أعداد الفلاتر الوجهية المخزنة بعد تعديل المنتجات أو أسماء الفئات والعلامات والوسوم
+    """
+    transaction.on_commit(invalidate_facets)
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def invalidate_facets_on_tags_change(sender, action, **kwargs):
+    """
+    إبطال أعداد الفلاتر الوجهية عند تغيير وسوم المنتجات
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(invalidate_facets)
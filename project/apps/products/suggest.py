@@ -0,0 +1,312 @@
+"""
+فهرس البادئات للإكمال التلقائي
+
+يخزن كل اسم (منتج، علامة تجارية، فئة، وسم) بعد توحيده كمفتاح مرتب معجمياً
+بالشكل "term\\x00kind:id"، فيصبح البحث بالبادئة مسحاً لمدى متصل:
+ZRANGEBYLEX في Redis أو bisect في الذاكرة، دون أي استعلام لقاعدة البيانات.
+"""
+import json
+import re
+import threading
+from bisect import bisect_left, insort
+from functools import lru_cache
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection, connections
+
+from config.redis import get_redis_connection
+from .models import Brand, Category, Product, Tag
+
+
+SEPARATOR = '\x00'
+# أقصى عدد من الكلمات تُفهرس بداياتها داخل الاسم الواحد
+MAX_WORD_STARTS = 5
+# عدد المرشحين المقروءين لكل نتيجة مطلوبة (لتعويض تكرار العنصر بعدة مفاتيح)
+CANDIDATES_FACTOR = 4
+TRIGRAM_THRESHOLD = 0.3
+
+KIND_ORDER = {'product': 0, 'brand': 1, 'category': 2, 'tag': 3}
+
+ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+ARABIC_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',  # أ إ آ ٱ ← ا
+    'ة': 'ه',  # ة ← ه
+    'ى': 'ي',  # ى ← ي
+    'ؤ': 'و',  # ؤ ← و
+    'ئ': 'ي',  # ئ ← ي
+})
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(text):
+    """توحيد النص للمطابقة: إزالة التشكيل والتطويل وتوحيد أشكال الحروف"""
+    text = ARABIC_DIACRITICS.sub('', text or '').translate(ARABIC_LETTERS).lower()
+    return WHITESPACE.sub(' ', text.replace(SEPARATOR, ' ')).strip()
+
+
+def get_terms(label):
+    """المفاتيح المفهرسة للاسم: الاسم كاملاً وبدايات كلماته التالية"""
+    words = normalize(label).split(' ')
+    return list(dict.fromkeys(
+        ' '.join(words[start:]) for start in range(min(len(words), MAX_WORD_STARTS)) if words[start]
+    ))
+
+
+def get_document(kind, obj):
+    """بيانات العنصر المعروضة في الاقتراحات، أو None إذا لم يكن قابلاً للعرض"""
+    if kind == 'product':
+        if obj.status != 'published':
+            return None
+        score = obj.rating_count
+    elif kind in ('brand', 'category'):
+        if not obj.is_active:
+            return None
+        score = 0
+    else:
+        score = 0
+    return {'type': kind, 'id': obj.pk, 'name': obj.name, 'slug': obj.slug, 'score': score}
+
+
+SOURCES = {
+    'product': lambda: Product.objects.published().only('pk', 'name', 'slug', 'status', 'rating_count'),
+    'brand': lambda: Brand.objects.filter(is_active=True).only('pk', 'name', 'slug', 'is_active'),
+    'category': lambda: Category.objects.filter(is_active=True).only('pk', 'name', 'slug', 'is_active'),
+    'tag': lambda: Tag.objects.only('pk', 'name', 'slug'),
+}
+MODEL_KINDS = {Product: 'product', Brand: 'brand', Category: 'category', Tag: 'tag'}
+
+
+def iter_documents():
+    """جميع العناصر القابلة للاقتراح من قاعدة البيانات"""
+    for kind, source in SOURCES.items():
+        for obj in source().iterator():
+            yield kind, get_document(kind, obj)
+
+
+def rank_documents(documents, limit):
+    """ترتيب النتائج: المنتجات أولاً ثم حسب الشعبية، مع الحفاظ على الترتيب المعجمي"""
+    documents = sorted(documents, key=lambda doc: (KIND_ORDER[doc['type']], -doc['score']))
+    return [
+        {key: doc[key] for key in ('type', 'id', 'name', 'slug')}
+        for doc in documents[:limit]
+    ]
+
+
+def _doc_key(kind, pk):
+    return f'{kind}:{pk}'
+
+
+def _member(term, key):
+    return f'{term}{SEPARATOR}{key}'
+
+
+class InMemorySuggestIndex:
+    """
+    فهرس داخل العملية (قائمة مرتبة + bisect)، يبنى عند أول استخدام.
+    التحديثات التدريجية تصل فقط للعملية التي نفذت الحفظ، لذا يُستخدم Redis في الإنتاج.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._members = []
+        self._documents = {}
+        self._terms = {}
+        self._built = False
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    def rebuild(self):
+        """إعادة بناء الفهرس بالكامل من قاعدة البيانات"""
+        members, documents, terms = [], {}, {}
+        for kind, document in iter_documents():
+            key = _doc_key(kind, document['id'])
+            documents[key] = document
+            terms[key] = get_terms(document['name'])
+            members.extend(_member(term, key) for term in terms[key])
+        members.sort()
+        with self._lock:
+            self._members, self._documents, self._terms = members, documents, terms
+            self._built = True
+        return len(documents)
+
+    def update(self, kind, obj):
+        """إضافة العنصر أو تحديثه، أو إزالته إذا لم يعد قابلاً للعرض"""
+        with self._lock:
+            if not self._built:
+                return
+            key = _doc_key(kind, obj.pk)
+            self._discard(key)
+            document = get_document(kind, obj)
+            if document is None:
+                return
+            self._documents[key] = document
+            self._terms[key] = get_terms(document['name'])
+            for term in self._terms[key]:
+                insort(self._members, _member(term, key))
+
+    def remove(self, kind, pk):
+        """إزالة العنصر من الفهرس"""
+        with self._lock:
+            if self._built:
+                self._discard(_doc_key(kind, pk))
+
+    def _discard(self, key):
+        for term in self._terms.pop(key, ()):
+            member = _member(term, key)
+            position = bisect_left(self._members, member)
+            if position < len(self._members) and self._members[position] == member:
+                del self._members[position]
+        self._documents.pop(key, None)
+
+    def search(self, prefix, limit):
+        """العناصر التي يبدأ أحد مفاتيحها بالبادئة"""
+        self._ensure_built()
+        keys = []
+        with self._lock:
+            position = bisect_left(self._members, prefix)
+            while position < len(self._members) and len(keys) < limit * CANDIDATES_FACTOR:
+                member = self._members[position]
+                if not member.startswith(prefix):
+                    break
+                keys.append(member.rsplit(SEPARATOR, 1)[1])
+                position += 1
+            documents = [self._documents[key] for key in dict.fromkeys(keys)]
+        return rank_documents(documents, limit)
+
+
+class RedisSuggestIndex:
+    """
+    فهرس مشترك في Redis: مجموعة مرتبة بنقاط متساوية يُمسح مداها بـ ZRANGEBYLEX،
+    و Hash يحوي بيانات العناصر ومفاتيحها لإزالتها عند التحديث
+    """
+    members_key = 'products:suggest:members'
+    documents_key = 'products:suggest:documents'
+
+    def __init__(self):
+        self.redis = get_redis_connection()
+
+    def rebuild(self, batch_size=1000):
+        """بناء الفهرس في مفاتيح مؤقتة ثم استبدالها دفعة واحدة"""
+        members_tmp = f'{self.members_key}:rebuild'
+        documents_tmp = f'{self.documents_key}:rebuild'
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(members_tmp, documents_tmp)
+        count = 0
+        for kind, document in iter_documents():
+            key = _doc_key(kind, document['id'])
+            terms = get_terms(document['name'])
+            pipe.zadd(members_tmp, {_member(term, key): 0 for term in terms})
+            pipe.hset(documents_tmp, key, json.dumps(dict(document, terms=terms)))
+            count += 1
+            if count % batch_size == 0:
+                pipe.execute()
+        pipe.execute()
+
+        pipe = self.redis.pipeline()
+        if count:
+            pipe.rename(members_tmp, self.members_key)
+            pipe.rename(documents_tmp, self.documents_key)
+        else:
+            pipe.delete(self.members_key, self.documents_key)
+        pipe.execute()
+        return count
+
+    def update(self, kind, obj):
+        """إضافة العنصر أو تحديثه، أو إزالته إذا لم يعد قابلاً للعرض"""
+        key = _doc_key(kind, obj.pk)
+        document = get_document(kind, obj)
+        pipe = self.redis.pipeline()
+        self._discard(pipe, key)
+        if document is not None:
+            terms = get_terms(document['name'])
+            pipe.zadd(self.members_key, {_member(term, key): 0 for term in terms})
+            pipe.hset(self.documents_key, key, json.dumps(dict(document, terms=terms)))
+        pipe.execute()
+
+    def remove(self, kind, pk):
+        """إزالة العنصر من الفهرس"""
+        pipe = self.redis.pipeline()
+        self._discard(pipe, _doc_key(kind, pk))
+        pipe.execute()
+
+    def _discard(self, pipe, key):
+        stored = self.redis.hget(self.documents_key, key)
+        if stored:
+            terms = json.loads(stored)['terms']
+            pipe.zrem(self.members_key, *[_member(term, key) for term in terms])
+        pipe.hdel(self.documents_key, key)
+
+    def search(self, prefix, limit):
+        """العناصر التي يبدأ أحد مفاتيحها بالبادئة"""
+        # الحد الأعلى بالبايتات: 0xff أكبر من أي بايت في ترميز UTF-8
+        start = b'[' + prefix.encode()
+        members = self.redis.zrangebylex(
+            self.members_key, start, start + b'\xff', start=0, num=limit * CANDIDATES_FACTOR
+        )
+        keys = list(dict.fromkeys(member.decode().rsplit(SEPARATOR, 1)[1] for member in members))
+        if not keys:
+            return []
+        documents = [json.loads(raw) for raw in self.redis.hmget(self.documents_key, keys) if raw]
+        return rank_documents(documents, limit)
+
+
+INDEXES = {
+    'memory': InMemorySuggestIndex,
+    'redis': RedisSuggestIndex,
+}
+
+
+@lru_cache(maxsize=None)
+def _load_index(name):
+    return INDEXES[name]()
+
+
+def get_suggest_index():
+    """الحصول على فهرس الإكمال التلقائي المحدد في الإعدادات"""
+    return _load_index(settings.PRODUCT_SUGGEST_INDEX)
+
+
+def fuzzy_suggest(query, limit):
+    """اقتراحات تقريبية بتشابه الثلاثيات عند عدم وجود مطابقة بالبادئة (PostgreSQL فقط)"""
+    if connection.vendor != 'postgresql':
+        return []
+    matches = []
+    for kind, source in SOURCES.items():
+        queryset = source().annotate(similarity=TrigramSimilarity('name', query)).filter(
+            similarity__gte=TRIGRAM_THRESHOLD
+        ).order_by('-similarity')[:limit]
+        matches.extend((obj.similarity, get_document(kind, obj)) for obj in queryset)
+    matches.sort(key=lambda match: -match[0])
+    return [
+        {key: doc[key] for key in ('type', 'id', 'name', 'slug')}
+        for _, doc in matches[:limit]
+    ]
+
+
+def suggest(query, limit=None):
+    """اقتراحات الإكمال التلقائي لنص البحث"""
+    limit = limit or settings.PRODUCT_SUGGEST_LIMIT
+    prefix = normalize(query)
+    if not prefix:
+        return []
+    results = get_suggest_index().search(prefix, limit)
+    if not results:
+        results = fuzzy_suggest(query, limit)
+    return results
+
+
+def ensure_trigram_indexes(using='default'):
+    """تفعيل pg_trgm وإنشاء فهارس GIN للثلاثيات على أعمدة الأسماء في PostgreSQL"""
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+    with db.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for model in MODEL_KINDS:
+            table = model._meta.db_table
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {table}_name_trgm '
+                f'ON {table} USING gin (name gin_trgm_ops)'
+            )
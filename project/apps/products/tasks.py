@@ -0,0 +1,8 @@
+from celery import shared_task
+from .inventory import release_expired_reservations
+
+
+@shared_task
+def release_expired_stock_reservations(batch_size=1000):
+    """تحرير حجوزات المخزون المنتهية"""
+    return release_expired_reservations(batch_size=batch_size)
@@ -13,6 +13,7 @@ router.register(r'reviews', views.ProductReviewViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('search/', views.ProductSearchView.as_view(), name='product_search'),
+    path('suggest/', views.ProductSuggestView.as_view(), name='product_suggest'),
     path('featured/', views.FeaturedProductsView.as_view(), name='featured_products'),
     path('category/<slug:slug>/', views.CategoryProductsView.as_view(), name='category_products'),
     path('brand/<slug:slug>/', views.BrandProductsView.as_view(), name='brand_products'),
@@ -1,15 +1,15 @@
 
 from django.shortcuts import render, get_object_or_404
+from django.core.paginator import Paginator
 from django.db.models import Avg, Count
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.pagination import PageNumberPagination
 from django.views.generic import ListView, DetailView
 from django.utils.translation import gettext_lazy as _
-from django.db.models import Q
 from .models import (
     Category, Tag, Brand, Product, ProductImage, 
     ProductVariant, ProductOption, ProductOptionValue,
@@ -21,18 +21,27 @@ from .serializers import (
     ProductReviewSerializer
 )
 from .filters import ProductFilter
+from .pagination import KeysetPagination
+from .facets import ProductFacets
+from .search import get_search_backend
+from .suggest import suggest
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    """ترقيم الصفحات المخصص"""
+class StandardResultsSetPagination(KeysetPagination):
+    """ترقيم الصفحات المخصص (بالمؤشر عند تمرير ?cursor=)"""
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 100
 
 
+class SearchResultsPagination(StandardResultsSetPagination):
+    """ترقيم نتائج البحث بالصفحات فقط: المؤشر يعيد الترتيب بالحقل فيفقد ترتيب الصلة"""
+    cursor_enabled = False
+
+
 class CategoryViewSet(viewsets.ModelViewSet):
     """عرض مجموعة الفئات"""
-    queryset = Category.objects.filter(is_active=True)
+    queryset = Category.objects.filter(is_active=True).with_product_counts()
     serializer_class = CategorySerializer
     lookup_field = 'slug'
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -40,6 +49,16 @@ class CategoryViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name', 'created_at']
     ordering = ['name']
 
+    @action(detail=True, methods=['get'])
+    def breadcrumbs(self, request, slug=None):
+        """الحصول على مسار التنقل للفئة"""
+        category = self.get_object()
+        data = [
+            {'id': item.id, 'name': item.name, 'slug': item.slug}
+            for item in category.get_breadcrumbs()
+        ]
+        return Response(data)
+
 
 class BrandViewSet(viewsets.ModelViewSet):
     """عرض مجموعة العلامات التجارية"""
@@ -71,7 +90,7 @@ class ProductViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_class = ProductFilter
     search_fields = ['name', 'description', 'short_description']
-    ordering_fields = ['name', 'price', 'created_at']
+    ordering_fields = ['name', 'price', 'created_at', 'rating_average', 'rating_count']
     ordering = ['-created_at']
 
     def get_serializer_class(self):
@@ -82,17 +101,25 @@ class ProductViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """تصفية المنتجات حسب الحالة"""
-        queryset = Product.objects.filter(status='published')
+        queryset = Product.objects.published()
+        if self.action != 'retrieve':
+            queryset = queryset.for_listing()
 
         # تصفية حسب التوفر في المخزون
         in_stock = self.request.query_params.get('in_stock')
         if in_stock == 'true':
-            queryset = queryset.filter(
-                Q(track_quantity=False) | Q(quantity__gt=0)
-            )
+            queryset = queryset.in_stock()
 
         return queryset
 
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """أعداد الفلاتر الوجهية لنتائج التصفية الحالية"""
+        queryset = filters.SearchFilter().filter_queryset(request, Product.objects.published(), self)
+        filterset = ProductFilter(request.query_params, queryset=queryset)
+        scope = f"search:{request.query_params.get('search', '')}"
+        return Response(ProductFacets(filterset, scope=scope).get())
+
     @action(detail=True, methods=['get'])
     def variants(self, request, slug=None):
         """الحصول على متغيرات المنتج"""
@@ -154,18 +181,13 @@ class ProductSearchView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        products = Product.objects.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) | 
-            Q(short_description__icontains=query) |
-            Q(tags__name__icontains=query)
-        ).distinct()
+        products = get_search_backend().search(Product.objects.published(), query).for_listing()
 
         # تطبيق الفلاتر
         products = ProductFilter(request.GET, queryset=products).qs
 
-        # ترقيم الصفحات
-        paginator = StandardResultsSetPagination()
+        # ترقيم الصفحات (مع الحفاظ على ترتيب الصلة)
+        paginator = SearchResultsPagination()
         page = paginator.paginate_queryset(products, request)
 
         if page is not None:
@@ -176,12 +198,29 @@ class ProductSearchView(APIView):
         return Response(serializer.data)
 
 
+class ProductSuggestView(APIView):
+    """عرض الإكمال التلقائي لكلمة البحث من فهرس البادئات دون استعلام قاعدة البيانات"""
+    permission_classes = [AllowAny]
+    authentication_classes = []
+    max_limit = 20
+
+    def get(self, request):
+        """الحصول على اقتراحات المنتجات والعلامات التجارية والفئات والوسوم"""
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 0)), 0), self.max_limit)
+        except ValueError:
+            limit = 0
+
+        return Response({'query': query, 'results': suggest(query, limit or None)})
+
+
 class FeaturedProductsView(APIView):
     """عرض المنتجات المميزة"""
 
     def get(self, request):
         """الحصول على المنتجات المميزة"""
-        products = Product.objects.filter(featured=True, status='published')
+        products = Product.objects.published().filter(featured=True).for_listing()
 
         # تطبيق الفلاتر
         products = ProductFilter(request.GET, queryset=products).qs
@@ -205,14 +244,10 @@ class CategoryProductsView(APIView):
         """الحصول على منتجات الفئة"""
         category = get_object_or_404(Category, slug=slug, is_active=True)
 
-        # الحصول على جميع الفئات الفرعية
-        categories = [category]
-        categories.extend(category.get_descendants())
-
-        products = Product.objects.filter(
-            category__in=categories, 
-            status='published'
-        )
+        # منتجات الفئة وجميع فئاتها الفرعية عبر المسار المخزن
+        products = Product.objects.published().filter(
+            category__path__startswith=category.path
+        ).for_listing()
 
         # تطبيق الفلاتر
         products = ProductFilter(request.GET, queryset=products).qs
@@ -236,10 +271,7 @@ class BrandProductsView(APIView):
         """الحصول على منتجات العلامة التجارية"""
         brand = get_object_or_404(Brand, slug=slug, is_active=True)
 
-        products = Product.objects.filter(
-            brand=brand, 
-            status='published'
-        )
+        products = Product.objects.published().filter(brand=brand).for_listing()
 
         # تطبيق الفلاتر
         products = ProductFilter(request.GET, queryset=products).qs
@@ -263,10 +295,7 @@ class TagProductsView(APIView):
         """الحصول على منتجات الوسم"""
         tag = get_object_or_404(Tag, slug=slug)
 
-        products = Product.objects.filter(
-            tags=tag, 
-            status='published'
-        )
+        products = Product.objects.published().filter(tags=tag).for_listing()
 
         # تطبيق الفلاتر
         products = ProductFilter(request.GET, queryset=products).qs
@@ -293,24 +322,26 @@ class ProductListView(ListView):
 
     def get_queryset(self):
         """تصفية المنتجات"""
-        queryset = Product.objects.filter(status='published')
+        queryset = Product.objects.published().for_listing()
 
-        # تطبيق الفلاتر
-        queryset = ProductFilter(self.request.GET, queryset=queryset).qs
+        # تطبيق الفلاتر (يحفظ للاستخدام في السياق دون إعادة بناء النتائج)
+        self.filterset = ProductFilter(self.request.GET, queryset=queryset)
 
-        return queryset
+        return self.filterset.qs
 
     def get_context_data(self, **kwargs):
         """إضافة بيانات إضافية للسياق"""
         context = super().get_context_data(**kwargs)
 
-        # إضافة الفئات والوسوم والعلامات التجارية للفلاتر
-        context['categories'] = Category.objects.filter(is_active=True)
-        context['tags'] = Tag.objects.all()
-        context['brands'] = Brand.objects.filter(is_active=True)
+        # أعداد الفئات والوسوم والعلامات التجارية وشرائح السعر للنتائج الحالية
+        facets = ProductFacets(self.filterset).get()
+        context['facets'] = facets
+        context['categories'] = facets['categories']
+        context['tags'] = facets['tags']
+        context['brands'] = facets['brands']
 
         # إضافة معلمات التصفية الحالية
-        context['filter'] = ProductFilter(self.request.GET, queryset=self.get_queryset())
+        context['filter'] = self.filterset
 
         return context
 
@@ -351,7 +382,7 @@ class CategoryListView(ListView):
 
     def get_queryset(self):
         """الحصول على الفئات الرئيسية فقط"""
-        return Category.objects.filter(parent=None, is_active=True)
+        return Category.objects.filter(parent=None, is_active=True).with_product_counts()
 
 
 class CategoryDetailView(DetailView):
@@ -365,30 +396,24 @@ class CategoryDetailView(DetailView):
         """إضافة بيانات إضافية للسياق"""
         context = super().get_context_data(**kwargs)
 
-        # إضافة المنتجات في الفئة وفئاتها الفرعية
-        category = self.get_object()
-        categories = [category]
-        categories.extend(category.get_descendants())
+        # إضافة مسار التنقل والفئات الفرعية المباشرة
+        category = self.object
+        context['breadcrumbs'] = category.get_breadcrumbs()
+        context['subcategories'] = category.children.filter(is_active=True).with_product_counts()
 
-        products = Product.objects.filter(
-            category__in=categories, 
-            status='published'
-        )
+        # إضافة المنتجات في الفئة وفئاتها الفرعية
+        products = Product.objects.published().filter(
+            category__path__startswith=category.path
+        ).for_listing()
 
         # تطبيق الفلاتر
         products = ProductFilter(self.request.GET, queryset=products).qs
 
         # ترقيم الصفحات
-        paginator = StandardResultsSetPagination()
-        page = paginator.paginate_queryset(products, self.request)
-
-        if page is not None:
-            context['products'] = page
-            context['is_paginated'] = True
-            context['page_obj'] = page
-        else:
-            context['products'] = products
-            context['is_paginated'] = False
+        page = Paginator(products, StandardResultsSetPagination.page_size).get_page(self.request.GET.get('page'))
+        context['products'] = page
+        context['page_obj'] = page
+        context['is_paginated'] = page.has_other_pages()
 
         return context
 
@@ -454,31 +479,28 @@ class SearchView(ListView):
         if not query:
             return Product.objects.none()
 
-        products = Product.objects.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) | 
-            Q(short_description__icontains=query) |
-            Q(tags__name__icontains=query)
-        ).distinct()
+        products = get_search_backend().search(Product.objects.published(), query).for_listing()
 
-        # تطبيق الفلاتر
-        products = ProductFilter(self.request.GET, queryset=products).qs
+        # تطبيق الفلاتر (يحفظ للاستخدام في السياق دون إعادة بناء النتائج)
+        self.filterset = ProductFilter(self.request.GET, queryset=products)
 
-        return products
+        return self.filterset.qs
 
     def get_context_data(self, **kwargs):
         """إضافة بيانات إضافية للسياق"""
         context = super().get_context_data(**kwargs)
 
         # إضافة كلمة البحث
-        context['query'] = self.request.GET.get('q', '')
-
-        # إضافة الفئات والوسوم والعلامات التجارية للفلاتر
-        context['categories'] = Category.objects.filter(is_active=True)
-        context['tags'] = Tag.objects.all()
-        context['brands'] = Brand.objects.filter(is_active=True)
-
-        # إضافة معلمات التصفية الحالية
-        context['filter'] = ProductFilter(self.request.GET, queryset=self.get_queryset())
+        query = self.request.GET.get('q', '')
+        context['query'] = query
+
+        # أعداد الفئات والوسوم والعلامات التجارية وشرائح السعر لنتائج البحث
+        if query:
+            facets = ProductFacets(self.filterset, scope=f'search:{query}').get()
+            context['facets'] = facets
+            context['categories'] = facets['categories']
+            context['tags'] = facets['tags']
+            context['brands'] = facets['brands']
+            context['filter'] = self.filterset
 
         return context
@@ -11,6 +11,7 @@ class User(AbstractUser):
     birth_date = models.DateField(_('تاريخ الميلاد'), null=True, blank=True)
     avatar = models.ImageField(_('الصورة الشخصية'), upload_to='avatars/', blank=True)
     is_verified = models.BooleanField(_('مفعل'), default=False)
+    stripe_customer_id = models.CharField(_('معرف عميل Stripe'), max_length=100, blank=True)
     created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
     updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
 
@@ -0,0 +1,19 @@
+"""
+اتصال Redis المشترك بين التطبيقات
+"""
+from functools import lru_cache
+from django.conf import settings
+
+
+@lru_cache(maxsize=None)
+def get_redis_connection(db=None):
+    """الحصول على عميل Redis يستخدم مجمع اتصالات مشتركاً داخل العملية"""
+    import redis
+
+    return redis.Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB if db is None else db,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    )
@@ -24,6 +24,7 @@ DJANGO_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sites',
+    'django.contrib.postgres',
 ]
 
 THIRD_PARTY_APPS = [
@@ -47,6 +48,7 @@ LOCAL_APPS = [
     'apps.payments',
     'apps.coupons',
     'apps.cart',
+    'apps.analytics',
 ]
 
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
@@ -163,6 +165,7 @@ SIMPLE_JWT = {
 REDIS_HOST = config('REDIS_HOST', default='localhost')
 REDIS_PORT = config('REDIS_PORT', default=6379, cast=int)
 REDIS_DB = config('REDIS_DB', default=0, cast=int)
+REDIS_SOCKET_TIMEOUT = config('REDIS_SOCKET_TIMEOUT', default=0.5, cast=float)
 
 # إعدادات التخزين المؤقت
 CACHES = {
@@ -186,6 +189,37 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    'flush-dirty-carts': {
+        'task': 'apps.cart.tasks.flush_dirty_carts',
+        'schedule': timedelta(minutes=5),
+    },
+    'release-expired-stock-reservations': {
+        'task': 'apps.products.tasks.release_expired_stock_reservations',
+        'schedule': timedelta(minutes=1),
+    },
+    # احتياط لإشعارات لم تُرسل مهمتها أو فشلت معالجتها (المعالجة تبدأ عادةً فور الاستلام)
+    'process-webhook-events': {
+        'task': 'apps.payments.tasks.process_webhook_events',
+        'schedule': timedelta(minutes=1),
+    },
+    'refresh-sales-rollups': {
+        'task': 'apps.analytics.tasks.refresh_sales_rollups',
+        'schedule': timedelta(minutes=5),
+    },
+}
+
+# مخزن سلة التسوق النشطة (تكتب سلال المستخدمين إلى قاعدة البيانات دورياً وعند إتمام الطلب)
+CART_STORE = config('CART_STORE', default='apps.cart.storage.RedisCartStore')
+CART_STORE_TTL = 60 * 60 * 24 * 30
+
+# مولد أرقام الطلبات وعدد الأرقام التي تحجزها كل عملية دفعة واحدة
+# أو مثلاً: apps.orders.numbering.RedisBlockGenerator
+ORDER_NUMBER_GENERATOR = config('ORDER_NUMBER_GENERATOR', default='apps.orders.numbering.PostgresSequenceGenerator')
+ORDER_NUMBER_BLOCK_SIZE = config('ORDER_NUMBER_BLOCK_SIZE', default=100, cast=int)
+
+# مدة حجز المخزون للطلب قبل تأكيده (بالثواني)
+STOCK_RESERVATION_TTL = config('STOCK_RESERVATION_TTL', default=30 * 60, cast=int)
 
 # إعدادات البريد الإلكتروني
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -205,6 +239,45 @@ STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET')
 PAYPAL_MODE = config('PAYPAL_MODE', default='sandbox')  # sandbox or live
 PAYPAL_CLIENT_ID = config('PAYPAL_CLIENT_ID')
 PAYPAL_CLIENT_SECRET = config('PAYPAL_CLIENT_SECRET')
+PAYPAL_WEBHOOK_ID = config('PAYPAL_WEBHOOK_ID', default='')
+
+# محولات بوابات الدفع لكل طريقة (apps.payments.gateways)
+# عناوين الواجهات قابلة للتغيير لتوجيهها إلى البوابة الوهمية المحلية في الاختبارات وقياس الأداء
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='https://api.stripe.com')
+PAYPAL_API_BASE = config(
+    'PAYPAL_API_BASE',
+    default='https://api-m.paypal.com' if PAYPAL_MODE == 'live' else 'https://api-m.sandbox.paypal.com',
+)
+PAYMENT_GATEWAYS = {
+    'credit_card': {
+        'BACKEND': 'apps.payments.gateways.StripeGateway',
+        'OPTIONS': {'api_key': STRIPE_SECRET_KEY, 'base_url': STRIPE_API_BASE, 'currency': 'sar'},
+    },
+    'paypal': {
+        'BACKEND': 'apps.payments.gateways.PayPalGateway',
+        'OPTIONS': {
+            'client_id': PAYPAL_CLIENT_ID, 'client_secret': PAYPAL_CLIENT_SECRET,
+            'base_url': PAYPAL_API_BASE, 'currency': 'USD', 'webhook_id': PAYPAL_WEBHOOK_ID,
+        },
+    },
+    'cash_on_delivery': {
+        'BACKEND': 'apps.payments.gateways.CashOnDeliveryGateway',
+    },
+}
+# مهلة الاتصال والقراءة (بالثواني)، ومحاولات الأخطاء العابرة، وحجم مجمع الاتصالات لكل بوابة
+PAYMENT_GATEWAY_TIMEOUT = (3.05, 15)
+PAYMENT_GATEWAY_RETRIES = 2
+PAYMENT_GATEWAY_POOL_SIZE = 10
+
+# محاولات معالجة إشعار البوابة قبل تركه فاشلاً والمهلة بينها (بالثواني)،
+# والمدة التي يعد بعدها الإشعار قيد المعالجة عالقاً
+WEBHOOK_MAX_ATTEMPTS = 5
+WEBHOOK_RETRY_DELAY = 60
+WEBHOOK_PROCESSING_TIMEOUT = 300
+
+# هامش التداخل عند تحديث ملخصات المبيعات من آخر علامة (بالثواني)،
+# لالتقاط الطلبات التي عُدلت في معاملات التزمت بعد بدء التحديث السابق
+SALES_ROLLUP_OVERLAP = 5 * 60
 
 # إعدادات CKEditor
 CKEDITOR_UPLOAD_PATH = 'uploads/'
@@ -222,6 +295,22 @@ ELASTICSEARCH_HOST = config('ELASTICSEARCH_HOST', default='localhost')
 ELASTICSEARCH_PORT = config('ELASTICSEARCH_PORT', default=9200, cast=int)
 ELASTICSEARCH_INDEX = 'ecommerce'
 
+# إعدادات البحث عن المنتجات
+# فارغ = اختيار تلقائي حسب قاعدة البيانات (PostgreSQL للبحث الكامل، وبحث بسيط لغيرها)
+# أو مثلاً: apps.products.search.ElasticsearchSearchBackend
+PRODUCT_SEARCH_BACKEND = config('PRODUCT_SEARCH_BACKEND', default='')
+PRODUCT_SEARCH_CONFIG = config('PRODUCT_SEARCH_CONFIG', default='arabic')
+
+# فهرس الإكمال التلقائي: redis (مشترك بين العمليات) أو memory (داخل العملية)
+PRODUCT_SUGGEST_INDEX = config('PRODUCT_SUGGEST_INDEX', default='redis')
+PRODUCT_SUGGEST_LIMIT = 10
+
+# مدة تخزين أعداد الفلاتر الوجهية (بالثواني)
+PRODUCT_FACETS_CACHE_TIMEOUT = 300
+
+# مدة تخزين نتيجة التحقق من صلاحية الكوبون لكل مستخدم (بالثواني)
+COUPON_ELIGIBILITY_CACHE_TIMEOUT = 300
+
 # إعدادات Allauth
 SITE_ID = 1
 ACCOUNT_EMAIL_REQUIRED = True
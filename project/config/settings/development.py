@@ -30,6 +30,15 @@ CACHES = {
     }
 }
 
+# فهرس الإكمال التلقائي داخل العملية للتطوير
+PRODUCT_SUGGEST_INDEX = config('PRODUCT_SUGGEST_INDEX', default='memory')
+
+# مخزن السلة فوق ذاكرة التخزين المؤقت للتطوير
+CART_STORE = config('CART_STORE', default='apps.cart.storage.CacheCartStore')
+
+# مولد أرقام الطلبات داخل العملية للتطوير (قاعدة SQLite)
+ORDER_NUMBER_GENERATOR = config('ORDER_NUMBER_GENERATOR', default='apps.orders.numbering.LocalBlockGenerator')
+
 # إعدادات الوسائط للتطوير
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
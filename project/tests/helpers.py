@@ -0,0 +1,36 @@
+"""أدوات مشتركة بين ملفات الاختبارات"""
+from apps.cart.models import Cart, CartItem
+from apps.orders.services import create_order_from_cart
+from apps.products.models import Category, Product
+from apps.users.models import Address, User
+
+
+class OrderTestMixin:
+    """بيانات مشتركة لاختبارات الطلبات"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='orders@example.com', username='orders', password='testpass123')
+        self.address = Address.objects.create(
+            user=self.user, first_name='أحمد', last_name='محمد', address_line_1='شارع 1',
+            city='الرياض', state='الرياض', postal_code='12345', country='SA', phone='0500000000'
+        )
+        self.category = Category.objects.create(name='إلكترونيات', slug='electronics')
+        self.products = [
+            Product.objects.create(
+                name=f'منتج {index}', slug=f'order-{index}', description='وصف', short_description='وصف',
+                price=10 * (index + 1), quantity=5, sku=f'OR{index}', category=self.category, status='published'
+            )
+            for index in range(5)
+        ]
+
+    def make_cart(self, lines, user=None):
+        cart = Cart.objects.create(user=user)
+        for product, quantity, variant in lines:
+            CartItem.objects.create(cart=cart, product=product, variant=variant, quantity=quantity)
+        return cart
+
+    def place(self, cart):
+        return create_order_from_cart(
+            cart, user=self.user, shipping_address=self.address, billing_address=self.address,
+            payment_method='cod', shipping_cost=10
+        )
@@ -0,0 +1,104 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from apps.analytics.models import RollupWatermark, SalesRollup
+from apps.analytics.rollups import dashboard, refresh_rollups
+from apps.coupons.models import Coupon, CouponUsage
+from apps.orders.models import Order
+from apps.products.models import Brand
+from tests.helpers import OrderTestMixin
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SalesRollupTest(OrderTestMixin, TestCase):
+    """اختبارات ملخصات المبيعات ولوحتها"""
+
+    def setUp(self):
+        super().setUp()
+        self.brand = Brand.objects.create(name='علامة', slug='brand')
+        self.products[0].brand = self.brand
+        self.products[0].save()
+        self.day = timezone.make_aware(datetime.combine(timezone.localdate() - timedelta(days=1), time.min))
+        self.coupon = Coupon.objects.create(code='SAVE', name='خصم', discount_type='fixed', discount_value=5)
+
+    def sell(self, hour, lines, status='confirmed'):
+        order = self.place(self.make_cart([(self.products[index], quantity, None) for index, quantity in lines]))
+        if status != 'pending':
+            order.transition_to(status)
+        Order.objects.filter(pk=order.pk).update(created_at=self.day + timedelta(hours=hour, minutes=10))
+        order.refresh_from_db()
+        return order
+
+    def rollup(self, period, dimension, key=''):
+        return SalesRollup.objects.get(period=period, dimension=dimension, key=key)
+
+    def test_refresh_builds_hourly_and_daily_facts(self):
+        """الملخصات الساعية واليومية لكل بعد، دون الطلبات غير المؤكدة"""
+        first = self.sell(9, [(0, 2), (1, 1)])
+        self.sell(9, [(0, 1)])
+        self.sell(14, [(1, 1)])
+        self.sell(15, [(2, 1)], status='pending')
+        CouponUsage.objects.create(coupon=self.coupon, user=self.user, order=first, discount_amount=5)
+        Order.objects.filter(pk=first.pk).update(amount_refunded=Decimal('20'))
+
+        self.assertEqual(refresh_rollups(), {'hours': 3, 'days': 1})
+
+        hour = SalesRollup.objects.get(period='hour', dimension='total', period_start=self.day + timedelta(hours=9))
+        self.assertEqual((hour.orders, hour.units), (2, 4))
+        day = self.rollup('day', 'total')
+        # الطلبات بإجمالي 50 و20 و30 مع الشحن 10 لكل منها
+        self.assertEqual((day.orders, day.units, day.revenue, day.refunds), (3, 5, Decimal('100'), Decimal('20')))
+        self.assertEqual(day.average_order_value, Decimal('100') / 3)
+
+        product = self.rollup('day', 'product', str(self.products[0].pk))
+        self.assertEqual((product.orders, product.units, product.revenue), (2, 3, Decimal('30')))
+        # المسترد موزع بنسبة العنصر من الطلب الأول (20 من 40)
+        self.assertEqual(product.refunds, Decimal('10'))
+        self.assertEqual(self.rollup('day', 'brand', str(self.brand.pk)).revenue, Decimal('30'))
+        self.assertEqual(self.rollup('day', 'category', str(self.category.pk)).units, 5)
+        coupon = self.rollup('day', 'coupon', str(self.coupon.pk))
+        self.assertEqual((coupon.label, coupon.orders, coupon.units), ('SAVE', 1, 3))
+        self.assertEqual(self.rollup('day', 'payment_method', 'cod').orders, 3)
+
+    def test_refresh_is_incremental_from_watermark(self):
+        """التحديث التالي يعيد الساعات التي تغيرت طلباتها فقط"""
+        order = self.sell(9, [(0, 1)])
+        self.sell(14, [(1, 1)])
+        refresh_rollups()
+        # الطلبات المعدلة قبل هامش التداخل لا تعاد
+        Order.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(refresh_rollups(), {'hours': 0, 'days': 0})
+
+        order.transition_to('cancelled')
+
+        self.assertEqual(refresh_rollups(), {'hours': 1, 'days': 1})
+        self.assertFalse(SalesRollup.objects.filter(period='hour', period_start=self.day + timedelta(hours=9)).exists())
+        self.assertEqual(self.rollup('day', 'total').orders, 1)
+
+    def test_backfill_command_and_dashboard_read_rollups_only(self):
+        """أمر إعادة البناء يبني الملخصات، واللوحة تقرأها دون جداول الطلبات"""
+        self.sell(9, [(0, 2)])
+        self.sell(10, [(1, 1)])
+        call_command('backfill_sales_rollups', stdout=StringIO())
+        self.assertIsNotNone(RollupWatermark.objects.get().value)
+
+        with CaptureQueriesContext(connection) as queries:
+            data = dashboard(self.day, self.day + timedelta(days=1))
+        self.assertFalse(any('orders_order' in query['sql'] for query in queries))
+        self.assertEqual(len(queries), 6)
+        self.assertEqual((data.totals['orders'], data.totals['revenue']), (2, Decimal('60')))
+        self.assertEqual(data.totals['average_order_value'], Decimal('30.00'))
+        self.assertEqual([row['name'] for row in data.top['product']], ['منتج 0', 'منتج 1'])
+
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('admin:analytics_salesrollup_changelist'), {'period': 'day'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'منتج 0')
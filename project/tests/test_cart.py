@@ -0,0 +1,163 @@
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from apps.cart.models import Cart, CartItem
+from apps.cart.storage import get_store_class
+from apps.cart.tasks import flush_dirty_carts
+from apps.products.models import Category, Product
+from apps.users.models import User
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CART_STORE='apps.cart.storage.CacheCartStore',
+)
+class CartStoreTest(APITestCase):
+    """اختبارات مخزن سلة التسوق"""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        category = Category.objects.create(name='إلكترونيات', slug='electronics')
+        self.phone = Product.objects.create(
+            name='هاتف', slug='phone', description='وصف', short_description='وصف',
+            price='100.50', quantity=10, sku='CT001', category=category, status='published'
+        )
+        self.cable = Product.objects.create(
+            name='كابل', slug='cable', description='وصف', short_description='وصف',
+            price='20.00', quantity=10, sku='CT002', category=category, status='published'
+        )
+        self.user = User.objects.create_user(email='cart@example.com', username='cart', password='testpass123')
+
+    def add(self, product, quantity=1):
+        return self.client.post(
+            reverse('cart:add_to_cart_api'), {'product_id': product.pk, 'quantity': quantity}, format='json'
+        )
+
+    def test_anonymous_cart_does_not_touch_database(self):
+        """سلة الزائر تبقى في المخزن حتى إتمام الطلب"""
+        self.add(self.phone, 2)
+        response = self.add(self.cable)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_items'], 3)
+        self.assertEqual(str(response.data['total_price']), '221.00')
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+
+        session_key = self.client.session['cart_session_key']
+        store = get_store_class()(f'session:{session_key}')
+        self.assertEqual((store.get_count(), str(store.get_total())), (3, '221.00'))
+
+    def test_update_and_remove_by_line_key(self):
+        """تعديل الكمية وحذف السطر بمفتاح السطر مع تحديث العدد والإجمالي"""
+        response = self.add(self.phone)
+        line = response.data['items'][0]['id']
+        self.assertEqual(line, f'{self.phone.pk}:0')
+
+        response = self.client.put(
+            reverse('cart:update_cart_item_api', args=[line]), {'quantity': 4}, format='json'
+        )
+        self.assertEqual(response.data['total_items'], 4)
+
+        response = self.client.put(
+            reverse('cart:update_cart_item_api', args=[line]), {'quantity': 11}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.delete(reverse('cart:remove_from_cart_api', args=[line]))
+        self.assertEqual(response.data['items'], [])
+        response = self.client.delete(reverse('cart:remove_from_cart_api', args=[line]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_login_merges_and_flush_writes_user_cart(self):
+        """دمج سلة الزائر عند تسجيل الدخول وكتابة سلة المستخدم دورياً"""
+        self.add(self.phone, 2)
+        self.client.force_login(self.user)
+        response = self.add(self.phone)
+        self.assertEqual(response.data['total_items'], 3)
+        self.assertFalse(CartItem.objects.exists())
+
+        self.assertEqual(flush_dirty_carts(), 1)
+        item = CartItem.objects.get(cart__user=self.user)
+        self.assertEqual((item.product, item.quantity), (self.phone, 3))
+
+        self.client.delete(reverse('cart:clear_cart_api'))
+        flush_dirty_carts()
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_failed_flush_keeps_the_rest_of_the_batch(self):
+        """فشل كتابة سلة لا يسقط بقية سلال الدفعة، وتعاد السلة الفاشلة إلى قائمة الانتظار"""
+        from unittest import mock
+        from apps.cart import tasks
+        from apps.cart.storage import get_store_class
+
+        store_class = get_store_class()
+        for owner in ('user:1', 'user:2', 'user:3'):
+            store_class.mark_dirty(owner)
+
+        written = []
+        def flush(owner):
+            if owner == 'user:1':
+                raise ConnectionError('down')
+            written.append(owner)
+
+        with mock.patch.object(tasks, 'flush_user_cart', side_effect=flush):
+            with self.assertLogs('apps.cart.tasks', 'ERROR'):
+                self.assertEqual(flush_dirty_carts(batch_size=10), 2)
+        self.assertEqual(sorted(written), ['user:2', 'user:3'])
+        self.assertEqual(store_class.pop_dirty(10), ['user:1'])
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CART_STORE='apps.cart.storage.CacheCartStore',
+)
+class CartContextProcessorTest(APITestCase):
+    """اختبارات معالج سياق السلة"""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        category = Category.objects.create(name='إلكترونيات', slug='electronics')
+        self.product = Product.objects.create(
+            name='هاتف', slug='phone', description='وصف', short_description='وصف',
+            price=10, quantity=10, sku='CP001', category=category, status='published'
+        )
+        self.user = User.objects.create_user(email='badge@example.com', username='badge', password='testpass123')
+
+    def get_context(self):
+        from django.contrib.auth.models import AnonymousUser
+        from django.test import RequestFactory
+        from apps.cart.context_processors import cart
+
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        request.user = AnonymousUser()
+        return cart(request)
+
+    def test_count_is_lazy_and_served_from_store(self):
+        """لا استعلامات قبل استخدام العدد ولا بعده"""
+        self.client.post(reverse('cart:add_to_cart_api'), {'product_id': self.product.pk, 'quantity': 2}, format='json')
+
+        with self.assertNumQueries(0):
+            context = self.get_context()
+            self.assertEqual(context['cart_items_count'] + 0, 2)
+            self.assertTrue(context['cart_items_count'] > 0)
+
+    def test_unused_count_does_not_load_user(self):
+        """عدم استخدام العدد في القالب لا يحمّل المستخدم ولا السلة"""
+        from apps.cart.context_processors import cart
+
+        class UnloadedRequest:
+            session = self.client.session
+
+            @property
+            def user(self):
+                raise AssertionError('تم تحميل المستخدم')
+
+        with self.assertNumQueries(0):
+            cart(UnloadedRequest())
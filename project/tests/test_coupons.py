@@ -0,0 +1,381 @@
+import csv
+import io
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from apps.coupons import campaigns
+from apps.coupons.campaigns import CouponBatchError, assign_batch, export_batch, generate_batch
+from apps.coupons.discounts import calculate_line_discounts, get_eligible_product_ids
+from apps.coupons.eligibility import CouponRedemptionError, redeem_coupon
+from apps.coupons.models import Coupon, CouponBatch, CouponUsage, CouponUserCounter, UserCoupon
+from apps.orders.models import Order
+from apps.orders.services import create_order_from_cart
+from apps.products.models import Category, Product
+from apps.users.models import User
+from tests.helpers import OrderTestMixin
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CouponEligibilityTest(TestCase):
+    """اختبارات محرك صلاحية الكوبونات"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='coupon@example.com', username='coupon', password='testpass123')
+        self.other = User.objects.create_user(email='other@example.com', username='other', password='testpass123')
+        self.coupon = Coupon.objects.create(
+            code='SAVE10', name='خصم', discount_type='percentage', discount_value=10,
+            usage_limit=2, usage_limit_per_user=1,
+        )
+
+    def redeem(self, user):
+        order = Order.objects.create(user=user, subtotal=100, total=100)
+        with self.captureOnCommitCallbacks(execute=True):
+            redeem_coupon(self.coupon, user, order, Decimal('10'))
+
+    def validate(self, code, user):
+        coupon = Coupon.objects.get(code__iexact=code, is_active=True)
+        return coupon.is_valid(user=user, cart_total=Decimal('100'))
+
+    def test_validation_costs_at_most_two_queries(self):
+        """جلب الكوبون واستعلام واحد لشروط المستخدم، ثم استعلام الجلب فقط من التخزين المؤقت"""
+        with self.assertNumQueries(2):
+            self.assertEqual(self.validate('save10', self.user), (True, ''))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.validate('save10', self.user), (True, ''))
+
+    def test_usage_counters_and_cache_invalidation(self):
+        """الاستخدام يحدث العدادات ويبطل نتيجة التحقق المخزنة للمستخدم"""
+        self.assertTrue(self.validate('SAVE10', self.user)[0])
+        self.redeem(self.user)
+
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, 1)
+        self.assertEqual(CouponUserCounter.objects.get(coupon=self.coupon, user=self.user).times_used, 1)
+        self.assertFalse(self.validate('SAVE10', self.user)[0])
+        self.assertTrue(self.validate('SAVE10', self.other)[0])
+
+        self.redeem(self.other)
+        self.assertFalse(self.validate('SAVE10', self.other)[0])
+
+    def test_restricted_to_assigned_users(self):
+        """الكوبون المخصص متاح لمستخدميه فقط"""
+        self.assertTrue(self.validate('SAVE10', self.other)[0])
+        self.coupon.users.add(self.user)
+
+        self.coupon.refresh_from_db()
+        self.assertTrue(self.coupon.is_restricted)
+        self.assertTrue(self.validate('SAVE10', self.user)[0])
+        self.assertFalse(self.validate('SAVE10', self.other)[0])
+        self.assertFalse(self.validate('SAVE10', None)[0])
+        self.assertEqual(list(Coupon.objects.available_to(self.other)), [])
+        self.assertEqual(list(Coupon.objects.available_to(self.user)), [self.coupon])
+
+        self.coupon.users.clear()
+        self.assertTrue(self.validate('SAVE10', self.other)[0])
+
+    def test_rebuild_counters_repairs_drift(self):
+        """إعادة بناء العدادات من سجل الاستخدامات تحدّث تاريخ التعديل لإبطال التحقق المخزن"""
+        self.redeem(self.user)
+        Coupon.objects.filter(pk=self.coupon.pk).update(times_used=2, updated_at=timezone.now() - timedelta(days=1))
+        CouponUserCounter.objects.all().delete()
+
+        call_command('rebuild_coupon_counters', stdout=io.StringIO())
+
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, 1)
+        self.assertGreater(self.coupon.updated_at, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(CouponUserCounter.objects.get(coupon=self.coupon, user=self.user).times_used, 1)
+
+    def test_reverse_clear_refreshes_only_related_coupons(self):
+        """مسح كوبونات المستخدم من جهته يحدّث كوبوناته فقط"""
+        other_coupon = Coupon.objects.create(code='OTHER', name='آخر', discount_type='fixed', discount_value=5)
+        self.coupon.users.add(self.user)
+        other_coupon.users.add(self.other)
+        stamp = Coupon.objects.get(pk=other_coupon.pk).updated_at
+
+        self.user.coupons.clear()
+
+        self.coupon.refresh_from_db()
+        other_coupon.refresh_from_db()
+        self.assertFalse(self.coupon.is_restricted)
+        self.assertTrue(other_coupon.is_restricted)
+        self.assertEqual(other_coupon.updated_at, stamp)
+
+    def test_scope_includes_descendant_categories(self):
+        """نطاق الكوبون يشمل منتجاته وفئاته وفروعها"""
+        parent = Category.objects.create(name='إلكترونيات', slug='electronics')
+        child = Category.objects.create(name='هواتف', slug='phones', parent=parent)
+        other = Category.objects.create(name='كتب', slug='books')
+        phone, book, novel = [
+            Product.objects.create(
+                name=name, slug=name, description='وصف', short_description='وصف',
+                price=10, quantity=5, sku=name, category=category, status='published'
+            )
+            for name, category in (('phone', child), ('book', other), ('novel', other))
+        ]
+        product_ids = [phone.pk, book.pk, novel.pk]
+        self.assertEqual(get_eligible_product_ids(self.coupon, product_ids), set(product_ids))
+
+        self.coupon.categories.add(parent)
+        self.coupon.products.add(novel)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_eligible_product_ids(self.coupon, product_ids), {phone.pk, novel.pk})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CouponCheckoutTest(OrderTestMixin, TestCase):
+    """اختبارات استخدام الكوبون ضمن إتمام الطلب"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.coupon = Coupon.objects.create(
+            code='ONCE', name='خصم', discount_type='fixed', discount_value=5, usage_limit_per_user=1,
+        )
+
+    def place_with_coupon(self):
+        cart = self.make_cart([(self.products[0], 1, None)])
+        with self.captureOnCommitCallbacks(execute=True):
+            return create_order_from_cart(
+                cart, user=self.user, shipping_address=self.address, billing_address=self.address,
+                shipping_cost=10, coupon=Coupon.objects.get(pk=self.coupon.pk)
+            )
+
+    def test_checkout_records_usage_and_enforces_limit(self):
+        """الطلب يسجل الاستخدام والخصم، والاستخدام الزائد يلغي الطلب كاملاً"""
+        order = self.place_with_coupon()
+        self.assertEqual((order.subtotal, order.discount, order.total), (10, 5, 15))
+        self.assertEqual(list(CouponUsage.objects.values_list('order', 'discount_amount')), [(order.pk, 5)])
+
+        with self.assertRaises(CouponRedemptionError):
+            self.place_with_coupon()
+        self.assertEqual(Order.objects.count(), 1)
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.times_used, 1)
+
+    def test_scoped_coupon_discounts_only_eligible_lines(self):
+        """الخصم يحسب من الأسطر المشمولة ويحفظ نصيب كل سطر، ويرفض الكوبون الذي لا يشمل السلة"""
+        scoped = Coupon.objects.create(code='ONE', name='خصم', discount_type='percentage', discount_value=50)
+        scoped.products.add(self.products[1])
+        cart = self.make_cart([(self.products[0], 1, None), (self.products[1], 2, None)])
+
+        order = create_order_from_cart(
+            cart, user=self.user, shipping_address=self.address, billing_address=self.address, coupon=scoped
+        )
+        self.assertEqual((order.subtotal, order.discount, order.total), (50, 20, 30))
+        self.assertEqual(
+            list(order.items.order_by('product_id').values_list('discount', flat=True)), [0, 20]
+        )
+
+        scoped.products.set([self.products[4]])
+        with self.assertRaises(CouponRedemptionError):
+            create_order_from_cart(
+                self.make_cart([(self.products[0], 1, None)]), user=self.user,
+                shipping_address=self.address, billing_address=self.address, coupon=scoped
+            )
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CouponLineDiscountTest(TestCase):
+    """اختبارات حساب الخصم على مستوى الأسطر"""
+
+    def setUp(self):
+        self.parent = Category.objects.create(name='ملابس', slug='clothes')
+        self.child = Category.objects.create(name='قمصان', slug='shirts', parent=self.parent)
+        self.other = Category.objects.create(name='كتب', slug='books')
+        self.products = [
+            Product.objects.create(
+                name=f'منتج {index}', slug=f'line-{index}', description='وصف', short_description='وصف',
+                price=10, quantity=5, sku=f'LN{index}', category=category, status='published'
+            )
+            for index, category in enumerate([self.child, self.parent, self.other, self.other])
+        ]
+        self.coupon = Coupon.objects.create(
+            code='LINES', name='خصم', discount_type='percentage', discount_value=10, maximum_discount=5,
+        )
+
+    def lines(self, *amounts):
+        return [(index, product.pk, amount) for index, (product, amount) in enumerate(zip(self.products, amounts))]
+
+    def test_unscoped_coupon_covers_every_line(self):
+        breakdown = calculate_line_discounts(self.coupon, self.lines('10', '20', '30'))
+        self.assertEqual((breakdown.eligible_subtotal, breakdown.discount), (60, Decimal('5.00')))
+        self.assertTrue(all(line.eligible for line in breakdown.lines))
+
+    def test_scope_includes_descendant_categories_in_one_query(self):
+        """فئة الكوبون تشمل فروعها، ومنتجاته تشمل من خارج فئاته، باستعلام واحد"""
+        self.coupon.categories.add(self.parent)
+        self.coupon.products.add(self.products[3])
+        with self.assertNumQueries(1):
+            breakdown = calculate_line_discounts(self.coupon, self.lines('10.00', '7.00', '99.00', '3.00'))
+        self.assertEqual([line.eligible for line in breakdown.lines], [True, True, False, True])
+        self.assertEqual((breakdown.eligible_subtotal, breakdown.discount), (Decimal('20.00'), Decimal('2.00')))
+        self.assertEqual([line.discount for line in breakdown.lines], [Decimal('1.00'), Decimal('0.70'), 0, Decimal('0.30')])
+
+    def test_fixed_discount_is_split_to_the_cent(self):
+        """توزيع الخصم الثابت بالنسبة مع تساوي المجموع للخصم تماماً ودون تجاوز الأسطر المشمولة"""
+        self.coupon.discount_type = 'fixed'
+        self.coupon.discount_value = Decimal('10')
+        breakdown = calculate_line_discounts(self.coupon, self.lines('10', '10', '10'))
+        self.assertEqual(sorted(line.discount for line in breakdown.lines), [Decimal('3.33'), Decimal('3.33'), Decimal('3.34')])
+        self.assertEqual(sum(line.discount for line in breakdown.lines), Decimal('10.00'))
+
+        self.coupon.products.add(self.products[0])
+        breakdown = calculate_line_discounts(self.coupon, self.lines('4', '10'))
+        self.assertEqual([line.discount for line in breakdown.lines], [Decimal('4.00'), 0])
+
+
+class CouponBatchTest(TestCase):
+    """اختبارات توليد كوبونات الحملات وتوزيعها"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='ملابس', slug='clothes')
+        self.template = Coupon.objects.create(
+            code='TEMPLATE', name='حملة', discount_type='percentage', discount_value=15, is_active=False,
+        )
+        self.template.categories.add(self.category)
+        self.batch = CouponBatch.objects.create(
+            name='حملة', template=self.template, prefix='CMP-', code_length=8, quantity=25,
+        )
+
+    def test_generation_retries_collisions_and_resumes(self):
+        """الأكواد المتصادمة تعوض، والاستئناف يكمل العدد دون تكرار"""
+        Coupon.objects.create(code='CMP-TAKEN', name='قائم', discount_type='fixed', discount_value=1)
+        real = campaigns.generate_code
+        codes = iter(['CMP-TAKEN'])
+        with mock.patch.object(campaigns, 'generate_code', lambda *args: next(codes, None) or real(*args)):
+            self.batch.quantity = 10
+            self.assertEqual(generate_batch(self.batch, chunk_size=4), 10)
+
+        self.batch.quantity = 25
+        progress = []
+        generate_batch(self.batch, chunk_size=10, progress=lambda done, total: progress.append(done))
+        self.assertEqual(progress, [20, 25])
+
+        coupons = self.batch.coupons.all()
+        self.assertEqual(coupons.count(), 25)
+        self.assertEqual(Coupon.objects.filter(code='CMP-TAKEN').count(), 1)
+        self.assertTrue(all(code.startswith('CMP-') and len(code) == 12 for code in coupons.values_list('code', flat=True)))
+        self.assertEqual(set(coupons.values_list('usage_limit', 'discount_value', 'is_active')), {(1, 15, True)})
+        self.assertEqual(Coupon.categories.through.objects.filter(coupon__batch=self.batch).count(), 25)
+        self.batch.refresh_from_db()
+        self.assertEqual((self.batch.status, self.batch.generated), ('generated', 25))
+
+    def test_repeated_batch_code_is_not_counted_twice(self):
+        """الكود المكرر لكود أدرجته الدفعة في مجموعة سابقة يعوض ولا يعد مرتين"""
+        codes = iter(['CMP-A1', 'CMP-A2', 'CMP-A1', 'CMP-A3'])
+        with mock.patch.object(campaigns, 'generate_code', lambda *args: next(codes)):
+            self.batch.quantity = 3
+            self.assertEqual(generate_batch(self.batch, chunk_size=2), 3)
+        self.assertEqual(sorted(self.batch.coupons.values_list('code', flat=True)), ['CMP-A1', 'CMP-A2', 'CMP-A3'])
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.generated, 3)
+
+    def test_batch_being_generated_cannot_be_claimed_twice(self):
+        """عامل ثانٍ يرفض دفعة قيد التوليد، ويستأنف الدفعة العالقة بعد المهلة"""
+        CouponBatch.objects.filter(pk=self.batch.pk).update(status='generating')
+        with self.assertRaises(CouponBatchError):
+            generate_batch(self.batch)
+        self.assertFalse(self.batch.coupons.exists())
+
+        CouponBatch.objects.filter(pk=self.batch.pk).update(
+            updated_at=timezone.now() - campaigns.GENERATION_STALE_AFTER - timedelta(minutes=1)
+        )
+        self.assertEqual(generate_batch(self.batch), 25)
+
+    def test_exhausted_code_space_fails_the_batch(self):
+        with mock.patch.object(campaigns, 'generate_code', return_value='TEMPLATE'):
+            with self.assertRaises(CouponBatchError):
+                generate_batch(self.batch)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.status, 'failed')
+
+    def test_assign_from_streamed_csv_and_export(self):
+        """كود واحد لكل مستخدم موجود، والتشغيل الثاني لا يعيد توزيع الأسطر المعالجة"""
+        generate_batch(self.batch)
+        users = [
+            User.objects.create_user(email=f'fan{index}@example.com', username=f'fan{index}', password='x')
+            for index in range(3)
+        ]
+        rows = ['email', users[0].email, 'missing@example.com', users[1].email, users[0].email, users[2].email]
+        source = '\n'.join(rows) + '\n'
+
+        self.assertEqual(assign_batch(self.batch, io.StringIO(source), chunk_size=2), 3)
+        self.assertEqual(assign_batch(self.batch, io.StringIO(source), chunk_size=2), 3)
+        self.assertEqual(UserCoupon.objects.filter(coupon__batch=self.batch).count(), 3)
+
+        held = UserCoupon.objects.get(user=users[1]).coupon
+        self.assertTrue(held.is_restricted)
+        self.assertEqual(list(held.users.all()), [users[1]])
+
+        output = io.StringIO()
+        self.assertEqual(export_batch(self.batch, output), 25)
+        exported = list(csv.DictReader(io.StringIO(output.getvalue())))
+        self.assertEqual(len(exported), 25)
+        self.assertEqual(sorted(row['email'] for row in exported if row['email']), sorted(user.email for user in users))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CouponRedemptionLoadTest(TransactionTestCase):
+    """اختبار تحميل: مشترون متزامنون لكوبون محدود لا يتجاوزون حده"""
+    buyers = 12
+    limit = 5
+    # محاولات الكتابة التي يرفضها SQLite قبل اعتبار المشتري فاشلاً، والانتظار بينها
+    max_attempts = 50
+    retry_delay = 0.01
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(email=f'buyer{index}@example.com', username=f'buyer{index}', password='x')
+            for index in range(self.buyers)
+        ]
+        self.coupon = Coupon.objects.create(
+            code='VIRAL', name='خصم', discount_type='fixed', discount_value=5, usage_limit=self.limit,
+        )
+
+    def buy(self, user, results):
+        """نتيجة المشتري: True للاسترداد، False لرفض الكوبون، None إذا استنفدت المحاولات"""
+        close_old_connections()
+        try:
+            for _ in range(self.max_attempts):
+                try:
+                    with transaction.atomic():
+                        order = Order.objects.create(user=user, subtotal=100, total=100)
+                        redeem_coupon(Coupon.objects.get(pk=self.coupon.pk), user, order, Decimal('5'))
+                    results.append(True)
+                    return
+                except CouponRedemptionError:
+                    results.append(False)
+                    return
+                except OperationalError:
+                    # SQLite يرفض الكتابة المتزامنة بدلاً من الانتظار؛ تعاد المحاولة بعد مهلة
+                    time.sleep(self.retry_delay)
+            results.append(None)
+        finally:
+            close_old_connections()
+
+    def test_concurrent_redemptions_never_exceed_limit(self):
+        results = []
+        threads = [threading.Thread(target=self.buy, args=(user, results)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertNotIn(
+            None, results, f'{results.count(None)} مشترٍ لم يكمل الشراء بعد {self.max_attempts} محاولة'
+        )
+        self.coupon.refresh_from_db()
+        self.assertEqual(results.count(True), self.limit)
+        self.assertEqual(self.coupon.times_used, self.limit)
+        self.assertEqual(CouponUsage.objects.count(), self.limit)
+        self.assertEqual(Order.objects.filter(coupon_usages__isnull=False).count(), self.limit)
@@ -0,0 +1,454 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import skipUnless
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from apps.orders.exports import COLUMN_NAMES, export_orders
+from apps.orders.models import InvalidTransitionError, Order, OrderItem, OrderStatusHistory
+from apps.orders.numbering import (
+    BlockOrderNumberGenerator, LocalBlockGenerator, get_order_number_generator, parse_order_number
+)
+from apps.orders.services import OutOfStockError, transition_orders
+from apps.products.inventory import commit_order, release_expired_reservations, release_order, restock_order
+from apps.products.models import Product, ProductVariant, StockReservation
+from tests.helpers import OrderTestMixin
+
+
+class CreateOrderTest(OrderTestMixin, TestCase):
+    """اختبارات إنشاء الطلب من السلة"""
+
+    def test_creates_order_and_reserves_stock(self):
+        """إنشاء عناصر الطلب وحساب الإجمالي وحجز المخزون وتفريغ السلة"""
+        variant = ProductVariant.objects.create(product=self.products[1], sku='OR1-V', price=15, quantity=3)
+        cart = self.make_cart([(self.products[0], 2, None), (self.products[1], 3, variant)])
+
+        order = self.place(cart)
+
+        self.assertEqual(order.subtotal, 65)
+        self.assertEqual(order.total, 75)
+        self.assertEqual(
+            sorted(order.items.values_list('product_sku', 'quantity', 'total')),
+            [('OR0', 2, 20), ('OR1-V', 3, 45)]
+        )
+        self.products[0].refresh_from_db()
+        variant.refresh_from_db()
+        self.assertEqual((self.products[0].quantity, variant.quantity), (5, 3))
+        self.assertEqual((self.products[0].reserved_quantity, variant.reserved_quantity), (2, 3))
+        self.assertEqual((self.products[0].available_quantity, variant.available_quantity), (3, 0))
+        self.assertEqual(order.stock_reservations.filter(status='active').count(), 2)
+        self.assertFalse(cart.items.exists())
+
+    def test_query_count_does_not_grow_with_items(self):
+        """عدد الاستعلامات ثابت مهما كان عدد العناصر"""
+        # المولد المحلي يقرأ آخر رقم محفوظ عند أول استخدام فقط
+        get_order_number_generator().generate()
+        small = self.make_cart([(self.products[0], 1, None)])
+        # (يشمل قراءة المتاح بعد الحجز لإبطال وجه التوفر إذا نفد منتج)
+        with self.assertNumQueries(14) as small_queries:
+            self.place(small)
+
+        large = self.make_cart([(product, 1, None) for product in self.products])
+        with self.assertNumQueries(len(small_queries)):
+            self.place(large)
+
+    def test_out_of_stock_rolls_back(self):
+        """نقص كمية أي عنصر يلغي الطلب بالكامل دون حجز أي مخزون"""
+        first = self.make_cart([(self.products[0], 4, None), (self.products[1], 1, None)])
+        second = self.make_cart([(self.products[0], 2, None), (self.products[1], 1, None)], user=self.user)
+        self.place(first)
+
+        with self.assertRaises(OutOfStockError) as context:
+            self.place(second)
+
+        self.assertEqual(context.exception.names, ['منتج 0'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 2)
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=[self.products[0].pk, self.products[1].pk]).order_by('pk').values_list('reserved_quantity', flat=True)),
+            [4, 1]
+        )
+        self.assertEqual(StockReservation.objects.count(), 2)
+        self.assertEqual(second.items.count(), 2)
+
+
+class StockReservationTest(OrderTestMixin, TestCase):
+    """اختبارات دورة حياة حجز المخزون"""
+
+    def setUp(self):
+        super().setUp()
+        self.product = self.products[0]
+        self.order = self.place(self.make_cart([(self.product, 2, None)]))
+
+    def assertStock(self, quantity, reserved):
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.reserved_quantity), (quantity, reserved))
+
+    def test_commit_deducts_reserved_quantity(self):
+        """تأكيد الطلب يخصم الكمية ويحرر المحجوز"""
+        commit_order(self.order)
+        self.assertStock(3, 0)
+        # التأكيد المكرر لا يخصم مرة أخرى
+        commit_order(self.order)
+        self.assertStock(3, 0)
+
+    def test_release_returns_available_quantity(self):
+        """فشل الدفع يعيد الكمية المحجوزة إلى المتاح، والدفع اللاحق يخصمها"""
+        release_order(self.order)
+        self.assertStock(5, 0)
+        commit_order(self.order)
+        self.assertStock(3, 0)
+
+    def test_commit_after_release_rereserves_available_quantity(self):
+        """الدفع بعد تحرير الحجز وبيع الكمية لغيره لا يخصم ما ليس متوفراً ويعلّم الطلب للمراجعة"""
+        release_order(self.order)
+        other = self.place(self.make_cart([(self.product, 4, None)]))
+
+        self.assertEqual(commit_order(self.order), 0)
+        self.assertStock(5, 4)
+        self.assertEqual(self.order.stock_reservations.get().status, 'released')
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.requires_review)
+        self.assertTrue(self.order.review_reason)
+
+        # بعد إلغاء الطلب الآخر تكفي الكمية فيعاد الحجز ويخصم
+        restock_order(other)
+        self.assertEqual(commit_order(self.order), 1)
+        self.assertStock(3, 0)
+
+    def test_expired_reservations_are_released(self):
+        """الحجوزات المنتهية تُحرر بالمهمة الدورية فقط"""
+        self.assertEqual(release_expired_reservations(), 0)
+        self.order.stock_reservations.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(release_expired_reservations(), 1)
+        self.assertStock(5, 0)
+        self.assertEqual(self.order.stock_reservations.get().status, 'expired')
+
+    def test_restock_cancelled_order(self):
+        """إلغاء الطلب يحرر الحجز النشط أو يعيد الكمية المخصومة بعد التأكيد"""
+        restock_order(self.order)
+        self.assertStock(5, 0)
+
+        order = self.place(self.make_cart([(self.product, 2, None)]))
+        commit_order(order)
+        restock_order(order)
+        self.assertStock(5, 0)
+
+
+class SharedCounterGenerator(BlockOrderNumberGenerator):
+    """مولد يحجز كتله من عداد مشترك يحاكي INCRBY"""
+    counter = 0
+    counter_lock = threading.Lock()
+
+    def allocate_block(self):
+        with self.counter_lock:
+            SharedCounterGenerator.counter += self.block_size
+            return SharedCounterGenerator.counter - self.block_size + 1
+
+
+class OrderNumberTest(OrderTestMixin, TestCase):
+    """اختبارات مولد أرقام الطلبات"""
+
+    def generate_concurrently(self, generators, count=200):
+        results = [[] for _ in generators]
+
+        def work(generator, numbers):
+            numbers.extend(generator.generate() for _ in range(count))
+
+        threads = [threading.Thread(target=work, args=pair) for pair in zip(generators, results)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_orders_in_same_second_get_distinct_numbers(self):
+        """الطلبات المتتالية تحصل على أرقام مختلفة ومتزايدة"""
+        first = self.place(self.make_cart([(self.products[0], 1, None)]))
+        second = self.place(self.make_cart([(self.products[1], 1, None)]))
+        self.assertNotEqual(first.order_number, second.order_number)
+        self.assertLess(first.order_number, second.order_number)
+        self.assertRegex(first.order_number, r'^ORD-\d{8}-\d{8}$')
+
+    def test_threads_sharing_a_generator_never_collide(self):
+        """الخيوط التي تشترك في مولد واحد لا تتكرر أرقامها"""
+        generator = LocalBlockGenerator(block_size=7)
+        generator.generate()
+        results = self.generate_concurrently([generator] * 8)
+        numbers = [number for numbers in results for number in numbers]
+        self.assertEqual(len(set(numbers)), 8 * 200)
+        for numbers in results:
+            self.assertEqual(numbers, sorted(numbers))
+
+    def test_workers_allocating_blocks_never_collide(self):
+        """عدة عمليات تحجز كتلاً من مصدر مشترك لا تتكرر أرقامها"""
+        results = self.generate_concurrently([SharedCounterGenerator(block_size=10) for _ in range(6)])
+        values = [parse_order_number(number) for numbers in results for number in numbers]
+        self.assertEqual(sorted(values), list(range(1, 6 * 200 + 1)))
+
+
+class OrderStatusTrackingTest(OrderTestMixin, TestCase):
+    """اختبارات تتبع تغيير حالة الطلب وسجلها"""
+
+    def setUp(self):
+        super().setUp()
+        get_order_number_generator().generate()
+        self.orders = [self.place(self.make_cart([(product, 1, None)])) for product in self.products[:3]]
+
+    def test_order_creation_records_one_history_row(self):
+        """إنشاء الطلب يسجل حالة أولية واحدة بالمستخدم"""
+        history = OrderStatusHistory.objects.filter(order=self.orders[0])
+        self.assertEqual(list(history.values_list('status', 'created_by')), [('pending', self.user.pk)])
+
+    def test_status_change_without_extra_selects(self):
+        """تغيير الحالة يحدّث الطابع الزمني ويسجل الحالة دون قراءة الطلب مجدداً"""
+        order = Order.objects.get(pk=self.orders[0].pk)
+        order.status = 'shipped'
+        with self.assertNumQueries(2):
+            order.save()
+
+        order.refresh_from_db()
+        self.assertIsNotNone(order.shipped_at)
+        self.assertEqual(order.status_history.filter(status='shipped').count(), 1)
+
+        # الحفظ دون تغيير الحالة لا يضيف سجلاً
+        with self.assertNumQueries(1):
+            order.save()
+        self.assertEqual(order.status_history.count(), 2)
+
+    def test_deferred_status_is_read_once(self):
+        """الحالة المؤجلة تُقرأ مرة واحدة فقط عند الحاجة"""
+        order = Order.objects.only('pk', 'order_number').get(pk=self.orders[0].pk)
+        order.status = 'processing'
+        with self.assertNumQueries(3):
+            order.save()
+        self.assertEqual(order.status_history.filter(status='processing').count(), 1)
+
+    def test_bulk_status_transition(self):
+        """النقل الجماعي بتحديث واحد وإدراج جماعي لسجلات الحالة لكل دفعة"""
+        Order.objects.filter(pk=self.orders[0].pk).update(status='processing')
+        Order.objects.exclude(pk=self.orders[0].pk).update(status='confirmed')
+
+        with self.assertNumQueries(6):
+            result = Order.objects.all().transition('processing', user=self.user)
+
+        self.assertEqual(result.transitioned, 2)
+        self.assertEqual(list(result.failures), [self.orders[0].pk])
+        self.assertFalse(Order.objects.exclude(status='processing').exists())
+        self.assertEqual(OrderStatusHistory.objects.filter(status='processing', created_by=self.user).count(), 2)
+
+        result = Order.objects.all().transition('shipped', batch_size=2)
+        self.assertEqual(result, (3, {}))
+        self.assertFalse(Order.objects.filter(shipped_at__isnull=True).exists())
+
+
+class OrderStateMachineTest(OrderTestMixin, TestCase):
+    """اختبارات آلة حالات الطلب"""
+
+    def setUp(self):
+        super().setUp()
+        self.product = self.products[0]
+        self.order = self.place(self.make_cart([(self.product, 2, None)]))
+
+    def test_guarded_transitions(self):
+        """الانتقالات غير المسموحة ترفع خطأ دون تغيير الطلب"""
+        with self.assertRaises(InvalidTransitionError):
+            self.order.transition_to('shipped')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+        with self.assertRaises(InvalidTransitionError):
+            Order.objects.all().transition('unknown')
+
+    def test_transition_effects_on_stock(self):
+        """التأكيد يخصم الكمية المحجوزة والإلغاء يعيدها"""
+        self.order.transition_to('confirmed')
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.reserved_quantity), (3, 0))
+
+        Order.objects.filter(pk=self.order.pk).transition('cancelled')
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.reserved_quantity), (5, 0))
+
+    def test_payment_for_cancelled_order_is_flagged(self):
+        """الدفع لطلب ملغي لا يؤكده ولا يخصم المخزون بل يعلّمه للمراجعة"""
+        from apps.payments.services import confirm_order
+
+        self.order.transition_to('cancelled')
+        self.order.payment_status = 'paid'
+        with self.assertLogs('apps.payments.services', 'WARNING'):
+            confirm_order(self.order)
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.payment_status), ('cancelled', 'paid'))
+        self.assertTrue(self.order.requires_review)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.reserved_quantity), (5, 0))
+
+    def test_transition_service_reports_failures(self):
+        """خدمة النقل تبلغ عن الطلبات غير الموجودة وغير المسموح نقلها"""
+        result = transition_orders(
+            'processing', ids=[self.order.pk, 999999], order_numbers=['ORD-MISSING']
+        )
+        self.assertEqual(result.transitioned, 0)
+        self.assertEqual(set(result.failures), {str(self.order.pk), '999999', 'ORD-MISSING'})
+
+        result = transition_orders('confirmed', order_numbers=[self.order.order_number])
+        self.assertEqual(result, (1, {}))
+
+    def test_transition_api_requires_staff(self):
+        """واجهة النقل الجماعي متاحة للموظفين فقط"""
+        client = APIClient()
+        url = reverse('orders:order_transition_api')
+        client.force_authenticate(self.user)
+        self.assertEqual(client.post(url, {'status': 'confirmed', 'orders': [self.order.pk]}, format='json').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = client.post(url, {'status': 'confirmed', 'orders': [self.order.pk, 999999]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['transitioned'], 1)
+        self.assertEqual(list(response.data['failures']), ['999999'])
+        self.assertEqual(client.post(url, {'status': 'confirmed'}, format='json').status_code, 400)
+
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+class OrderExportTest(OrderTestMixin, TestCase):
+    """اختبارات تصدير الطلبات التدفقي"""
+
+    def setUp(self):
+        super().setUp()
+        self.first = self.place(self.make_cart([(self.products[0], 2, None), (self.products[1], 1, None)]))
+        self.second = self.place(self.make_cart([(self.products[2], 1, None)]))
+        self.second.transition_to('confirmed')
+        Order.objects.filter(pk=self.first.pk).update(created_at=timezone.now() - timedelta(days=40))
+
+    def export(self, format, **filters):
+        return b''.join(export_orders(format, chunk_size=1, **filters))
+
+    def test_csv_has_a_flat_row_per_item_from_one_query(self):
+        """سطر لكل عنصر بترتيب الطلب، من استعلام واحد مهما كان عدد العناصر"""
+        with self.assertNumQueries(1):
+            content = self.export('csv')
+
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(rows[0], COLUMN_NAMES)
+        self.assertEqual(
+            [(row[0], row[13], row[16]) for row in rows[1:]],
+            [(self.first.order_number, 'OR0', '2'), (self.first.order_number, 'OR1', '1'),
+             (self.second.order_number, 'OR2', '1')],
+        )
+        self.assertEqual(rows[1][5:8], ['orders@example.com', 'الرياض', 'SA'])
+
+    def test_date_and_status_filters(self):
+        """مرشحا التاريخ والحالة يحددان الطلبات المصدرة"""
+        today = timezone.localdate()
+        lines = self.export('ndjson', date_from=today - timedelta(days=1), date_to=today).decode().splitlines()
+        self.assertEqual([json.loads(line)['product_sku'] for line in lines], ['OR2'])
+        self.assertEqual(json.loads(lines[0])['order_total'], '40.00')
+
+        lines = self.export('ndjson', statuses=['pending']).decode().splitlines()
+        self.assertEqual([json.loads(line)['product_sku'] for line in lines], ['OR0', 'OR1'])
+
+    @skipUnless(pq, 'pyarrow غير مثبت')
+    def test_parquet_export(self):
+        """Parquet بأنواع أعمدته"""
+        table = pq.read_table(io.BytesIO(self.export('parquet')))
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(table.column('product_sku').to_pylist(), ['OR0', 'OR1', 'OR2'])
+
+    def test_export_api_streams_for_staff_only(self):
+        """واجهة التصدير للموظفين فقط وتبث الاستجابة، وترفض المرشحات غير الصالحة"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('orders:order_export_api')
+        self.assertEqual(client.get(url).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = client.get(url, {'file_format': 'csv', 'status': 'confirmed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 2)
+
+        self.assertEqual(client.get(url, {'status': 'unknown'}).status_code, 400)
+        self.assertEqual(client.get(url, {'file_format': 'xlsx'}).status_code, 400)
+
+    def test_export_command_writes_file(self):
+        """أمر التصدير يكتب الملف بالمرشحات"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'orders.csv')
+            call_command('export_orders', output=path, status=['pending'], stderr=io.StringIO())
+            with open(path, newline='') as file:
+                self.assertEqual(len(list(csv.reader(file))), 3)
+
+
+class OrderApiQueryTest(OrderTestMixin, TestCase):
+    """عدد استعلامات قائمة الطلبات وتفاصيلها ثابت مهما كان عدد الطلبات والعناصر"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_orders(self, count, lines):
+        for _ in range(count):
+            order = self.place(self.make_cart([(product, 1, None) for product in self.products[:lines]]))
+            order.transition_to('confirmed')
+            for product in self.products[:lines]:
+                Product.objects.filter(pk=product.pk).update(quantity=5)
+        return order
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data
+
+    def test_list_is_a_summary_with_constant_queries(self):
+        """القائمة ملخص بعدد العناصر دون العناصر نفسها"""
+        self.add_orders(1, 1)
+        few, data = self.count_queries(reverse('orders:order_list_api'))
+        self.add_orders(4, 3)
+        many, data = self.count_queries(reverse('orders:order_list_api'))
+
+        self.assertEqual(few, many)
+        summary = data['results'][0]
+        self.assertEqual(summary['item_count'], 3)
+        self.assertNotIn('items', summary)
+        self.assertEqual(
+            [row['item_count'] for row in data['results']], [3, 3, 3, 3, 1]
+        )
+
+    def test_detail_prefetches_items_history_and_addresses(self):
+        """التفاصيل تجلب العناصر والمتغيرات والسجل والعناوين مسبقاً"""
+        variant = ProductVariant.objects.create(product=self.products[0], sku='OR0-V', price=12, quantity=3)
+        small = self.place(self.make_cart([(self.products[0], 1, variant)]))
+        large = self.place(self.make_cart(
+            [(self.products[0], 1, variant)] + [(product, 1, None) for product in self.products[1:]]
+        ))
+        large.transition_to('confirmed')
+
+        few, _ = self.count_queries(reverse('orders:order_detail_api', args=[small.pk]))
+        many, data = self.count_queries(reverse('orders:order_detail_api', args=[large.pk]))
+
+        self.assertEqual(few, many)
+        self.assertEqual(len(data['items']), 5)
+        self.assertEqual(data['items'][0]['variant']['sku'], 'OR0-V')
+        self.assertEqual([entry['status'] for entry in data['status_history']], ['confirmed', 'pending'])
+        self.assertEqual(data['shipping_address']['city'], 'الرياض')
@@ -0,0 +1,376 @@
+import csv
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from apps.orders.models import Order
+from apps.payments.fake_gateway import FakeGatewayServer
+from apps.payments.gateways import StripeGateway, get_gateway
+from apps.payments.ledger import record_transaction
+from apps.payments.models import Payment, Transaction, WebhookEvent
+from apps.payments.reconciliation import read_settlement, reconcile
+from apps.payments.settlement_samples import sample_lookup, write_sample_settlement
+from apps.payments.services import PaymentError, complete_payment, execute_payment, refund_payment, start_payment
+from apps.payments.webhooks import process_events
+from tests.helpers import OrderTestMixin
+
+
+class FakeGatewayMixin(OrderTestMixin):
+    """بوابة وهمية محلية لكل اختبار (تتكرر معرفات الدفعات بين الاختبارات) ومحولات تشير إليها"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeGatewayServer().start()
+        self.addCleanup(self.server.stop)
+        override = override_settings(PAYMENT_GATEWAYS={
+            'credit_card': {
+                'BACKEND': 'apps.payments.gateways.StripeGateway',
+                'OPTIONS': {'api_key': 'sk_test', 'base_url': self.server.url, 'currency': 'sar'},
+            },
+            'paypal': {
+                'BACKEND': 'apps.payments.gateways.PayPalGateway',
+                'OPTIONS': {'client_id': 'id', 'client_secret': 'secret', 'base_url': self.server.url},
+            },
+            'cash_on_delivery': {'BACKEND': 'apps.payments.gateways.CashOnDeliveryGateway'},
+        }, PAYMENT_GATEWAY_RETRIES=2)
+        override.enable()
+        get_gateway.cache_clear()
+        self.addCleanup(get_gateway.cache_clear)
+        self.addCleanup(override.disable)
+        self.product = self.products[0]
+
+    def new_order(self, quantity=2):
+        return self.place(self.make_cart([(self.product, quantity, None)]))
+
+    def assertStock(self, quantity, reserved):
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.reserved_quantity), (quantity, reserved))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PaymentGatewayTest(FakeGatewayMixin, TestCase):
+    """اختبارات محولات البوابات والدفع على مرحلتين"""
+
+    def test_stripe_payment_reuses_pooled_connection(self):
+        """نية الدفع تنشأ مع عميل Stripe مرة واحدة، والطلبات تمر على اتصال دائم واحد"""
+        first = start_payment(self.new_order(), 'credit_card', user=self.user)
+        second = start_payment(self.new_order(), 'credit_card', user=self.user)
+
+        self.assertEqual(first.payment.status, 'processing')
+        self.assertTrue(first.payment.transaction_id.startswith('pi_'))
+        self.assertTrue(first.client_secret)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.stripe_customer_id.startswith('cus_'))
+        intent = self.server.payment_intents[second.payment.transaction_id]
+        self.assertEqual((intent['amount'], intent['customer']), (3000, self.user.stripe_customer_id))
+        # عميل واحد ونيتا دفع
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_transient_errors_are_retried_idempotently(self):
+        """أخطاء البوابة العابرة تعاد محاولتها بمفتاح منع التكرار نفسه"""
+        self.user.stripe_customer_id = 'cus_existing'
+        self.server.fail_next(503, 2)
+
+        started = start_payment(self.new_order(), 'credit_card', user=self.user)
+
+        self.assertEqual(started.payment.status, 'processing')
+        self.assertEqual((self.server.requests, len(self.server.payment_intents)), (3, 1))
+
+    def test_declined_payment_releases_reservation(self):
+        """رفض البوابة يسجل الدفعة فاشلة ويحرر الكمية المحجوزة"""
+        self.user.stripe_customer_id = 'cus_existing'
+        order = self.new_order()
+        self.assertStock(5, 2)
+        self.server.fail_next(402)
+
+        with self.assertRaises(PaymentError):
+            start_payment(order, 'credit_card', user=self.user)
+
+        self.assertEqual(Payment.objects.get(order=order).status, 'failed')
+        self.assertStock(5, 0)
+
+    def test_webhook_completion_and_refund(self):
+        """إكمال الدفع من الإشعار يؤكد الطلب، والإرجاع المرفوض يعيد الدفعة مكتملة"""
+        self.user.stripe_customer_id = 'cus_existing'
+        order = self.new_order()
+        payment = start_payment(order, 'credit_card', user=self.user).payment
+        complete_payment(payment, {'id': payment.transaction_id})
+        complete_payment(payment, {'id': payment.transaction_id})
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'confirmed')
+        self.assertStock(3, 0)
+
+        with self.assertRaises(PaymentError):
+            refund_payment(payment, Decimal('40'))
+        self.server.fail_next(400)
+        with self.assertRaises(PaymentError):
+            refund_payment(payment, Decimal('5'))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+
+        payment = refund_payment(payment, '5')
+        self.assertEqual((payment.status, payment.refund_amount), ('partially_refunded', Decimal('5')))
+        self.assertTrue(payment.refund_transaction_id.startswith('re_'))
+        with self.assertRaises(PaymentError):
+            refund_payment(payment, '5')
+
+    def test_paypal_approval_execute_and_refund(self):
+        """دفع PayPal ينشأ برابط موافقة، ويؤكد الطلب عند التنفيذ، ويرجع من عملية البيع"""
+        order = self.new_order()
+        started = start_payment(order, 'paypal', return_url='http://shop/execute/')
+
+        self.assertEqual(started.payment.status, 'processing')
+        self.assertIn('/approve/', started.redirect_url)
+        sent = self.server.paypal_payments[started.payment.transaction_id]
+        self.assertEqual(sent['transactions'][0]['amount']['total'], '30.00')
+
+        payment = execute_payment(started.payment, payer_id='PAYER')
+        self.assertEqual(payment.status, 'completed')
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'confirmed')
+
+        payment = refund_payment(payment, payment.amount)
+        self.assertEqual(payment.status, 'refunded')
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, 'refunded')
+        self.assertEqual((order.amount_paid, order.amount_refunded), (Decimal('30'), Decimal('30')))
+        self.assertEqual(
+            list(payment.transactions.order_by('pk').values_list('transaction_type', flat=True)),
+            ['payment', 'refund'],
+        )
+
+    def test_cash_on_delivery_confirms_without_gateway(self):
+        """الدفع عند الاستلام يؤكد الطلب دون أي طلب HTTP"""
+        order = self.new_order()
+
+        start_payment(order, 'cash_on_delivery', user=self.user)
+
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status), ('confirmed', 'unpaid'))
+        self.assertEqual(self.server.requests, 0)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PaymentTransactionScopeTest(FakeGatewayMixin, TransactionTestCase):
+    """استدعاء البوابة يتم خارج معاملات قاعدة البيانات"""
+
+    def test_gateway_is_called_outside_transactions(self):
+        self.user.stripe_customer_id = 'cus_existing'
+        calls = []
+        create_payment = StripeGateway.create_payment
+
+        def record(gateway, payment, **kwargs):
+            calls.append(connection.in_atomic_block)
+            return create_payment(gateway, payment, **kwargs)
+
+        with mock.patch.object(StripeGateway, 'create_payment', record):
+            payment = start_payment(self.new_order(), 'credit_card', user=self.user).payment
+
+        self.assertEqual(calls, [False])
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'processing')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class WebhookInboxTest(FakeGatewayMixin, TestCase):
+    """اختبارات صندوق وارد الإشعارات"""
+
+    def setUp(self):
+        super().setUp()
+        self.user.stripe_customer_id = 'cus_existing'
+        self.order = self.new_order()
+
+    def post_stripe(self, event_id, event_type, intent):
+        payload = {'id': event_id, 'type': event_type, 'data': {'object': intent}}
+        event = mock.Mock(id=event_id, type=event_type)
+        with mock.patch('stripe.Webhook.construct_event', return_value=event):
+            return self.client.post(
+                reverse('payments:stripe_webhook'), json.dumps(payload),
+                content_type='application/json', HTTP_STRIPE_SIGNATURE='sig',
+            )
+
+    def test_replayed_stripe_event_is_applied_once(self):
+        """الإشعار يحفظ ويعاد 200 دون معالجته، والمعاد إرساله لا يطبق مرة ثانية"""
+        payment = start_payment(self.order, 'credit_card', user=self.user).payment
+        intent = {'id': payment.transaction_id, 'status': 'succeeded'}
+
+        with mock.patch('apps.payments.tasks.process_webhook_events.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.post_stripe('evt_1', 'payment_intent.succeeded', intent)
+            self.post_stripe('evt_1', 'payment_intent.succeeded', intent)
+        self.assertEqual(response.status_code, 200)
+        delay.assert_called_once_with()
+        self.assertEqual(WebhookEvent.objects.get().status, 'pending')
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'processing')
+
+        self.assertEqual(process_events(), (1, 0, 0))
+        self.assertEqual(process_events(), (0, 0, 0))
+        payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual((payment.status, self.order.status), ('completed', 'confirmed'))
+        self.assertStock(3, 0)
+
+    def test_failed_events_are_retried_after_delay(self):
+        """الحدث الذي يسبق حفظ معرف المعاملة يفشل ثم ينجح في محاولة لاحقة"""
+        self.post_stripe('evt_2', 'payment_intent.succeeded', {'id': 'pi_unknown'})
+        self.post_stripe('evt_3', 'charge.updated', {'id': 'ch_1'})
+
+        with self.assertLogs('apps.payments.webhooks', 'ERROR'):
+            self.assertEqual(process_events(), (0, 1, 1))
+        self.assertEqual(process_events(), (0, 0, 0))
+
+        payment = Payment.objects.create(order=self.order, amount=self.order.total, method='credit_card')
+        Payment.objects.filter(pk=payment.pk).update(transaction_id='pi_unknown')
+        WebhookEvent.objects.filter(event_id='evt_2').update(updated_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(process_events(), (1, 0, 0))
+        self.assertEqual(WebhookEvent.objects.get(event_id='evt_2').attempts, 2)
+
+    def test_paypal_event_is_verified_by_the_worker(self):
+        """إشعار PayPal يتحقق من توقيعه عند المعالجة، والتوقيع غير الصالح لا يطبق"""
+        payment = start_payment(self.order, 'paypal', return_url='http://shop/execute/').payment
+        for event_id, signature in (('WH-bad', 'invalid'), ('WH-good', 'signed')):
+            response = self.client.post(
+                reverse('payments:paypal_webhook'),
+                json.dumps({
+                    'id': event_id, 'event_type': 'PAYMENT.SALE.COMPLETED',
+                    'resource': {'parent_payment': payment.transaction_id},
+                }),
+                content_type='application/json', HTTP_PAYPAL_TRANSMISSION_SIG=signature,
+            )
+            self.assertEqual(response.status_code, 200)
+
+        with self.assertLogs('apps.payments.webhooks', 'ERROR'):
+            self.assertEqual(process_events(), (1, 0, 1))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+        self.assertEqual(WebhookEvent.objects.get(event_id='WH-bad').status, 'failed')
+
+
+class PaymentLedgerTest(OrderTestMixin, TestCase):
+    """اختبارات دفتر المعاملات ورصيدي الطلب"""
+
+    def setUp(self):
+        super().setUp()
+        self.order = self.place(self.make_cart([(self.products[0], 2, None)]))
+        self.payments = [
+            Payment.objects.create(order=self.order, amount=Decimal('15'), method='credit_card')
+            for _ in range(5)
+        ]
+
+    def locked(self, payment):
+        return Payment.objects.select_related('order').get(pk=payment.pk)
+
+    def test_recording_costs_one_insert_and_one_update(self):
+        """تسجيل المعاملة إدراج وتحديث فقط مهما كان عدد دفعات الطلب"""
+        payment = self.locked(self.payments[0])
+        with self.assertNumQueries(2):
+            record_transaction(payment, 'payment', '15', 'pi_1')
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.amount_paid, self.order.payment_status), (Decimal('15'), 'partially_paid'))
+        self.assertEqual(payment.order.payment_status, 'partially_paid')
+
+    def test_payment_status_is_derived_from_balances(self):
+        """حالة الدفع تتبع الرصيدين في قاعدة البيانات وفي نسخة الطلب في الذاكرة"""
+        steps = [
+            ('payment', '15', 'paid'),
+            ('refund', '10', 'partially_refunded'),
+            ('void', '5', 'partially_refunded'),
+            ('refund', '20', 'refunded'),
+        ]
+        for (transaction_type, amount, status), payment in zip(steps, self.payments):
+            payment = self.locked(payment)
+            if transaction_type == 'payment':
+                record_transaction(payment, 'capture', '15')
+            record_transaction(payment, transaction_type, amount)
+            self.order.refresh_from_db()
+            self.assertEqual(self.order.payment_status, status)
+            self.assertEqual(payment.order.payment_status, status)
+
+        self.assertEqual((self.order.amount_paid, self.order.amount_refunded), (Decimal('30'), Decimal('30')))
+        self.assertEqual(Transaction.objects.filter(payment__order=self.order).count(), 5)
+
+    def test_rebuild_repairs_drifted_balances(self):
+        """أمر إعادة البناء يعيد الأرصدة وحالة الدفع من المعاملات"""
+        record_transaction(self.locked(self.payments[0]), 'payment', '30')
+        record_transaction(self.locked(self.payments[1]), 'refund', '5')
+        Order.objects.filter(pk=self.order.pk).update(amount_paid=0, amount_refunded=0, payment_status='unpaid')
+
+        call_command('rebuild_order_payments', stdout=StringIO())
+
+        self.order.refresh_from_db()
+        self.assertEqual(
+            (self.order.amount_paid, self.order.amount_refunded, self.order.payment_status),
+            (Decimal('30'), Decimal('5'), 'partially_refunded'),
+        )
+
+
+class ReconciliationTest(OrderTestMixin, TestCase):
+    """اختبارات دفتر الإضافة فقط ومطابقة ملفات التسوية"""
+
+    def setUp(self):
+        super().setUp()
+        order = self.place(self.make_cart([(self.products[0], 2, None)]))
+        payment = Payment.objects.select_related('order').get(
+            pk=Payment.objects.create(order=order, amount=Decimal('30'), method='credit_card').pk
+        )
+        self.entry = record_transaction(payment, 'payment', '30', 'pi_1')
+        record_transaction(payment, 'refund', '10', 're_1')
+
+    def test_ledger_is_append_only(self):
+        """المعاملة المسجلة لا تعدل ولا تحذف"""
+        self.entry.amount = Decimal('1')
+        with self.assertRaises(ValueError):
+            self.entry.save()
+        with self.assertRaises(ValueError):
+            self.entry.delete()
+
+    def test_settlement_mismatches_are_reported_in_batches(self):
+        """كل دفعة أسطر تطابق باستعلام واحد، والفروق تكتب بأسبابها والتحويلات تتخطى"""
+        settlement = StringIO(
+            'source_id,reporting_category,gross,currency\n'
+            'pi_1,charge,30.00,sar\n'
+            're_1,refund,-10.00,sar\n'
+            'pi_2,charge,5.00,sar\n'
+            'po_1,payout,-20.00,sar\n'
+            'pi_1,refund,-30.00,sar\n'
+            're_1,refund,-9.99,sar\n'
+            'pi_3\n'
+        )
+        mismatches = []
+        with self.assertNumQueries(2):
+            result = reconcile(read_settlement(settlement, 'stripe'), mismatches.append, batch_size=4)
+
+        self.assertEqual(result, (7, 2, 4, 1))
+        self.assertEqual(
+            [(mismatch.line_number, mismatch.reason) for mismatch in mismatches],
+            [(4, 'missing'), (6, 'type'), (7, 'amount'), (8, 'malformed')],
+        )
+        self.assertEqual(mismatches[2].ledger_amount, Decimal('10'))
+
+    def test_reconcile_command_on_sample_settlement(self):
+        """الملف الاصطناعي يطابق دفتره الاصطناعي إلا الأسطر المفسدة عمداً"""
+        with tempfile.TemporaryDirectory() as directory:
+            source, output = os.path.join(directory, 'settlement.csv'), os.path.join(directory, 'report.csv')
+            with open(source, 'w', newline='') as file:
+                broken = write_sample_settlement(file, 500, format='paypal', mismatch_every=100)
+            with open(source, newline='') as file:
+                mismatches = []
+                result = reconcile(read_settlement(file, 'paypal'), mismatches.append, lookup=sample_lookup('paypal'))
+            self.assertEqual((result.lines, result.mismatched, result.skipped), (500, broken, 10))
+            self.assertEqual({mismatch.reason for mismatch in mismatches}, {'amount', 'missing'})
+
+            # مقابل قاعدة البيانات كل أسطر الملف الاصطناعي غير موجودة
+            call_command('reconcile_settlement', source, format='paypal', output=output, stdout=StringIO())
+            with open(output, newline='') as file:
+                rows = list(csv.reader(file))
+        self.assertEqual(len(rows), 1 + 490)
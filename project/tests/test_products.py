@@ -1,10 +1,11 @@
 
-from django.test import TestCase, Client
+from io import StringIO
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework import status
 from rest_framework.test import APITestCase
-from apps.products.models import Category, Brand, Product, ProductImage, ProductReview
+from apps.products.models import Brand, Category, Product, ProductImage, ProductReview, Tag
 from apps.users.models import User
 
 
@@ -245,6 +246,61 @@ class ProductReviewTest(TestCase):
         self.assertEqual(str(review), expected_str)
 
 
+    def test_rating_aggregates_follow_reviews(self):
+        """القيم المجمعة للتقييمات تتحدث مع الإنشاء والموافقة والحذف"""
+        other_user = User.objects.create_user(
+            email='other@example.com',
+            username='otheruser',
+            password='testpass123'
+        )
+        review = ProductReview.objects.create(
+            product=self.product, user=self.user, rating=5, title='رائع', content='ممتاز'
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 0)
+
+        review.is_approved = True
+        review.save()
+        ProductReview.objects.create(
+            product=self.product, user=other_user, rating=2, title='سيء', content='سيء',
+            is_approved=True
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 2)
+        self.assertEqual(self.product.rating_sum, 7)
+        self.assertEqual(self.product.average_rating, 3.5)
+        self.assertEqual(self.product.get_rating_distribution(), {1: 0, 2: 1, 3: 0, 4: 0, 5: 1})
+
+        ProductReview.objects.filter(product=self.product).set_approved(False)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 0)
+        self.assertIsNone(self.product.average_rating)
+
+        ProductReview.objects.filter(user=other_user).set_approved(True)
+        ProductReview.objects.get(user=other_user).delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 0)
+        self.assertEqual(self.product.rating_2_count, 0)
+
+    def test_rebuild_product_ratings_command(self):
+        """أمر إعادة البناء يصلح أي انحراف في القيم المجمعة"""
+        from django.core.management import call_command
+
+        ProductReview.objects.create(
+            product=self.product, user=self.user, rating=4, title='جيد', content='جيد',
+            is_approved=True
+        )
+        Product.objects.filter(pk=self.product.pk).update(rating_sum=99, rating_count=9)
+
+        call_command('rebuild_product_ratings', stdout=StringIO())
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_sum, 4)
+        self.assertEqual(self.product.rating_count, 1)
+        self.assertEqual(self.product.rating_4_count, 1)
+        self.assertEqual(self.product.average_rating, 4)
+
+
 class ProductViewTest(TestCase):
     """اختبارات واجهة المنتجات الأمامية"""
 
@@ -291,3 +347,453 @@ class ProductViewTest(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'أجهزة إلكترونية')
+
+
+class ProductListingQueryTest(APITestCase):
+    """اختبارات ثبات عدد الاستعلامات في قوائم المنتجات"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='reviewer@example.com',
+            username='reviewer',
+            password='testpass123'
+        )
+        self.client.force_authenticate(self.user)
+
+        self.category = Category.objects.create(name='أجهزة إلكترونية', slug='electronics')
+        self.brand = Brand.objects.create(name='سامسونج', slug='samsung')
+        self.tag = Tag.objects.create(name='تخفيضات', slug='sale')
+
+    def create_products(self, count, offset=0):
+        """إنشاء منتجات مع صور وتقييمات"""
+        for i in range(offset, offset + count):
+            product = Product.objects.create(
+                name=f'منتج {i}',
+                slug=f'product-{i}',
+                description='وصف',
+                short_description='وصف مختصر',
+                price=100,
+                sku=f'SKU{i}',
+                quantity=5,
+                category=self.category,
+                brand=self.brand,
+                status='published',
+                featured=True
+            )
+            product.tags.add(self.tag)
+            for index in range(3):
+                ProductImage.objects.create(
+                    product=product,
+                    image=SimpleUploadedFile(f'p{i}-{index}.jpg', b'file_content', content_type='image/jpeg'),
+                    is_featured=index == 1
+                )
+            ProductReview.objects.create(
+                product=product,
+                user=self.user,
+                rating=4,
+                title='جيد',
+                content='منتج جيد',
+                is_approved=True
+            )
+
+    def count_queries(self, url):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        url, params = url if isinstance(url, tuple) else (url, {})
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'page_size': 100, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), response
+
+    def test_listing_query_count_is_constant(self):
+        """عدد الاستعلامات لا يتغير بزيادة حجم الصفحة"""
+        urls = [
+            reverse('product-list'),
+            reverse('featured_products'),
+            reverse('category_products', kwargs={'slug': 'electronics'}),
+            reverse('brand_products', kwargs={'slug': 'samsung'}),
+            reverse('tag_products', kwargs={'slug': 'sale'}),
+            (reverse('product_search'), {'q': 'منتج'}),
+        ]
+
+        self.create_products(3)
+        small = [self.count_queries(url)[0] for url in urls]
+
+        self.create_products(20, offset=3)
+        large = [self.count_queries(url)[0] for url in urls]
+
+        self.assertEqual(small, large)
+
+    def test_listing_reads_annotations(self):
+        """متوسط التقييم وعدد التقييمات والصورة تأتي من الاستعلام المجهز"""
+        self.create_products(2)
+        _, response = self.count_queries(reverse('product-list'))
+
+        item = response.data['results'][0]
+        self.assertEqual(item['average_rating'], 4)
+        self.assertEqual(item['reviews_count'], 1)
+        self.assertEqual(item['category_name'], 'أجهزة إلكترونية')
+        self.assertEqual(item['brand_name'], 'سامسونج')
+        self.assertIn('-1', item['image_url'])
+
+    def test_listing_prefetches_only_the_main_image(self):
+        """الجلب المسبق يحمل صورة واحدة لكل منتج هي الصورة المميزة"""
+        self.create_products(2)
+        products = list(Product.objects.for_listing())
+        self.assertEqual([len(product.listing_images) for product in products], [1, 1])
+        self.assertTrue(all(product.listing_images[0].is_featured for product in products))
+
+
+class CategoryTreeTest(APITestCase):
+    """اختبارات شجرة الفئات"""
+
+    def setUp(self):
+        self.root = Category.objects.create(name='أجهزة', slug='devices')
+        self.phones = Category.objects.create(name='هواتف', slug='phones', parent=self.root)
+        self.android = Category.objects.create(name='أندرويد', slug='android', parent=self.phones)
+        self.other = Category.objects.create(name='ملابس', slug='clothes')
+
+    def test_descendants_and_ancestors(self):
+        """الفئات الفرعية والآباء تعتمد على المسار المخزن"""
+        self.assertEqual(set(self.root.get_descendants()), {self.phones, self.android})
+        self.assertEqual(list(self.android.get_ancestors()), [self.root, self.phones])
+        self.assertEqual(self.android.get_breadcrumbs(), [self.root, self.phones, self.android])
+        self.assertEqual(self.android.depth, 2)
+
+    def test_move_updates_subtree(self):
+        """نقل فئة يحدث مسارات جميع فئاتها الفرعية"""
+        self.phones.parent = self.other
+        self.phones.save()
+
+        self.android.refresh_from_db()
+        self.assertEqual(list(self.android.get_ancestors()), [self.other, self.phones])
+        self.assertFalse(self.root.get_descendants().exists())
+
+    def test_cannot_move_into_own_subtree(self):
+        """منع نقل فئة إلى إحدى فئاتها الفرعية"""
+        from django.core.exceptions import ValidationError
+
+        self.root.parent = self.android
+        with self.assertRaises(ValidationError):
+            self.root.save()
+
+    def test_child_of_stale_parent_uses_stored_path(self):
+        """مسار الفئة الجديدة يبنى من مسار الأب المحفوظ لا من نسخة قديمة منه"""
+        stale_phones = Category.objects.get(pk=self.phones.pk)
+        self.phones.parent = self.other
+        self.phones.save()
+
+        child = Category.objects.create(name='آيفون', slug='iphone', parent=stale_phones)
+        self.assertEqual(list(child.get_ancestors()), [self.other, self.phones])
+
+    def test_depth_is_limited_to_path_length(self):
+        """تجاوز أقصى عمق يرفع ValidationError بدلاً من خطأ قاعدة البيانات"""
+        from django.core.exceptions import ValidationError
+
+        parent = self.android
+        for level in range(self.android.depth + 1, Category.MAX_DEPTH):
+            parent = Category.objects.create(name=f'مستوى {level}', slug=f'level-{level}', parent=parent)
+        self.assertEqual(parent.depth, Category.MAX_DEPTH - 1)
+
+        with self.assertRaises(ValidationError):
+            Category.objects.create(name='عميق', slug='too-deep', parent=parent)
+
+        # نقل شجرة تحت فئة عميقة يتجاوز الحد لأعمق فروعها
+        self.other.parent = Category.objects.get(slug=f'level-{Category.MAX_DEPTH - 2}')
+        self.other.save()
+        self.root.parent = self.other
+        with self.assertRaises(ValidationError):
+            self.root.save()
+
+    def test_category_tree_query_count(self):
+        """شجرة الفئات مع عدد المنتجات تُجلب بعدد ثابت من الاستعلامات"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        user = User.objects.create_user(email='tree@example.com', username='tree', password='testpass123')
+        self.client.force_authenticate(user)
+        Product.objects.create(
+            name='هاتف', slug='phone', description='وصف', short_description='وصف',
+            price=100, sku='PH1', category=self.android, status='published'
+        )
+
+        url = reverse('category-detail', kwargs={'slug': 'devices'})
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(url)
+        self.assertEqual(response.data['children'][0]['children'][0]['product_count'], 1)
+
+        for i in range(10):
+            Category.objects.create(name=f'فرعية {i}', slug=f'sub-{i}', parent=self.android)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(url)
+
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+
+class ProductSearchTest(APITestCase):
+    """اختبارات البحث عن المنتجات"""
+
+    def setUp(self):
+        from apps.products.models import Tag
+
+        user = User.objects.create_user(email='search@example.com', username='search', password='testpass123')
+        self.client.force_authenticate(user)
+
+        category = Category.objects.create(name='أجهزة إلكترونية', slug='electronics')
+        self.tag = Tag.objects.create(name='ذكي', slug='smart')
+        self.product = Product.objects.create(
+            name='هاتف جديد', slug='phone', description='<p>وصف الهاتف</p>',
+            short_description='أحدث هاتف', price=1000, sku='SP001',
+            category=category, status='published'
+        )
+        self.product.tags.add(self.tag)
+        self.other_tag = Tag.objects.create(name='ذكي جداً', slug='very-smart')
+        self.product.tags.add(self.other_tag)
+        Product.objects.create(
+            name='مسودة هاتف', slug='draft', description='وصف', short_description='وصف',
+            price=10, sku='DR001', category=category, status='draft'
+        )
+
+    def test_search_matches_tags_without_duplicates(self):
+        """البحث بالوسم يعيد المنتج مرة واحدة ويستبعد المسودات"""
+        response = self.client.get(reverse('product_search'), {'q': 'ذكي'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['slug'] for item in response.data['results']], ['phone'])
+
+    def test_search_composes_with_filters(self):
+        """يمكن تطبيق ProductFilter على نتائج البحث"""
+        response = self.client.get(reverse('product_search'), {'q': 'هاتف', 'price_max': 500})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+    def test_postgres_search_ranks_by_name(self):
+        """البحث الكامل في PostgreSQL يرتب النتائج حسب الأوزان"""
+        from django.db import connection
+        from apps.products.search import PostgresSearchBackend
+
+        if connection.vendor != 'postgresql':
+            self.skipTest('يتطلب PostgreSQL')
+
+        backend = PostgresSearchBackend()
+        backend.rebuild()
+        results = list(backend.search(Product.objects.published(), 'هاتف'))
+        self.assertEqual(results[0], self.product)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductSuggestTest(APITestCase):
+    """اختبارات الإكمال التلقائي"""
+
+    def setUp(self):
+        from apps.products.suggest import get_suggest_index
+
+        self.index = get_suggest_index()
+        category = Category.objects.create(name='إلكترونيات', slug='electronics')
+        self.brand = Brand.objects.create(name='هواوي', slug='huawei')
+        self.product = Product.objects.create(
+            name='هاتف ذكي', slug='smart-phone', description='وصف', short_description='وصف',
+            price=1000, sku='SG001', category=category, brand=self.brand, status='published'
+        )
+        Product.objects.create(
+            name='هاتف مسودة', slug='draft-phone', description='وصف', short_description='وصف',
+            price=10, sku='SG002', category=category, status='draft'
+        )
+        self.index.rebuild()
+
+    def suggest(self, query):
+        response = self.client.get(reverse('product_suggest'), {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(item['type'], item['slug']) for item in response.data['results']]
+
+    def test_prefix_matches_names_and_word_starts(self):
+        """المطابقة ببداية الاسم أو بداية أي كلمة فيه، مع توحيد الحروف"""
+        self.assertEqual(self.suggest('ها'), [('product', 'smart-phone')])
+        self.assertEqual(self.suggest('ذك'), [('product', 'smart-phone')])
+        self.assertEqual(self.suggest('الك'), [('category', 'electronics')])
+
+    def test_suggest_does_not_query_database(self):
+        """الاقتراحات تقدم من الفهرس دون استعلامات"""
+        with self.assertNumQueries(0):
+            self.suggest('هو')
+
+    def test_index_is_updated_incrementally(self):
+        """تحديث الفهرس عند تعديل العناصر أو حذفها"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'حاسوب محمول'
+            self.product.save()
+            self.brand.delete()
+
+        self.assertEqual(self.suggest('ها'), [])
+        self.assertEqual(self.suggest('هو'), [])
+        self.assertEqual(self.suggest('حاس'), [('product', 'smart-phone')])
+
+    def test_index_outage_does_not_fail_saves(self):
+        """تعطل الفهرس يسجل فقط ولا يفشل حفظ البيانات"""
+        from unittest import mock
+
+        with mock.patch.object(self.index, 'update', side_effect=ConnectionError('down')):
+            with self.assertLogs('apps.products.signals', 'ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.product.name = 'حاسوب محمول'
+                    self.product.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'حاسوب محمول')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductFacetsTest(APITestCase):
+    """اختبارات الفلاتر الوجهية"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        from apps.products.models import Tag
+
+        cache.clear()
+        user = User.objects.create_user(email='facets@example.com', username='facets', password='testpass123')
+        self.client.force_authenticate(user)
+
+        self.phones = Category.objects.create(name='هواتف', slug='phones')
+        laptops = Category.objects.create(name='حواسيب', slug='laptops')
+        brand = Brand.objects.create(name='سامسونج', slug='samsung')
+        tag = Tag.objects.create(name='جديد', slug='new')
+        for index, (category, price, quantity) in enumerate([
+            (self.phones, 50, 5), (self.phones, 700, 0), (laptops, 3000, 2),
+        ]):
+            product = Product.objects.create(
+                name=f'منتج {index}', slug=f'facet-{index}', description='وصف', short_description='وصف',
+                price=price, quantity=quantity, sku=f'FC{index}', category=category,
+                brand=brand if category == self.phones else None, status='published'
+            )
+            product.tags.add(tag)
+
+    def test_counts_for_filtered_results(self):
+        """الأعداد محسوبة على النتائج المصفاة بعدد ثابت من الاستعلامات ومخزنة مؤقتاً"""
+        url = reverse('product-facets')
+        # استعلام إضافي لشرائح السعر دون فلتر السعر
+        with self.assertNumQueries(5):
+            response = self.client.get(url, {'price_max': 1000})
+        facets = response.data
+
+        self.assertEqual(facets['total'], 2)
+        self.assertEqual([(c['slug'], c['count']) for c in facets['categories']], [('phones', 2)])
+        self.assertEqual([(b['slug'], b['count']) for b in facets['brands']], [('samsung', 2)])
+        self.assertEqual([(t['slug'], t['count']) for t in facets['tags']], [('new', 2)])
+        self.assertEqual([r['count'] for r in facets['price_ranges']], [1, 0, 1, 1, 0])
+        self.assertEqual(facets['in_stock'], 1)
+
+        with self.assertNumQueries(0):
+            self.client.get(url, {'price_max': '1000.0', 'price_min': ''})
+
+    def test_cache_invalidated_on_product_change(self):
+        """تعديل منتج يبطل الأعداد المخزنة"""
+        url = reverse('product-facets')
+        self.assertEqual(self.client.get(url).data['total'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(slug='facet-0').get().delete()
+
+        self.assertEqual(self.client.get(url).data['total'], 2)
+
+    def test_facets_ignore_their_own_filter(self):
+        """اختيار فئة يبقي بدائلها بأعدادها، وبقية الوجوه تحسب على الفئة المختارة"""
+        response = self.client.get(reverse('product-facets'), {'category': self.phones.pk, 'in_stock': 'true'})
+        facets = response.data
+
+        self.assertEqual(facets['total'], 1)
+        self.assertEqual([(c['slug'], c['count']) for c in facets['categories']], [('laptops', 1), ('phones', 1)])
+        self.assertEqual([(b['slug'], b['count']) for b in facets['brands']], [('samsung', 1)])
+        self.assertEqual(facets['in_stock'], 1)
+        self.assertEqual([r['count'] for r in facets['price_ranges']], [1, 0, 0, 0, 0])
+
+        facets = self.client.get(reverse('product-facets'), {'category': self.phones.pk}).data
+        self.assertEqual(facets['in_stock'], 1)
+        self.assertEqual([r['count'] for r in facets['price_ranges']], [1, 0, 1, 0, 0])
+
+    def test_cache_invalidated_when_stock_runs_out(self):
+        """حجز آخر قطعة من منتج يبطل وجه التوفر رغم أن التحديث لا يرسل post_save"""
+        from apps.products.inventory import reserve_stock
+
+        url = reverse('product-facets')
+        self.assertEqual(self.client.get(url).data['in_stock'], 2)
+
+        laptop = Product.objects.get(slug='facet-2')
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock(Product, {laptop.pk: 1})
+        self.assertEqual(self.client.get(url).data['in_stock'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock(Product, {laptop.pk: 1})
+        self.assertEqual(self.client.get(url).data['in_stock'], 1)
+
+
+class KeysetPaginationTest(APITestCase):
+    """اختبارات الترقيم بالمؤشر"""
+
+    def setUp(self):
+        user = User.objects.create_user(email='cursor@example.com', username='cursor', password='testpass123')
+        self.client.force_authenticate(user)
+
+        category = Category.objects.create(name='فئة', slug='cursor-category')
+        for index, price in enumerate([30, 10, 30, 20, 50]):
+            Product.objects.create(
+                name=f'منتج {index}', slug=f'cursor-{index}', description='وصف', short_description='وصف',
+                price=price, sku=f'CR{index}', category=category, status='published'
+            )
+        self.url = reverse('product-list')
+
+    def walk(self, params):
+        """تتبع روابط الصفحة التالية وجمع المعرفات"""
+        response = self.client.get(self.url, dict(params, cursor='', page_size=2))
+        pages = [[item['slug'] for item in response.data['results']]]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append([item['slug'] for item in response.data['results']])
+        return pages, response
+
+    def test_walks_all_pages_in_order(self):
+        """تغطية جميع النتائج دون تكرار مع كسر التعادل بالمعرف"""
+        pages, last = self.walk({'ordering': 'price'})
+        self.assertEqual(pages, [['cursor-1', 'cursor-3'], ['cursor-0', 'cursor-2'], ['cursor-4']])
+        self.assertNotIn('count', last.data)
+
+        previous = self.client.get(last.data['previous'])
+        self.assertEqual([item['slug'] for item in previous.data['results']], ['cursor-0', 'cursor-2'])
+
+        pages, _ = self.walk({})
+        self.assertEqual(sum(pages, []), [f'cursor-{index}' for index in range(4, -1, -1)])
+
+    def test_deep_page_does_not_count(self):
+        """صفحة المؤشر لا تنفذ COUNT(*) ولا OFFSET"""
+        first = self.client.get(self.url, {'cursor': '', 'page_size': 2})
+        with self.assertNumQueries(2) as queries:
+            self.client.get(first.data['next'])
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('COUNT(', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_estimated_count_and_invalid_cursor(self):
+        """العدد التقديري اختياري والمؤشر غير الصالح يعيد 404"""
+        response = self.client.get(self.url, {'cursor': '', 'count': 'estimate'})
+        self.assertEqual(response.data['count'], 5)
+
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_search_keeps_relevance_order_with_cursor(self):
+        """البحث يتجاهل المؤشر ويرقم بالصفحات كي لا يستبدل ترتيب الصلة بترتيب الحقل"""
+        from unittest import mock
+        from apps.products.search import SimpleSearchBackend
+
+        class PriceRankedBackend(SimpleSearchBackend):
+            def search(self, queryset, query):
+                return super().search(queryset, query).order_by('-price', 'pk')
+
+        url = reverse('product_search')
+        with mock.patch('apps.products.views.get_search_backend', return_value=PriceRankedBackend()):
+            response = self.client.get(url, {'q': 'منتج', 'cursor': '', 'page_size': 3})
+
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual([item['slug'] for item in response.data['results']], ['cursor-4', 'cursor-0', 'cursor-2'])